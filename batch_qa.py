@@ -0,0 +1,127 @@
+# Headless batch question answering over the persisted index, for evaluation runs and bulk FAQ generation
+# Usage: python batch_qa.py questions.txt --output answers.jsonl --model llama3.2:latest --concurrency 2
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
+from core.embeddings import active_store_dir, get_embeddings, get_index_version, list_indexed_documents
+from core.llm import get_cached_llm_chain, get_cached_retriever, stream_answer
+from core.scheduler import get_scheduler
+from utils.helpers import trace, record_span
+
+logger = logging.getLogger("batch_qa")
+
+def read_questions(path: str) -> List[dict]:
+    """One question per line, or JSONL objects with a "question" (and optional "id") field"""
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    questions = []
+    with stream:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                questions.append({"id": record.get("id", line_number), "question": record["question"]})
+            else:
+                questions.append({"id": line_number, "question": line})
+    return questions
+
+def batches(items: list, size: int) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def percentile_ms(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return round(ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] * 1000, 1)
+
+def answer_question(chain, model: str, item: dict) -> dict:
+    """Generate one answer from documents retrieved for it in the batch"""
+    timings = {"retrieve": item.pop("retrieve_seconds")}
+    documents = item.pop("documents")
+    result = {**item, "answer": None, "sources": [], "error": None}
+    try:
+        with trace("question", model=model, batch=True):
+            record_span("retrieve", timings["retrieve"])
+            tokens = get_scheduler().stream(model, lambda: stream_answer(chain, item["question"], timings, documents), timings)
+            result["answer"] = "".join(tokens)
+            record_span("queue", timings.get("queued", 0.0))
+            record_span("first_token", timings.get("first_token", 0.0))
+            record_span("generation", timings.get("total", 0.0) - timings.get("first_token", 0.0))
+        result["sources"] = list(dict.fromkeys(doc.metadata.get("doc_id", doc.metadata.get("source", "")) for doc in documents))
+    except Exception as e:
+        logger.error(f"Question {item['id']} failed: {str(e)}")
+        result["error"] = str(e)
+    result["timings"] = {key: round(value, 4) if isinstance(value, float) else value for key, value in timings.items()}
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions against the persisted index")
+    parser.add_argument("questions", help="Text file with one question per line, or JSONL with a question field ('-' for stdin)")
+    parser.add_argument("--output", default="-", help="JSONL file for answers and timings ('-' for stdout)")
+    parser.add_argument("--model", default="llama3.2:latest")
+    parser.add_argument("--concurrency", type=int, default=2, help="Answers generated at the same time")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions embedded and retrieved per batch")
+    parser.add_argument("--workspace", help="Workspace to answer from, the default one if omitted")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    store_dir = active_store_dir(args.workspace)
+    if not list_indexed_documents(store_dir):
+        parser.error(f"No documents indexed in {store_dir}, ingest some through the app first")
+    questions = read_questions(args.questions)
+    # The scheduler still caps Ollama load, raised to the requested concurrency for this process
+    get_scheduler(llm_concurrency=max(args.concurrency, 1))
+
+    index_version = get_index_version(store_dir)
+    chain = get_cached_llm_chain(args.model, store_dir, index_version)
+    retriever = get_cached_retriever(store_dir, index_version)
+    embeddings = get_embeddings()
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    start_time = time.perf_counter()
+    first_tokens, totals, failed = [], [], 0
+    with output, ThreadPoolExecutor(max_workers=max(args.concurrency, 1), thread_name_prefix="batch-qa") as pool:
+        for batch in batches(questions, args.batch_size):
+            # One embedding request and one vector search for the whole batch
+            retrieve_start = time.perf_counter()
+            texts = [item["question"] for item in batch]
+            documents = retriever.retrieve_batch(texts, embeddings.embed_queries(texts))
+            retrieve_seconds = (time.perf_counter() - retrieve_start) / len(batch)
+            for item, docs in zip(batch, documents):
+                item.update(documents=docs, retrieve_seconds=retrieve_seconds)
+
+            # map keeps input order while up to --concurrency answers generate
+            for result in pool.map(lambda item: answer_question(chain, args.model, item), batch):
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                if result["error"]:
+                    failed += 1
+                else:
+                    first_tokens.append(result["timings"].get("first_token", 0.0))
+                    totals.append(result["timings"].get("total", 0.0))
+
+    wall = time.perf_counter() - start_time
+    summary = {
+        "questions": len(questions),
+        "failed": failed,
+        "wall_seconds": round(wall, 2),
+        "questions_per_sec": round(len(questions) / max(wall, 1e-9), 2),
+        "first_token_p50_ms": percentile_ms(first_tokens, 50),
+        "first_token_p95_ms": percentile_ms(first_tokens, 95),
+        "total_p50_ms": percentile_ms(totals, 50),
+        "total_p95_ms": percentile_ms(totals, 95)
+    }
+    print(json.dumps(summary), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Embedding pipeline throughput at different batch sizes and concurrency levels
+# Run from the repository root: python -m benchmarks.bench_embedding_pipeline
+import argparse
+import json
+import time
+from langchain_core.documents import Document
+from langchain_ollama import OllamaEmbeddings
+from core.embeddings import iter_embedded_batches
+from benchmarks.fake_ollama import FakeOllamaServer
+
+def synthetic_chunks(count: int, size: int = 800) -> list:
+    """Distinct chunk-sized documents"""
+    filler = "lorem ipsum dolor sit amet consectetur adipiscing elit "
+    body = (filler * (size // len(filler) + 1))[:size]
+    return [Document(page_content=f"chunk {i} {body}", metadata={"offset": i}) for i in range(count)]
+
+def run_case(embeddings, chunks, batch_size, workers) -> dict:
+    """Embed every chunk once and measure throughput"""
+    ids = [str(i) for i in range(len(chunks))]
+    start = time.perf_counter()
+    embedded = 0
+    for batch_ids, _, vectors in iter_embedded_batches(embeddings, chunks, ids, batch_size, workers):
+        assert len(vectors) == len(batch_ids)
+        embedded += len(batch_ids)
+    elapsed = time.perf_counter() - start
+    return {
+        "batch_size": batch_size,
+        "workers": workers,
+        "chunks": embedded,
+        "seconds": round(elapsed, 4),
+        "chunks_per_sec": round(embedded / elapsed, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding pipeline throughput benchmark")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--server-parallel", type=int, default=4, help="Concurrent requests the fake server serves")
+    parser.add_argument("--request-latency", type=float, default=0.005, help="Fixed seconds per request")
+    parser.add_argument("--item-latency", type=float, default=0.001, help="Seconds per embedded text")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+    results = []
+    with FakeOllamaServer(parallel=args.server_parallel, request_latency=args.request_latency,
+                          item_latency=args.item_latency) as server:
+        embeddings = OllamaEmbeddings(model="fake-embed", base_url=server.base_url)
+        print(f"{'batch':>6} {'workers':>8} {'seconds':>9} {'chunks/sec':>11}")
+        for batch_size in args.batch_sizes:
+            for workers in args.workers:
+                result = run_case(embeddings, chunks, batch_size, workers)
+                results.append(result)
+                print(f"{batch_size:>6} {workers:>8} {result['seconds']:>9.3f} {result['chunks_per_sec']:>11.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "embedding_pipeline", "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+# End-to-end RAG benchmarks against the fake Ollama server: ingestion, chunking, indexing, retrieval, questions
+# Run from the repository root: python -m benchmarks.bench_rag --output results.json [--baseline previous.json]
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fake_ollama import FakeOllamaServer
+
+# Everything the app persists goes to a scratch directory, and Ollama calls go to the fake server.
+# This has to happen before any core module reads its configuration
+WORK_DIR = tempfile.mkdtemp(prefix="chatdoc-bench-")
+os.environ["CHATDOC_EMBEDDING_CACHE_PATH"] = os.path.join(WORK_DIR, "embedding_cache", "embeddings.sqlite3")
+os.environ["CHATDOC_LEXICAL_INDEX_DIR"] = os.path.join(WORK_DIR, "lexical_index")
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from core.cache import text_hash
+from core.embeddings import EMBEDDING_MODEL, chunk_id, chunk_signature, group_by_document, index_documents, index_lexical
+from core.chunking import autotune_chunking
+from core.context import count_tokens
+from core.ingest import CHUNKING_STRATEGIES, TEXT_FORMATS, TOKEN_STRATEGIES, get_text_splitter, group_semantic_chunks, load_and_split, split_documents
+from core.lexical import BM25Index
+from core.llm import get_llm_chain, stream_answer
+from core.rerank import get_reranker
+from core.resources import get_embedder
+from core.retrieval import HybridRetriever
+from core.scheduler import get_scheduler
+from utils.helpers import get_file_extension
+
+SAMPLE_DIR = "data/sample_docs"
+LLM_MODEL = "llama3.2:latest"
+QUESTIONS = [
+    "What does the document say about population change?",
+    "Summarize the main results section",
+    "Which district has the largest area?",
+    "What method was used for the analysis?",
+    "What is the average value in the report?",
+]
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+def latency_summary(seconds: list) -> dict:
+    """p50/p95/mean in milliseconds"""
+    return {
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 3) if seconds else 0.0,
+        "runs": len(seconds)
+    }
+
+def sample_files() -> list:
+    return sorted(os.path.join(SAMPLE_DIR, name) for name in os.listdir(SAMPLE_DIR))
+
+def seed_text() -> str:
+    """Plain text of the sample docs, used to grow synthetic corpora"""
+    parts = []
+    for path in sample_files():
+        if get_file_extension(path) in ('.md', '.txt', '.csv'):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                parts.append(f.read())
+    return "\n\n".join(parts) or "lorem ipsum dolor sit amet " * 200
+
+def synthetic_corpus(chunk_count: int, seed: str, chunk_chars: int = 800) -> list:
+    """Chunk-sized documents cut from the sample text, each one distinct"""
+    rng = random.Random(chunk_count)
+    words = seed.split()
+    per_chunk = max(chunk_chars // 6, 1)
+    documents = []
+    for i in range(chunk_count):
+        start = rng.randrange(max(len(words) - per_chunk, 1))
+        doc_id = f"synthetic-{i // 50}.txt"
+        body = " ".join(words[start:start + per_chunk])
+        documents.append(Document(
+            page_content=f"Section {i} of {doc_id}. {body}",
+            metadata={"doc_id": doc_id, "source": doc_id, "source_hash": text_hash(doc_id)}
+        ))
+    return documents
+
+def bench_ingestion(repeats: int) -> list:
+    """Each loader on the sample documents, with the default recursive splitter"""
+    from core.spatial import SpatialLayer, feature_documents
+    from core.tabular import summarize_dataframe
+    import geopandas as gpd
+    import pandas as pd
+
+    params = {"chunk_size": 1000, "chunk_overlap": 200}
+    results = []
+    for path in sample_files():
+        ext = get_file_extension(path)
+        metadata = {"doc_id": os.path.basename(path), "source_hash": text_hash(path)}
+        timings = []
+        try:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                if ext in TEXT_FORMATS:
+                    chunks, _ = load_and_split((path, ext, (0, 10_000) if ext == '.pdf' else None, metadata, "recursive", params))
+                elif ext == '.csv':
+                    chunks = summarize_dataframe(pd.read_csv(path), metadata)
+                elif ext == '.json':
+                    chunks = summarize_dataframe(pd.read_json(path), metadata)
+                elif ext == '.geojson':
+                    chunks = feature_documents(SpatialLayer(gpd.read_file(path)), metadata)
+                else:
+                    break
+                timings.append(time.perf_counter() - start)
+        except Exception as e:
+            results.append({"file": os.path.basename(path), "error": f"{type(e).__name__}: {e}"[:200]})
+            continue
+        if timings:
+            results.append({"file": os.path.basename(path), "chunks": len(chunks), **latency_summary(timings)})
+    return results
+
+def bench_chunking(seed: str, scales: list) -> list:
+    """Every chunking strategy over growing text"""
+    results = []
+    for scale in scales:
+        document = Document(page_content="\n\n".join([seed] * scale), metadata={})
+        for strategy in CHUNKING_STRATEGIES:
+            # Token strategies get the token equivalent of 1000/200 characters
+            params = {"chunk_size": 256, "chunk_overlap": 48} if strategy in TOKEN_STRATEGIES else {"chunk_size": 1000, "chunk_overlap": 200}
+            case = {"strategy": strategy, "chars": len(document.page_content)}
+            try:
+                start = time.perf_counter()
+                if strategy == "auto":
+                    params, _ = autotune_chunking([document], get_embedder(EMBEDDING_MODEL))
+                    case.update(params)
+                chunks = split_documents(get_text_splitter(strategy, params), [document])
+                if strategy == "semantic":
+                    chunks = group_semantic_chunks(chunks, params)
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                results.append({**case, "error": f"{type(e).__name__}: {e}"[:200]})
+                continue
+            results.append({
+                **case,
+                "chunks": len(chunks),
+                "avg_chunk_chars": sum(len(c.page_content) for c in chunks) // max(len(chunks), 1),
+                "max_chunk_tokens": max((count_tokens(c.page_content) for c in chunks), default=0),
+                "seconds": round(elapsed, 4),
+                "mb_per_sec": round(len(document.page_content) / 1e6 / max(elapsed, 1e-9), 2)
+            })
+    return results
+
+def build_store(size: int, documents: list) -> tuple:
+    """Chroma store and BM25 index holding one synthetic corpus"""
+    persist_directory = os.path.join(WORK_DIR, f"store_{size}")
+    os.makedirs(persist_directory, exist_ok=True)
+    store = Chroma(
+        collection_name=f"bench_{size}",
+        embedding_function=get_embedder(EMBEDDING_MODEL),
+        client=chromadb.PersistentClient(path=persist_directory)
+    )
+    start = time.perf_counter()
+    index_documents(store, documents, persist_directory)
+    embed_seconds = time.perf_counter() - start
+
+    lexical = BM25Index(directory=os.path.join(WORK_DIR, f"lexical_{size}"))
+    start = time.perf_counter()
+    for doc_id, chunks in group_by_document(documents).items():
+        ids = [chunk_id(doc_id, chunks[0].metadata["source_hash"], offset) for offset in range(len(chunks))]
+        lexical.add_document(doc_id, chunk_signature(chunks), ids, chunks)
+    lexical_seconds = time.perf_counter() - start
+    indexing = {
+        "chunks": len(documents),
+        "embed_seconds": round(embed_seconds, 3),
+        "chunks_per_sec": round(len(documents) / max(embed_seconds, 1e-9), 1),
+        "lexical_seconds": round(lexical_seconds, 3)
+    }
+    return store, lexical, indexing
+
+def bench_retrieval(store, lexical, size: int, repeats: int) -> list:
+    """Vector, BM25 and hybrid (+ rerank) latency on one corpus"""
+    retrievers = {
+        "vector": lambda q: store.similarity_search(q, k=3),
+        "lexical": lambda q: lexical.search(q, 3),
+        "hybrid": HybridRetriever(vector_store=store, lexical_index=lexical, k=3, candidate_k=10).invoke,
+        "hybrid_rerank": HybridRetriever(vector_store=store, lexical_index=lexical, k=3, candidate_k=50,
+                                         reranker=get_reranker()).invoke,
+    }
+    results = []
+    for name, retrieve in retrievers.items():
+        retrieve(QUESTIONS[0])  # warm-up
+        timings = []
+        for _ in range(repeats):
+            for question in QUESTIONS:
+                start = time.perf_counter()
+                retrieve(question)
+                timings.append(time.perf_counter() - start)
+        results.append({"corpus_chunks": size, "retriever": name, **latency_summary(timings)})
+    return results
+
+def bench_questions(store, documents: list, repeats: int) -> list:
+    """Full question latency through the chain, scheduler and fake LLM"""
+    index_lexical(documents)
+    chain = get_llm_chain(store, LLM_MODEL)
+    first_tokens, totals, prompt_tokens = [], [], []
+    for _ in range(repeats):
+        for question in QUESTIONS:
+            timings = {}
+            start = time.perf_counter()
+            for _ in get_scheduler().stream(LLM_MODEL, lambda: stream_answer(chain, question, timings), timings):
+                if "client_first_token" not in timings:
+                    timings["client_first_token"] = time.perf_counter() - start
+            totals.append(time.perf_counter() - start)
+            first_tokens.append(timings["client_first_token"])
+            prompt_tokens.append(timings.get("prompt_tokens", 0))
+    return [
+        {"metric": "first_token", **latency_summary(first_tokens)},
+        {"metric": "total", **latency_summary(totals)},
+        {"metric": "prompt_tokens", "mean": round(sum(prompt_tokens) / len(prompt_tokens), 1)},
+    ]
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+def flatten(results: dict) -> dict:
+    """suite/case/metric -> value, for comparing two runs"""
+    keys = ("file", "strategy", "chars", "corpus_chunks", "retriever", "chunks", "metric")
+    flat = {}
+    for suite, cases in results.items():
+        for case in cases:
+            label = "/".join(str(case[k]) for k in keys if k in case and not isinstance(case[k], float))
+            for metric, value in case.items():
+                if metric not in keys and isinstance(value, (int, float)) and metric != "runs":
+                    flat[f"{suite}/{label}/{metric}"] = value
+    return flat
+
+def compare(current: dict, baseline: dict, threshold: float):
+    """Print metrics that moved more than threshold (a fraction) against the baseline run"""
+    before, after = flatten(baseline["results"]), flatten(current["results"])
+    print(f"\nChanges vs {baseline.get('commit', 'baseline')} (more than {threshold:.0%}):")
+    changed = 0
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        if old and abs(new - old) / abs(old) > threshold:
+            changed += 1
+            print(f"  {key}: {old} -> {new} ({(new - old) / abs(old):+.0%})")
+    if not changed:
+        print("  none")
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end RAG benchmark suite")
+    parser.add_argument("--suites", nargs="+", default=["ingestion", "chunking", "indexing", "retrieval", "questions"])
+    parser.add_argument("--corpus-sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--chunking-scales", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=1024, help="Fake embedding dimension")
+    parser.add_argument("--server-parallel", type=int, default=4)
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Fake seconds per generated token")
+    parser.add_argument("--prefill-latency", type=float, default=0.0002, help="Fake seconds per prompt token")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported by --baseline")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    results = {}
+    seed = seed_text()
+    with FakeOllamaServer(dim=args.dim, parallel=args.server_parallel, request_latency=0.002, item_latency=0.0002,
+                          token_latency=args.token_latency, prefill_latency=args.prefill_latency) as server:
+        os.environ["OLLAMA_HOST"] = server.base_url
+        if "ingestion" in args.suites:
+            results["ingestion"] = bench_ingestion(args.repeats)
+        if "chunking" in args.suites:
+            results["chunking"] = bench_chunking(seed, args.chunking_scales)
+        if {"indexing", "retrieval", "questions"} & set(args.suites):
+            for suite in ("indexing", "retrieval", "questions"):
+                results[suite] = []
+            for size in args.corpus_sizes:
+                documents = synthetic_corpus(size, seed)
+                store, lexical, indexing = build_store(size, documents)
+                results["indexing"].append({"corpus_chunks": size, **indexing})
+                if "retrieval" in args.suites:
+                    results["retrieval"].extend(bench_retrieval(store, lexical, size, args.repeats))
+                if "questions" in args.suites and size == args.corpus_sizes[0]:
+                    results["questions"] = bench_questions(store, documents, args.repeats)
+            results = {suite: cases for suite, cases in results.items() if suite in args.suites}
+
+    report = {
+        "benchmark": "rag",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": vars(args),
+        "results": results
+    }
+    for suite, cases in results.items():
+        print(f"\n[{suite}]")
+        for case in cases:
+            print("  " + ", ".join(f"{k}={v}" for k, v in case.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f), args.threshold)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Recall, latency and memory of the NumPy vector store variants against Chroma
+# Run from the repository root: python -m benchmarks.bench_vector_store
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import chromadb
+import core.vectorstore as vectorstore
+from core.vectorstore import NumpyVectorStore, normalize
+from utils.helpers import get_rss_mb
+
+class NoEmbeddings:
+    """Vectors are inserted precomputed, nothing should embed"""
+
+    def embed_documents(self, texts):
+        raise RuntimeError("benchmark inserts precomputed vectors")
+
+    def embed_query(self, text):
+        raise RuntimeError("benchmark queries with precomputed vectors")
+
+def latency_summary(seconds: list) -> dict:
+    """p50/p95/mean in milliseconds"""
+    return {
+        "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(seconds, 95)) * 1000, 3),
+        "mean_ms": round(float(np.mean(seconds)) * 1000, 3)
+    }
+
+def clustered_vectors(count: int, dim: int, clusters: int, rng) -> np.ndarray:
+    """Unit vectors around random topic centres, closer to real embeddings than pure noise"""
+    centres = rng.standard_normal((clusters, dim))
+    return normalize(centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)))
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def recall_at_k(truth: np.ndarray, results: list) -> float:
+    return float(np.mean([len(set(expected) & set(found)) / len(expected) for expected, found in zip(truth, results)]))
+
+def bench_chroma(vectors, ids, queries, k, work_dir, batch_size=5000) -> tuple:
+    rss = get_rss_mb()
+    client = chromadb.PersistentClient(path=work_dir)
+    collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+    start = time.perf_counter()
+    for offset in range(0, len(ids), batch_size):
+        collection.add(ids=ids[offset:offset + batch_size], embeddings=vectors[offset:offset + batch_size],
+                       documents=ids[offset:offset + batch_size])
+    build_seconds = time.perf_counter() - start
+
+    def search(query_batch):
+        return [[int(i) for i in row] for row in collection.query(query_embeddings=query_batch, n_results=k)["ids"]]
+    return search, build_seconds, get_rss_mb() - rss
+
+def bench_numpy(vectors, ids, queries, k, work_dir, dtype, batch_size=5000) -> tuple:
+    rss = get_rss_mb()
+    store = NumpyVectorStore(work_dir, NoEmbeddings(), dtype)
+    start = time.perf_counter()
+    for offset in range(0, len(ids), batch_size):
+        batch = ids[offset:offset + batch_size]
+        store.upsert(batch, vectors[offset:offset + batch_size], [{} for _ in batch], batch)
+    # Reopened so searches run against the memory map, as after a restart
+    store = NumpyVectorStore(work_dir, NoEmbeddings())
+    store.search_vectors(queries[:1], k)  # trains the IVF lists when enabled
+    build_seconds = time.perf_counter() - start
+
+    def search(query_batch):
+        return [[row for row, _ in hits] for hits in store.search_vectors(query_batch, k)]
+    return search, build_seconds, get_rss_mb() - rss
+
+def run_case(name, factory, vectors, queries, truth, k, batch, work_dir) -> dict:
+    ids = [str(i) for i in range(len(vectors))]
+    search, build_seconds, rss_delta = factory(vectors, ids, queries, k, work_dir)
+    search(queries[:1])  # warm-up
+    single, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.extend(search(query[None, :]))
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for offset in range(0, len(queries), batch):
+        search(queries[offset:offset + batch])
+    batched_seconds = time.perf_counter() - start
+    return {
+        "backend": name,
+        "corpus": len(vectors),
+        "build_seconds": round(build_seconds, 3),
+        **latency_summary(single),
+        "batched_qps": round(len(queries) / max(batched_seconds, 1e-9), 1),
+        f"recall_at_{k}": round(recall_at_k(truth, results), 4),
+        "disk_mb": round(directory_bytes(work_dir) / (1024 * 1024), 2),
+        "rss_delta_mb": round(rss_delta, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy vector store vs Chroma benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--dim", type=int, default=1024, help="mxbai-embed-large produces 1024 dimensions")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=32, help="Queries per batched search")
+    parser.add_argument("--backends", nargs="+", default=["chroma", "float16", "int8", "int8-mmap", "int8-ivf"],
+                        help="chroma, or float16/int8 with -mmap (no float32 copy in RAM) and/or -ivf suffixes")
+    parser.add_argument("--ivf-min-rows", type=int, default=20000, help="Corpus size from which *-ivf backends use IVF")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dense_cache_mb = vectorstore.DENSE_CACHE_MB
+    results = []
+    print(f"{'backend':>12} {'corpus':>8} {'build s':>8} {'p50 ms':>8} {'p95 ms':>8} {'batch qps':>10} {'recall':>7} {'disk MB':>8} {'rss MB':>7}")
+    for size in args.sizes:
+        vectors = clustered_vectors(size, args.dim, max(size // 500, 10), rng)
+        # Queries near existing chunks, like questions about something the corpus covers
+        noise = rng.standard_normal((args.queries, args.dim)) / np.sqrt(args.dim)
+        queries = normalize(vectors[rng.integers(0, size, args.queries)] + 0.5 * noise)
+        truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+        for name in args.backends:
+            dtype, *options = name.split("-")
+            vectorstore.IVF_MIN_ROWS = args.ivf_min_rows if "ivf" in options else 0
+            vectorstore.DENSE_CACHE_MB = 0 if "mmap" in options else dense_cache_mb
+            factory = bench_chroma if dtype == "chroma" else (lambda *a, dtype=dtype: bench_numpy(*a, dtype=dtype))
+            with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as work_dir:
+                result = run_case(name, factory, vectors, queries, truth, args.k, args.batch, work_dir)
+            results.append(result)
+            print(f"{name:>12} {size:>8} {result['build_seconds']:>8.2f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                  f"{result['batched_qps']:>10.1f} {result[f'recall_at_{args.k}']:>7.3f} {result['disk_mb']:>8.1f} {result['rss_delta_mb']:>7.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"benchmark": "vector_store", "config": vars(args), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# Deterministic local stand-in for the Ollama HTTP API used by the benchmarks
+import json
+import time
+import hashlib
+import threading
+import logging
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+WORDS = ("the document describes data results section value model analysis report shows table area "
+         "district population change method source figure summary total average increase").split()
+
+def fake_tokens(text: str) -> list:
+    """Stable token ids, roughly one per four characters like a real tokenizer"""
+    words = text.split()
+    ids = []
+    for word in words:
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        ids.extend(int.from_bytes(digest[i:i + 2], "little") for i in range(0, 2 * max(1, len(word) // 4), 2))
+    return ids
+
+def fake_answer(prompt: str, tokens: int) -> list:
+    """Deterministic answer pieces derived from the prompt hash"""
+    seed = hashlib.sha256(prompt.encode("utf-8")).digest()
+    return [WORDS[seed[i % len(seed)] % len(WORDS)] + " " for i in range(tokens)]
+
+def fake_embedding(text: str, dim: int = 1024) -> list:
+    """Deterministic pseudo-embedding derived from the text hash"""
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    # Stretch the digest to dim bytes and centre the values around zero
+    raw = (seed * (dim // len(seed) + 1))[:dim]
+    return [(b - 127.5) / 127.5 for b in array("B", raw)]
+
+class FakeOllamaServer:
+    """Threaded HTTP server answering the embed, generate, chat, tags and ps endpoints like Ollama"""
+
+    def __init__(self, host="127.0.0.1", port=0, dim=1024, request_latency=0.005,
+                 item_latency=0.002, parallel=1, prefill_latency=0.0002, token_latency=0.002,
+                 answer_tokens=48, load_latency=0.2, models=("llama3.2:latest", "mxbai-embed-large:latest")):
+        self.dim = dim
+        self.request_latency = request_latency
+        self.item_latency = item_latency
+        self.prefill_latency = prefill_latency  # seconds per prompt token not served from the KV cache
+        self.token_latency = token_latency  # seconds per generated token
+        self.answer_tokens = answer_tokens
+        self.load_latency = load_latency  # first request per model, until keep_alive=0 unloads it
+        self.models = list(models)
+        self.loaded = set()
+        # Last context per model, stands in for the server's KV cache
+        self.kv_cache = {}
+        # Ollama only runs a few requests per model at once (OLLAMA_NUM_PARALLEL)
+        self.slots = threading.Semaphore(parallel)
+        self.requests = 0
+        self.items = 0
+        self._stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _simulate(self, items: int):
+        with self.slots:
+            time.sleep(self.request_latency + self.item_latency * items)
+        with self._stats_lock:
+            self.requests += 1
+            self.items += items
+
+    def _load(self, model: str, keep_alive) -> float:
+        """Seconds spent loading the model for this request"""
+        with self._stats_lock:
+            cold = model not in self.loaded
+            self.loaded.add(model)
+            if keep_alive in (0, "0", "0s"):
+                self.loaded.discard(model)
+        if cold:
+            time.sleep(self.load_latency)
+            return self.load_latency
+        return 0.0
+
+    def _prefill(self, model: str, context: list, prompt_ids: list) -> int:
+        """Simulate prompt evaluation, returning how many tokens had to be evaluated"""
+        with self._stats_lock:
+            cached = self.kv_cache.get(model, [])
+        reused = context if context and cached[:len(context)] == context else []
+        evaluated = len(context) - len(reused) + len(prompt_ids)
+        with self.slots:
+            time.sleep(self.request_latency + self.prefill_latency * evaluated)
+        with self._stats_lock:
+            self.requests += 1
+        return evaluated
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    inputs = request.get("input", [])
+                    if isinstance(inputs, str):
+                        inputs = [inputs]
+                    server._simulate(len(inputs))
+                    self._reply(200, {
+                        "model": request.get("model"),
+                        "embeddings": [fake_embedding(text, server.dim) for text in inputs]
+                    })
+                elif self.path == "/api/embeddings":
+                    server._simulate(1)
+                    self._reply(200, {"embedding": fake_embedding(request.get("prompt", ""), server.dim)})
+                elif self.path == "/api/generate":
+                    self._generate(request, request.get("prompt", ""), chat=False)
+                elif self.path == "/api/chat":
+                    prompt = "\n".join(m.get("content", "") for m in request.get("messages", []))
+                    self._generate(request, prompt, chat=True)
+                else:
+                    self._reply(404, {"error": f"unknown endpoint {self.path}"})
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._reply(200, {"models": [
+                        {"name": name, "model": name, "modified_at": "2024-01-01T00:00:00Z", "size": 0, "digest": name}
+                        for name in server.models
+                    ]})
+                elif self.path == "/api/ps":
+                    self._reply(200, {"models": [
+                        {"name": name, "model": name, "size": 0, "digest": name, "expires_at": "2100-01-01T00:00:00Z"}
+                        for name in sorted(server.loaded)
+                    ]})
+                else:
+                    self._reply(404, {"error": f"unknown endpoint {self.path}"})
+
+            def _generate(self, request, prompt, chat):
+                model = request.get("model", "")
+                load = server._load(model, request.get("keep_alive"))
+                context = list(request.get("context") or [])
+                prompt_ids = fake_tokens((request.get("system") or "") + prompt)
+                prefill_start = time.perf_counter()
+                evaluated = server._prefill(model, context, prompt_ids)
+                prefill = time.perf_counter() - prefill_start
+                pieces = fake_answer(prompt, server.answer_tokens) if prompt or chat else []
+                final_context = context + prompt_ids + fake_tokens("".join(pieces))
+                with server._stats_lock:
+                    server.kv_cache[model] = final_context
+
+                def part(text, done):
+                    payload = {"model": model, "created_at": "2024-01-01T00:00:00Z", "done": done}
+                    if chat:
+                        payload["message"] = {"role": "assistant", "content": text}
+                    else:
+                        payload["response"] = text
+                    if done:
+                        payload.update({
+                            "done_reason": "stop",
+                            "total_duration": int((load + prefill + server.token_latency * len(pieces)) * 1e9),
+                            "load_duration": int(load * 1e9),
+                            "prompt_eval_count": evaluated,
+                            "prompt_eval_duration": int(prefill * 1e9),
+                            "eval_count": len(pieces),
+                            "eval_duration": int(server.token_latency * len(pieces) * 1e9)
+                        })
+                        if not chat:
+                            payload["context"] = final_context
+                    return payload
+
+                if not request.get("stream", True):
+                    time.sleep(server.token_latency * len(pieces))
+                    final = part("".join(pieces), True)
+                    self._reply(200, final)
+                    return
+                # NDJSON stream, the connection closes when the last line is written (HTTP/1.0)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for piece in pieces:
+                    time.sleep(server.token_latency)
+                    self.wfile.write(json.dumps(part(piece, False)).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+                self.wfile.write(json.dumps(part("", True)).encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Ollama server listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -2,18 +2,42 @@
 import streamlit as st
 from typing import Optional, List, Dict
 from langchain_core.documents import Document
-from core.llm import get_llm_chain
-from core.embeddings import get_vector_store
+from core.llm import get_cached_llm_chain, get_cached_retriever, stream_answer
+from core.conversation import Conversation
+from core.scheduler import get_scheduler
+from core.models import get_model_manager
+from utils.helpers import trace, span, record_span
+from core.embeddings import active_store_dir, get_index_version, get_embeddings
+from core.cache import get_answer_cache, text_hash
+from core.tabular import answer_tabular_question
+from core.workspaces import get_session_data
+from core.spatial import get_spatial_layer, answer_spatial_question
 import nltk
 from nltk.corpus import stopwords
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
+from wordcloud import WordCloud, STOPWORDS
 import folium
-from streamlit_folium import folium_static
-import geopandas as gpd
-from io import StringIO
+import streamlit.components.v1 as components
+from io import BytesIO
+import hashlib
 import random
+import itertools
 import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+WORDCLOUD_MAX_CHARS = 2_000_000
+CHUNKS_PER_PAGE = 20
+
+def bounded_texts(documents: List[Document], max_chars: int):
+    """Chunk texts until max_chars characters have been produced"""
+    remaining = max_chars
+    for doc in documents:
+        if remaining <= 0:
+            return
+        text = doc.page_content[:remaining]
+        remaining -= len(text)
+        yield text
 
 def initialize_chat_session():
     """Initialize chat session state"""
@@ -22,6 +46,140 @@ def initialize_chat_session():
     if "user_name" not in st.session_state:
         st.session_state.user_name = ""
 
+def session_dataframes(documents: List[Document]) -> list:
+    """DataFrames kept in session state for the given documents, one per source"""
+    # Spilled frames are loaded back from disk on access
+    data = get_session_data(st.session_state)
+    sources = dict.fromkeys(doc.metadata.get('source', '') for doc in documents)
+    return [frame for frame in (data.get(f"dataframe:{source}") for source in sources) if frame is not None]
+
+def session_spatial_layer(documents: List[Document]):
+    """Cached spatial layer of the session's GeoJSON, only while it is among the given documents"""
+    source = st.session_state.get('geojson_source')
+    if source is None or not any(doc.metadata.get('source') == source for doc in documents):
+        return None
+    geojson_str = get_session_data(st.session_state).get('geojson_str')
+    if geojson_str is None:
+        return None
+    content_hash = st.session_state.get('geojson_hash') or hashlib.sha256(geojson_str.encode('utf-8')).hexdigest()
+    return get_spatial_layer(content_hash, geojson_str)
+
+def documents_key(documents: List[Document]) -> str:
+    """Cheap identity of a document set: sources, chunk count and the first and last chunk"""
+    digest = hashlib.sha256()
+    for source in sorted({(str(doc.metadata.get('doc_id', doc.metadata.get('source', ''))),
+                           str(doc.metadata.get('source_hash', ''))) for doc in documents}):
+        digest.update("\0".join(source).encode("utf-8"))
+    digest.update(f"{len(documents)}:{text_hash(documents[0].page_content)}:{text_hash(documents[-1].page_content)}".encode("utf-8"))
+    return digest.hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def get_stopwords() -> frozenset:
+    """English stopwords plus URL noise, downloaded once per process"""
+    # Download stopwords if not already downloaded
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('stopwords')
+    try:
+        stop_words = set(stopwords.words('english'))
+    except LookupError:
+        # Offline and never downloaded, the word cloud's built-in list is close enough
+        logger.warning("NLTK stopwords unavailable, using the word cloud defaults")
+        stop_words = set(STOPWORDS)
+    my_stopwords = [" ","https", "cdn", "None", "1280x720", "services", "http" "www", "www.", "com", "org", "net", "int", "gov", "edu", "mil", "biz", "info", "name", "pro", "aero", "co", "STS"]
+    stop_words.update(my_stopwords)
+    return frozenset(stop_words)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def render_wordcloud(content_key: str, _documents: List[Document]) -> Optional[bytes]:
+    """Word cloud PNG for a document set, generated once per content key"""
+    # Combine document chunks, capped so huge documents don't build one giant string
+    text = " ".join(bounded_texts(_documents, WORDCLOUD_MAX_CHARS))
+    try:
+        wordcloud = WordCloud(width=800,
+                            height=540,
+                            background_color='white',
+                            stopwords=set(get_stopwords())).generate(text)
+    except ValueError:
+        # Nothing left after removing stopwords
+        return None
+    buffer = BytesIO()
+    wordcloud.to_image().save(buffer, format="PNG")
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def render_map_html(content_hash: str, _layer) -> str:
+    """Folium map HTML for a spatial layer, built once per GeoJSON content hash"""
+    non_geometry_cols = _layer.property_columns
+    # Compute bounding box
+    minx, miny, maxx, maxy = _layer.gdf.total_bounds
+    # Generate Folium map
+    m = folium.Map(location=[(miny + maxy) / 2, (minx + maxx) / 2], zoom_start=8)
+    m.fit_bounds([[miny, minx], [maxy, maxx]])  # Set map bounds to match GeoDataFrame
+    # Add the cached, simplified GeoJSON layer (already WGS 84) with hover functionality
+    folium.GeoJson(
+        data=_layer.map_json(),
+        style_function=lambda x: {
+            'fillColor': '#ffaf00',
+            'color': '#000000',
+            'weight': 1,
+            'fillOpacity': 0.5
+        },
+        tooltip=folium.GeoJsonTooltip(
+            fields=non_geometry_cols[:5],  # Show first 5 properties on hover
+            aliases=non_geometry_cols[:5],
+            style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;")
+        )
+    ).add_to(m)
+    return m.get_root().render()
+
+@st.fragment
+def display_document_viewer(documents: List[Document]):
+    """Document pane; paging through chunks reruns only this fragment"""
+    content_key = documents_key(documents)
+    tabs = st.tabs(["Content 📄", "𝒲ord Cloud 🔠", "Data View 📊", "Map View 🌎"])
+
+    # Content Tab, one page of chunk tabs at a time instead of one tab per chunk
+    with tabs[0]:
+        pages = (len(documents) + CHUNKS_PER_PAGE - 1) // CHUNKS_PER_PAGE
+        page = 1
+        if pages > 1:
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1,
+                                   key=f"chunk_page_{content_key[:12]}")
+        start = (page - 1) * CHUNKS_PER_PAGE
+        page_documents = documents[start:start + CHUNKS_PER_PAGE]
+        chunk_tabs = st.tabs([f"Chunk {start + i + 1}" for i in range(len(page_documents))])
+        for tab, doc in zip(chunk_tabs, page_documents):
+            with tab:
+                st.text(doc.page_content)
+
+    # Word Cloud Tab
+    with tabs[1]:
+        image = render_wordcloud(content_key, documents)
+        if image:
+            st.image(image)
+        else:
+            st.info("Not enough text for a word cloud")
+
+    # Data View Tab
+    with tabs[2]:
+        frames = session_dataframes(documents)
+        if frames:
+            for df in frames:
+                st.dataframe(df)
+        else:
+            st.info("No tabular data available")
+
+    # Map View Tab
+    with tabs[3]:
+        layer = session_spatial_layer(documents)
+        if layer is not None:
+            # Rendered once per GeoJSON, later reruns only re-send the cached HTML
+            components.html(render_map_html(st.session_state.get('geojson_hash', content_key), layer), height=510)
+        else:
+            st.info("No geographic data found in the document")
+
 def display_chat_interface(documents: Optional[List[Document]] = None):
     """Display chat interface and handle interactions"""
     initialize_chat_session()
@@ -35,88 +193,7 @@ def display_chat_interface(documents: Optional[List[Document]] = None):
         doc_container = st.container(height=600)
         with doc_container:
             if documents:
-                tabs = st.tabs(["Content 📄", "𝒲ord Cloud 🔠", "Data View 📊", "Map View 🌎"])
-
-                # Content Tab
-                with tabs[0]:
-                    chunk_tabs = st.tabs(
-                        [f"Chunk {i+1}" for i in range(len(documents))])
-                    for i, tab in enumerate(chunk_tabs):
-                        with tab:
-                            st.text(documents[i].page_content)
-
-                # Word Cloud Tab
-                with tabs[1]:
-                    # Download stopwords if not already downloaded
-                    try:
-                        nltk.data.find('corpora/stopwords')
-                    except LookupError:
-                        nltk.download('stopwords')
-
-                    # Combine all document chunks
-                    text = " ".join([doc.page_content for doc in documents])
-
-                    # Removing stopwords and generating wordcloud
-                    stop_words = set(stopwords.words('english'))
-                    my_stopwords = [" ","https", "cdn", "None", "1280x720", "services", "http" "www", "www.", "com", "org", "net", "int", "gov", "edu", "mil", "biz", "info", "name", "pro", "aero", "co", "STS"]
-                    stop_words.update(my_stopwords)
-                    stop_words = set(stop_words)
-                    wordcloud = WordCloud(width=800,
-                                        height=540,
-                                        background_color='white',
-                                        stopwords=stop_words).generate(text)
-
-                    # Display wordcloud
-                    plt.figure(figsize=(10, 5))
-                    plt.imshow(wordcloud, interpolation='bilinear')
-                    plt.axis('off')
-                    st.pyplot(plt)
-
-                # Data View Tab
-                with tabs[2]:
-                    if 'dataframe' in st.session_state:
-                        for doc in documents:
-                            source = doc.metadata.get('source', '')
-                            if source in st.session_state.dataframe:
-                                st.dataframe(st.session_state.dataframe[source])
-                            else:
-                                st.info("No tabular data available for this document")
-                    else:
-                        st.info("No tabular data available")
-
-                # Map View Tab
-                with tabs[3]:
-                    if 'geojson_str' in st.session_state:
-                        geojson_str = st.session_state.geojson_str
-                        gdf = gpd.read_file(StringIO(geojson_str))
-                        non_geometry_cols = [col for col in gdf.columns if col != 'geometry']
-                        # Compute bounding box
-                        bounds = gdf.total_bounds
-                        minx, miny, maxx, maxy = bounds
-                        # Generate Folium map
-                        m = folium.Map(location=[(miny + maxy) / 2, (minx + maxx) / 2], zoom_start=8)
-                        m.fit_bounds([[miny, minx], [maxy, maxx]])  # Set map bounds to match GeoDataFrame
-                        folium.GeoJson(gdf).add_to(m)  # Ensure GeoJSON is in WGS 84
-                        # Add GeoJSON to map with hover functionality
-                        folium.GeoJson(
-                            data=gdf.to_json(),
-                            style_function=lambda x: {
-                                'fillColor': '#ffaf00',
-                                'color': '#000000',
-                                'weight': 1,
-                                'fillOpacity': 0.5
-                            },
-                            tooltip=folium.GeoJsonTooltip(
-                                fields=non_geometry_cols[:5],  # Show first 5 properties on hover
-                                aliases=non_geometry_cols[:5],
-                                style=("background-color: white; color: #333333; font-family: arial; font-size: 12px; padding: 10px;")
-                            )
-                        ).add_to(m)
-
-                        # Display the map using streamlit-folium
-                        folium_static(m, width=600, height=500)
-                    else:
-                        st.info("No geographic data found in the document")
+                display_document_viewer(documents)
             else:
                 st.info("Upload a document to see its content here")
 
@@ -128,6 +205,11 @@ def display_chat_interface(documents: Optional[List[Document]] = None):
         if not st.session_state.user_name:
             st.session_state.user_name = st.text_input("Say your name, human")
 
+        conversation_mode = st.toggle(
+            "Conversation mode",
+            help="Follow-up questions keep the earlier turns and reuse the model's prompt cache"
+        )
+
         # Container for chat messages
         chat_container = st.container(height=545)
         
@@ -157,14 +239,72 @@ def display_chat_interface(documents: Optional[List[Document]] = None):
                     if documents:
                         try:
                             think = ["I am thinking ⏳", "Shh.. magic is happening 🔮", "Thinking, wanna tea ? ☕", "To be or not to be, that's the question 🎭 or is it 🤔?", "Red pill 🔴 or Blue pill 🔵, Neo? "]
-                            with st.spinner(f":grey[{random.choice(think)}]"):
-                                # Start timer
-                                start_time = time.time()
-                                
-                                # Get existing vector store from session state or create new one
-                                vector_store = st.session_state.get('vector_store') or get_vector_store(documents)
-                                chain = get_llm_chain(vector_store)
-                                response = chain.invoke(prompt)
+                            model_name = st.session_state.get('selected_model', 'llama3.2')
+                            # Every stage of this question is recorded as a span of one trace
+                            with trace("question", model=model_name, conversation=conversation_mode):
+                                # Resolved once per question, a snapshot published meanwhile is picked up by the next one
+                                store_dir = active_store_dir(st.session_state.get('workspace'))
+                                index_version = get_index_version(store_dir)
+                                # Chain, LLM and vector store are shared, only retrieval and generation run per question
+                                chain = get_cached_llm_chain(model_name, store_dir, index_version)
+
+                                # Spatial questions use the STRtree, aggregate/filter questions about tables go straight to pandas
+                                lookup_start = time.perf_counter()
+                                layer = session_spatial_layer(documents)
+                                tabular_answer = answer_spatial_question(layer, prompt) if layer is not None else None
+                                if not tabular_answer:
+                                    for df in session_dataframes(documents):
+                                        tabular_answer = answer_tabular_question(df, prompt)
+                                        if tabular_answer:
+                                            break
+                                record_span("lookup", time.perf_counter() - lookup_start)
+
+                                # Repeated and near-duplicate questions are answered from the semantic cache
+                                answer_cache = get_answer_cache()
+                                question_vector, cached = None, None
+                                # Conversation answers depend on the earlier turns, so they bypass the cache
+                                if not tabular_answer and not conversation_mode:
+                                    try:
+                                        with span("embed_query"):
+                                            question_vector = get_embeddings().embed_query(prompt)
+                                        with span("cache_lookup"):
+                                            cached = answer_cache.lookup(model_name, index_version, question_vector, store_dir)
+                                    except Exception as e:
+                                        logger.warning(f"Answer cache lookup failed: {str(e)}")
+
+                                timings = {}
+                                placeholder = st.empty()
+                                if tabular_answer:
+                                    response = tabular_answer
+                                    timings["first_token"] = timings["total"] = time.perf_counter() - lookup_start
+                                elif cached:
+                                    response = cached[0]
+                                    timings["first_token"] = timings["total"] = time.perf_counter() - lookup_start
+                                else:
+                                    # Stream tokens as Ollama produces them, the spinner only covers retrieval and prefill
+                                    if conversation_mode:
+                                        conversation = st.session_state.get('conversation')
+                                        if conversation is None or not conversation.matches(model_name, index_version):
+                                            conversation = st.session_state['conversation'] = Conversation(model_name, index_version)
+                                        with span("retrieve"):
+                                            retrieved = get_cached_retriever(store_dir, index_version).invoke(prompt)
+                                        generate = lambda: conversation.stream(prompt, retrieved, timings)
+                                    else:
+                                        generate = lambda: stream_answer(chain, prompt, timings)
+                                    # Generation waits its (fair) turn for the model in the shared scheduler
+                                    tokens = get_scheduler().stream(model_name, generate, timings)
+                                    was_warm = get_model_manager().is_warm(model_name)
+                                    with st.spinner(f":grey[{random.choice(think)}]"):
+                                        first_token = next(tokens, "")
+                                    with placeholder.container():
+                                        response = st.write_stream(itertools.chain([first_token], tokens))
+                                    get_model_manager().record_request(model_name, was_warm, timings.get("first_token"))
+                                    record_span("queue", timings.get("queued", 0.0))
+                                    record_span("first_token", timings.get("first_token", 0.0))
+                                    record_span("generation", timings.get("total", 0.0) - timings.get("first_token", 0.0))
+                                    if question_vector is not None:
+                                        answer_cache.store(model_name, index_version, prompt, question_vector,
+                                                           response, timings.get("total", 0.0), store_dir)
 
                                 # List of quirky responses
                                 quirky_responses = [
@@ -179,27 +319,24 @@ def display_chat_interface(documents: Optional[List[Document]] = None):
 
                                 # Select a random quirky response
                                 quirky_response = f":rainbow[{response}]\n\n{random.choice(quirky_responses)}"
-                                
-                                # Calculate elapsed time
-                                elapsed_time = time.time() - start_time
-                                
+
                                 # Add timing information to the response
-                                response_with_time = f"{quirky_response} |  󠀠 󠀠󠀠󠀠󠀠󠀠:stopwatch: _{elapsed_time:.2f} sec_"
+                                response_with_time = (
+                                    f"{quirky_response} |  󠀠 󠀠󠀠󠀠󠀠󠀠:zap: _first token {timings.get('first_token', 0.0):.2f} sec_"
+                                    f" | :stopwatch: _total {timings.get('total', 0.0):.2f} sec_"
+                                    + (f" | :hourglass: _queued {timings['queued']:.2f} sec_" if timings.get("queued", 0.0) >= 0.1 else "")
+                                    + (f" | :1234: _{timings['prompt_tokens']} prompt tokens_" if "prompt_tokens" in timings else "")
+                                    + (f" | :fast_forward: _{timings['prefill_saved']:.2f} sec prefill saved_" if timings.get("cached_tokens") else "")
+                                    + (" | :recycle: _cached_" if cached else "")
+                                    + (" | :bar_chart: _from data_" if tabular_answer else "")
+                                )
+                                with span("render"):
+                                    placeholder.markdown(response_with_time, unsafe_allow_html=True)
 
-                                # response_with_time = f"{quirky_response} | 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠 󠀠󠀠󠀠󠀠󠀠 󠀠 󠀠 󠀠 󠀠(:stopwatch: _{elapsed_time:.2f} sec_)"
-                                
-                                # Typing effect
-                                placeholder = st.empty()
-                                typed_response = ""
-                                for char in response_with_time:
-                                    typed_response += char
-                                    placeholder.markdown(typed_response, unsafe_allow_html=True)
-                                    time.sleep(0.001)  # Adjust typing speed here
-
-                                st.session_state.messages.append({
-                                    "role": "assistant",
-                                    "content": response_with_time
-                                })
+                                    st.session_state.messages.append({
+                                        "role": "assistant",
+                                        "content": response_with_time
+                                    })
                         except Exception as e:
                             error_msg = f"Oops! My circuits got tangled: {str(e)}"
                             st.error(error_msg)
@@ -1,29 +1,36 @@
 # type: ignore
 import streamlit as st
-from typing import Optional, Dict, Any
+from typing import Optional, List
 import tempfile
+import shutil
 import json
 import os
-from langchain_community.document_loaders import (
-    TextLoader,
-    PyPDFLoader,
-    Docx2txtLoader,
-    UnstructuredWordDocumentLoader,
-    JSONLoader,
-    UnstructuredMarkdownLoader
-)
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-    MarkdownHeaderTextSplitter,
-    TokenTextSplitter
-)
-from langchain.schema import Document
-from utils.helpers import get_file_extension
+from utils.helpers import get_file_extension, span
 import logging
 import pandas as pd
-import geopandas as gpd
-from io import StringIO
-import chromadb
+import hashlib
+from core.ingest import (
+    CHUNKING_STRATEGIES,
+    INGEST_ROOT,
+    TEXT_FORMATS,
+    TOKEN_STRATEGIES,
+    file_sha256,
+    find_ingestible_documents
+)
+from core.embeddings import (
+    DEFAULT_WORKSPACE,
+    VECTOR_BACKEND,
+    active_store_dir,
+    get_vector_store,
+    list_indexed_documents,
+    remove_document,
+    workspace_dir
+)
+from core.jobs import STREAM_PREVIEW_CHUNKS, IngestionJob, get_ingestion_jobs
+from core.snapshot import preview_documents, served_snapshot
+from core.tabular import summarize_dataframe
+from core.spatial import get_spatial_layer, feature_documents
+from core.workspaces import WORKSPACE_MAX_CHUNKS, get_session_data, get_workspace_registry, workspace_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -38,12 +45,6 @@ SUPPORTED_FORMATS = {
     '.md': ('Markdown files', '.md')
 }
 
-CHUNKING_STRATEGIES = {
-    'recursive': 'Recursive Character (Smart)',
-    'token': 'Token-based',
-    'markdown': 'Markdown-aware'
-}
-
 def extract_json_content(data: dict) -> str:
     """Extract content from JSON data"""
     try:
@@ -60,89 +61,270 @@ def extract_json_content(data: dict) -> str:
         logger.error(f"Error extracting JSON content: {str(e)}")
         raise ValueError(f"Failed to process JSON content: {str(e)}")
 
-def get_text_splitter(strategy: str, params: Dict[str, Any]):
-    """Get appropriate text splitter based on strategy"""
-    if strategy == 'recursive':
-        return RecursiveCharacterTextSplitter(
-            chunk_size=params['chunk_size'],
-            chunk_overlap=params['chunk_overlap'],
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-    elif strategy == 'token':
-        return TokenTextSplitter(
-            chunk_size=params['chunk_size'] // 4,  # Token-based chunks are typically shorter
-            chunk_overlap=params['chunk_overlap'] // 4
-        )
-    elif strategy == 'markdown':
-        headers_to_split_on = [
-            ("#", "Header 1"),
-            ("##", "Header 2"),
-            ("###", "Header 3"),
-        ]
-        return MarkdownHeaderTextSplitter(
-            headers_to_split_on=headers_to_split_on
-        )
-    else:
-        raise ValueError(f"Unknown chunking strategy: {strategy}")
-
-def delete_vector_store():
-    """Delete the vector store directory and clear related session state"""
-    import shutil
-    vector_store_path = "data/vector_store"
-    
-    # First, try to close any existing ChromaDB connections
+def delete_vector_store(doc_id: str, persist_directory: str):
+    """Delete one document's chunks from the workspace's vector store and clear related session state"""
     try:
-        # Initialize ChromaDB client
-        chroma_client = chromadb.PersistentClient(
-            path=vector_store_path,
-            settings=chromadb.Settings(
-                allow_reset=True,
-                is_persistent=True
-            )
-        )
-        
-        # Reset and close the client
-        chroma_client.reset()
-        del chroma_client
-        
-        # Small delay to ensure connections are closed
-        import time
-        time.sleep(0.5)
-        
+        vector_store = get_vector_store(persist_directory=persist_directory)
+        if not remove_document(vector_store, doc_id, persist_directory):
+            st.warning(f"{doc_id} is not in the vector store")
+            return
     except Exception as e:
-        logger.warning(f"Error while closing ChromaDB connection: {str(e)}")
+        logger.error(f"Failed to delete {doc_id} from vector store: {str(e)}")
+        st.error(f"Failed to delete document: {str(e)}")
+        return
+
+    # Clear session data that belongs to the deleted document
+    data = get_session_data(st.session_state)
+    documents = data.get('documents') or []
+    sources = {doc.metadata.get('source') for doc in documents if doc.metadata.get('doc_id') == doc_id}
+    if sources:
+        for key in ['documents', 'geojson_str']:
+            data.pop(key)
+        st.session_state.pop('geojson_hash', None)
+        st.session_state.pop('geojson_source', None)
+        logger.info("Cleared session data of the deleted document")
+        for source in sources:
+            data.pop(f"dataframe:{source}")
+
+    st.success(f"{doc_id} deleted from the vector store!")
+    st.rerun()  # Force streamlit to rerun
+
+def stage_upload(uploaded_file, staging_dir: str) -> tuple:
+    """Copy an upload into the staging directory in blocks, hashing it on the way"""
+    # Own directory per upload, so two uploads with the same name don't overwrite each other
+    file_path = os.path.join(tempfile.mkdtemp(dir=staging_dir), os.path.basename(uploaded_file.name))
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    with open(file_path, "wb") as f:
+        for block in iter(lambda: uploaded_file.read(1 << 20), b""):
+            digest.update(block)
+            f.write(block)
+    return file_path, digest.hexdigest()
+
+def process_structured_file(file_path: str, file_extension: str, source_metadata: dict) -> Optional[List]:
+    """Load CSV/JSON/GeoJSON uploads, keeping their (Geo)DataFrames in the session's spillable data"""
+    data = get_session_data(st.session_state)
 
-    # Now try to delete the directory
-    if os.path.exists(vector_store_path):
+    if file_extension in ['.json']:
+        with open(file_path, 'r') as f:
+            df = pd.read_json(f)
+            # json_content = extract_json_content(json.load(f))
+        data.put(f"dataframe:{file_path}", df)
+        # Questions are answered from the DataFrame, only row-group summaries get embedded
+        return summarize_dataframe(df, {"source": file_path, **source_metadata})
+    elif file_extension in ['.geojson']:
         try:
-            shutil.rmtree(vector_store_path)
-            logger.info(f"Deleted vector store at {vector_store_path}")
-            
-            # Recreate empty directory
-            os.makedirs(vector_store_path, exist_ok=True)
-            
+            with open(file_path, 'r', encoding='utf-8') as f:
+                geojson_str = f.read()
+            json.loads(geojson_str)
+            # Parsed once per content hash, with an STRtree built on it
+            layer = get_spatial_layer(source_metadata["source_hash"], geojson_str)
+            documents = feature_documents(layer, {"source": file_path, **source_metadata})
+            # Save geojson_str to session data to be used in another file
+            data.put("geojson_str", geojson_str)
+            st.session_state.geojson_hash = source_metadata["source_hash"]
+            st.session_state.geojson_source = file_path
+            data.put(f"dataframe:{file_path}", layer.gdf)
+            return documents
+        except json.JSONDecodeError:
+            st.error("Invalid GeoJSON file. Please ensure the file is properly formatted.")
+            return None
         except Exception as e:
-            logger.error(f"Failed to delete vector store: {str(e)}")
-            st.error(f"Failed to delete vector store: {str(e)}")
-            return
+            st.error(f"Error processing GeoJSON file: {str(e)}")
+            return None
+    elif file_extension == '.csv':
+        df = pd.read_csv(file_path)
+        # Store only the source in metadata, keep DataFrame in session data
+        data.put(f"dataframe:{file_path}", df)
+        # Questions are answered from the DataFrame, only row-group summaries get embedded
+        return summarize_dataframe(df, {"source": file_path, **source_metadata})
+    st.error(f"Unsupported file type: {file_extension}")
+    return None
 
-    # Clear all related session state
-    keys_to_clear = ['documents', 'messages', 'dataframe', 'geojson_str']
-    for key in keys_to_clear:
-        if key in st.session_state:
-            del st.session_state[key]
-            logger.info(f"Cleared session state for key: {key}")
+def submit_ingestion(uploaded_files: list, folder: Optional[str], strategy: str, chunk_params: dict,
+                     persist_directory: str) -> Optional[IngestionJob]:
+    """Stage new uploads and queue one background job to parse and index them into the workspace"""
+    staging_dir = tempfile.mkdtemp(prefix="chatdoc-upload-")
+    try:
+        # (path, source metadata) for files parsed and indexed by the job
+        files = []
+        documents = []
+        for uploaded_file in uploaded_files:
+            with span("stage"):
+                file_path, source_hash = stage_upload(uploaded_file, staging_dir)
+            # Stable identity of the upload, used for incremental indexing
+            source_metadata = {
+                "doc_id": uploaded_file.name,
+                "source_hash": source_hash
+            }
 
-    st.success("Vector store and chat history deleted successfully!")
-    st.rerun()  # Force streamlit to rerun
+            # Load document based on file type
+            file_extension = get_file_extension(uploaded_file.name)
+            if file_extension in TEXT_FORMATS:
+                files.append((file_path, source_metadata))
+            else:
+                # Cheap to load and they need session state, only their summaries are indexed in the background
+                structured = process_structured_file(file_path, file_extension, source_metadata)
+                if structured:
+                    documents.extend(structured)
+
+        if folder:
+            try:
+                folder_files = find_ingestible_documents(folder)
+            except ValueError as e:
+                st.error(str(e))
+                folder_files = []
+            for file_path in folder_files:
+                files.append((file_path, {
+                    "doc_id": os.path.relpath(file_path, INGEST_ROOT),
+                    "source_hash": file_sha256(file_path)
+                }))
+
+        if not files and not documents:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return None
+        job = get_ingestion_jobs().submit(files, documents, strategy, chunk_params, staging_dir, persist_directory)
+    except Exception as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        logger.error(f"Error handling file upload: {str(e)}")
+        st.error(f"Error processing file: {str(e)}")
+        return None
+
+    st.session_state.setdefault('ingestion_jobs', []).append(job.key)
+    return job
+
+@st.fragment(run_every=1.0)
+def display_ingestion_progress():
+    """Poll the running jobs without rerunning the rest of the app"""
+    jobs = [job for job in map(get_ingestion_jobs().get, st.session_state.get('ingestion_jobs', [])) if job]
+    for job in jobs:
+        if job.finished:
+            continue
+        if job.total:
+            st.progress(min(job.done / job.total, 1.0), text=f"{job.stage.capitalize()}: {job.done}/{job.total} chunks")
+        elif job.done:
+            st.caption(f"{job.stage.capitalize()}: {job.done} chunks embedded")
+        else:
+            st.caption(f"{job.stage.capitalize()}...")
+    if all(job.finished for job in jobs):
+        # Full rerun so the chat and document viewer pick up the new documents
+        st.rerun()
+
+def display_job_summary(job: IngestionJob):
+    """Outcome of the last ingestion job of this session"""
+    if job.status == "failed":
+        st.error(f"Error processing file: {job.error}")
+        return
+    stats = job.stats
+    if not job.chunks:
+        st.warning("The document appears to be empty. Please upload a document with content.")
+        return
+    st.success(f"Successfully processed {stats['documents']} document(s)")
+    stage_timings = ""
+    if "timings" in stats:
+        timings = stats["timings"]
+        stage_timings = f"""
+        - Load: {timings['load']:.2f}s, split: {timings['split']:.2f}s across {timings['tasks']} tasks
+        - Wall time: {timings['wall']:.2f}s ({timings['chunks'] / max(timings['wall'], 1e-9):.0f} chunks/sec)"""
+        for doc_id, params in timings.get("autotuned", {}).items():
+            stage_timings += f"""
+        - {doc_id}: tuned to {params['chunk_size']} tokens, overlap {params['chunk_overlap']}"""
+    if stats["chunks"]:
+        st.info(f"""
+        Chunking Statistics:
+        - Average chunk size: {stats['avg_chunk_chars']} characters
+        - Number of chunks: {stats['chunks']}
+        - Chunking strategy: {CHUNKING_STRATEGIES.get(job.strategy, job.strategy)}{stage_timings}
+        - Memory: {stats['memory']}
+        """)
+    for doc_id, written in stats.get("streamed", {}).items():
+        if written is None:
+            st.info(f"{doc_id} is already indexed")
+        else:
+            st.success(f"Streamed {doc_id} into {written} chunks")
+
+def display_ingestion_status():
+    """Progress of this session's ingestion jobs, their results are picked up once all finish"""
+    jobs = get_ingestion_jobs()
+    if any(job and not job.finished for job in map(jobs.get, st.session_state.get('ingestion_jobs', []))):
+        display_ingestion_progress()
+        return
+    for key in st.session_state.pop('ingestion_jobs', []):
+        job = jobs.get(key)
+        if job is None:
+            continue
+        st.session_state['last_ingestion'] = key
+        if job.status == "done" and job.chunks:
+            get_session_data(st.session_state).put('documents', job.chunks)
+    job = jobs.get(st.session_state.get('last_ingestion', ''))
+    if job is not None:
+        display_job_summary(job)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def snapshot_preview(store_dir: str) -> list:
+    """First chunks of a served snapshot, read once per snapshot"""
+    return preview_documents(store_dir, STREAM_PREVIEW_CHUNKS)
+
+def display_snapshot_status() -> Optional[list]:
+    """Read-only replica: what is served instead of the upload controls"""
+    try:
+        store_dir = active_store_dir()
+    except Exception as e:
+        st.error(f"No snapshot to serve: {str(e)}")
+        return None
+    info = served_snapshot()
+    st.caption(f"Serving snapshot {info['name']} read-only: {len(info['documents'])} documents, {info['chunks']} chunks")
+    return snapshot_preview(store_dir)
+
+def select_workspace() -> str:
+    """Workspace of this session, from the ?workspace= URL parameter; switching starts a clean session"""
+    workspace = st.text_input(
+        "Workspace",
+        value=st.query_params.get("workspace", DEFAULT_WORKSPACE),
+        help="Documents, chat history and answer cache are kept apart per workspace. Anyone who knows its name can open it"
+    ).strip() or DEFAULT_WORKSPACE
+    if workspace != st.session_state.get('workspace', workspace):
+        for key in ['conversation', 'last_ingestion', 'ingestion_jobs', 'geojson_hash', 'geojson_source', 'messages']:
+            st.session_state.pop(key, None)
+        get_session_data(st.session_state).clear()
+        logger.info(f"Switched to workspace {workspace}")
+    st.session_state['workspace'] = workspace
+    st.query_params["workspace"] = workspace
+    return workspace
+
+def display_workspace_usage(persist_directory: str):
+    """Chunks used against the workspace quota and this session's memory"""
+    used = workspace_chunks(persist_directory)
+    if WORKSPACE_MAX_CHUNKS:
+        st.progress(min(used / WORKSPACE_MAX_CHUNKS, 1.0), text=f"{used}/{WORKSPACE_MAX_CHUNKS} chunks")
+    stats = get_session_data(st.session_state).stats()
+    st.caption(f"Session data: {stats['resident_mb']}/{stats['budget_mb']} MB in memory, {stats['spilled']} item(s) on disk")
 
 def handle_file_upload() -> Optional[list]:
-    """Handle document upload and processing with advanced chunking"""
-    uploaded_file = st.file_uploader(
+    """Handle document upload and submit new documents for background ingestion"""
+    if VECTOR_BACKEND == "snapshot":
+        # Replicas serve a prebuilt index, documents are ingested where the snapshot is exported
+        return display_snapshot_status()
+    workspace = select_workspace()
+    persist_directory = workspace_dir(workspace)
+    # Releases the handles of workspaces nobody used for a while
+    get_workspace_registry().touch(persist_directory)
+    display_workspace_usage(persist_directory)
+
+    uploaded_files = st.file_uploader(
         "",
-        type=[fmt[1:] for fmt in SUPPORTED_FORMATS.keys()]
+        type=[fmt[1:] for fmt in SUPPORTED_FORMATS.keys()],
+        accept_multiple_files=True
     )
+    folder, ingest_folder = None, False
+    if INGEST_ROOT:
+        # Only offered when the operator set a root, browser users can't read arbitrary server paths
+        folder = st.text_input(
+            f"Or ingest a folder under {INGEST_ROOT}",
+            placeholder="sample_docs",
+            help="All .txt, .pdf, .docx, .doc and .md files below this folder are ingested in parallel"
+        )
+        ingest_folder = st.button("Ingest Folder", disabled=not folder)
 
     # Show supported formats in the UI
     # st.markdown("# ✅ Supported Formats")
@@ -150,10 +332,17 @@ def handle_file_upload() -> Optional[list]:
     # st.caption(f"{formats_text}")
 
     st.markdown("# 📕 Remove Document")
-    if st.button("Delete Document", type="secondary"):
-        delete_vector_store()
-        st.success("Document deleted successfully!")
-        st.rerun()
+    indexed_documents = list_indexed_documents(persist_directory)
+    if indexed_documents:
+        doc_to_delete = st.selectbox(
+            "Indexed documents",
+            options=list(indexed_documents.keys()),
+            format_func=lambda x: f"{x} ({indexed_documents[x]['chunks']} chunks)"
+        )
+        if st.button("Delete Document", type="secondary"):
+            delete_vector_store(doc_to_delete, persist_directory)
+    else:
+        st.caption("No documents indexed yet")
 
     # Chunking strategy configuration
     st.markdown("# 🧩 Chunking")
@@ -165,9 +354,31 @@ def handle_file_upload() -> Optional[list]:
             help="Choose how to split the document into chunks"
         )
 
-        # Only show size parameters for non-markdown strategies
         chunk_params = {}
-        if strategy != 'markdown':
+        if strategy == 'auto':
+            st.caption("Chunk size and overlap are tuned per document on a sample of it")
+        elif strategy in TOKEN_STRATEGIES:
+            col1, col2 = st.columns(2)
+            with col1:
+                chunk_params['chunk_size'] = st.slider(
+                    "Max Chunk Tokens",
+                    min_value=64,
+                    max_value=1024,
+                    value=400 if strategy == 'markdown' else 256,
+                    step=32,
+                    help="Upper bound on prompt tokens per chunk"
+                )
+            if strategy == 'token':
+                with col2:
+                    chunk_params['chunk_overlap'] = st.slider(
+                        "Chunk Overlap Tokens",
+                        min_value=0,
+                        max_value=128,
+                        value=32,
+                        step=16,
+                        help="Number of overlapping tokens between chunks"
+                    )
+        else:
             col1, col2 = st.columns(2)
             with col1:
                 chunk_params['chunk_size'] = st.slider(
@@ -188,104 +399,13 @@ def handle_file_upload() -> Optional[list]:
                     help="Number of overlapping characters between chunks"
                 )
 
+    # Each upload is ingested once per chunking setup, chat reruns only read job status
+    submitted = st.session_state.setdefault('ingestion_requests', set())
+    settings = json.dumps({"workspace": workspace, "strategy": strategy, **chunk_params}, sort_keys=True)
+    new_uploads = [f for f in uploaded_files or [] if f"{f.file_id}:{settings}" not in submitted]
+    if new_uploads or ingest_folder:
+        submitted.update(f"{f.file_id}:{settings}" for f in new_uploads)
+        submit_ingestion(new_uploads, folder if ingest_folder else None, strategy, chunk_params, persist_directory)
 
-    if uploaded_file is not None:
-        try:
-            # Create a temporary file to store the uploaded content
-            with tempfile.NamedTemporaryFile(delete=False, suffix=uploaded_file.name) as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                file_path = tmp_file.name
-
-            # Load document based on file type
-            file_extension = get_file_extension(uploaded_file.name)
-
-            try:
-                if file_extension == '.txt':
-                    loader = TextLoader(file_path)
-                elif file_extension == '.pdf':
-                    loader = PyPDFLoader(file_path)
-                elif file_extension in ['.docx', '.doc']:
-                    try:
-                        loader = Docx2txtLoader(file_path)
-                    except Exception:
-                        # Fallback to UnstructuredWordDocumentLoader if Docx2txtLoader fails
-                        loader = UnstructuredWordDocumentLoader(file_path)
-                elif file_extension in ['.json']:
-                    with open(file_path, 'r') as f:
-                        df = pd.read_json(f)
-                        json_content = df.to_string()
-                        # json_content = extract_json_content(json.load(f))
-                        if 'dataframe' not in st.session_state:
-                            st.session_state.dataframe = {}
-                        st.session_state.dataframe[file_path] = df
-                    documents = [Document(page_content=json_content, metadata={"source": file_path})]
-                    return documents
-                elif file_extension in ['.geojson']:
-                    with open(file_path, 'r') as f:
-                        try:
-                            geojson_str = uploaded_file.getvalue().decode('utf-8')
-                            json_content = extract_json_content(json.loads(geojson_str))
-                            documents = [Document(page_content=json_content, metadata={"source": file_path})]
-                            # Save geojson_str to session state to be used in another file
-                            st.session_state.geojson_str = geojson_str
-                            gdf = gpd.read_file(StringIO(geojson_str))
-                            if 'dataframe' not in st.session_state:
-                                    st.session_state.dataframe = {}
-                            st.session_state.dataframe[file_path] = gdf
-                        except json.JSONDecodeError:
-                            st.error("Invalid GeoJSON file. Please ensure the file is properly formatted.")
-                            return None
-                        except Exception as e:
-                            st.error(f"Error processing GeoJSON file: {str(e)}")
-                            return None
-                    return documents
-                elif file_extension == '.csv':
-                    df = pd.read_csv(file_path)
-                    # Convert DataFrame to text for vector store
-                    text_content = df.to_string()
-                    # Store only the source in metadata, keep DataFrame in session state
-                    if 'dataframe' not in st.session_state:
-                        st.session_state.dataframe = {}
-                    st.session_state.dataframe[file_path] = df
-                    documents = [Document(page_content=text_content, metadata={"source": file_path})]
-                    return documents
-                elif file_extension == '.md':
-                    loader = UnstructuredMarkdownLoader(file_path)
-                else:
-                    st.error(f"Unsupported file type: {file_extension}")
-                    return None
-
-                documents = loader.load()
-
-                # Get appropriate text splitter
-                text_splitter = get_text_splitter(strategy, chunk_params)
-
-                # Split documents into chunks
-                chunks = text_splitter.split_documents(documents)
-
-                if not chunks:
-                    st.warning("The document appears to be empty. Please upload a document with content.")
-                    return None
-
-                # Display chunking statistics
-                st.success(f"Successfully processed document into {len(chunks)} chunks")
-                st.info(f"""
-                Chunking Statistics:
-                - Average chunk size: {sum(len(chunk.page_content) for chunk in chunks) // len(chunks)} characters
-                - Number of chunks: {len(chunks)}
-                - Chunking strategy: {CHUNKING_STRATEGIES[strategy]}
-                """)
-
-                return chunks
-
-            except Exception as e:
-                logger.error(f"Error processing file {uploaded_file.name}: {str(e)}")
-                st.error(f"Error processing file: {str(e)}")
-                return None
-
-        except Exception as e:
-            logger.error(f"Error handling file upload: {str(e)}")
-            st.error("An error occurred while uploading file. Please try again.")
-            return None
-
-    return None
\ No newline at end of file
+    display_ingestion_status()
+    return get_session_data(st.session_state).get('documents')
@@ -0,0 +1,287 @@
+# Caching layers in front of the embedding model and the LLM
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+import contextvars
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv("CHATDOC_EMBEDDING_CACHE_PATH", "data/embedding_cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("CHATDOC_EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("CHATDOC_ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("CHATDOC_ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("CHATDOC_ANSWER_CACHE_MAX_ENTRIES", "512"))
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so cosmetic differences share one cache entry"""
+    return " ".join(text.split())
+
+def text_hash(text: str) -> str:
+    """Content hash of the normalized chunk text"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Persistent (embedding model, text hash) -> vector store with LRU eviction"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Streamlit sessions and embedding workers share one connection
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for the given hashes and refresh their LRU position"""
+        found = {}
+        if not hashes:
+            return found
+        with self._lock:
+            # Stay well below SQLite's host parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for row_hash, blob in rows:
+                    found[row_hash] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        """Store freshly computed vectors and evict the least recently used overflow"""
+        if not vectors:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, h, array("f", vec).tobytes(), now) for h, vec in vectors.items()]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop the oldest entries once the cache grows past max_entries"""
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Evict down to 90% so we don't pay for eviction on every insert
+        overflow = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (overflow,)
+        )
+        logger.info(f"Evicted {overflow} entries from embedding cache")
+
+    def stats(self) -> dict:
+        """Hit/miss counters plus current size"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries
+        }
+
+    def clear(self):
+        """Remove every cached vector"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the model for chunks it has never seen"""
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache: Optional[EmbeddingCache] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache if cache is not None else get_embedding_cache()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        vectors = self.cache.get_many(self.model_name, unique)
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in vectors and h not in missing:
+                missing[h] = text
+        if missing:
+            computed = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), computed))
+            self.cache.put_many(self.model_name, new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Some models embed queries differently, so keep them in their own namespace
+        model_key = f"{self.model_name}#query"
+        h = text_hash(text)
+        cached = self.cache.get_many(model_key, [h])
+        if h in cached:
+            return cached[h]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many(model_key, {h: vector})
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Many queries in one cache lookup, the misses embedded as queries like embed_query does"""
+        model_key = f"{self.model_name}#query"
+        hashes = [text_hash(text) for text in texts]
+        vectors = self.cache.get_many(model_key, list(dict.fromkeys(hashes)))
+        missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+        if missing:
+            # Sent together, so the scheduler coalesces them into one embedding request
+            with ThreadPoolExecutor(max_workers=min(len(missing), 32), thread_name_prefix="embed-query") as executor:
+                computed = dict(zip(missing.keys(), executor.map(
+                    lambda text: contextvars.copy_context().run(self.embeddings.embed_query, text), missing.values())))
+            self.cache.put_many(model_key, computed)
+            vectors.update(computed)
+        return [vectors[h] for h in hashes]
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache"""
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+        return _embedding_cache
+
+class SemanticAnswerCache:
+    """Question -> answer cache matched by cosine similarity of the question embeddings"""
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+        # (model, store, index version, question hash) -> entry, oldest first
+        self._entries = OrderedDict()
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, model: str, index_version: int, vector: List[float], store: str = "") -> Optional[Tuple[str, float]]:
+        """Return (answer, similarity) for the closest cached question above the threshold"""
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            self._expire(time.time())
+            # Only answers from the same workspace's index, never another tenant's
+            keys = [key for key in self._entries if key[:3] == (model, store, index_version)]
+            best_key, best_score = None, -1.0
+            if keys:
+                scores = np.stack([self._entries[key]["vector"] for key in keys]) @ query
+                best = int(np.argmax(scores))
+                best_key, best_score = keys[best], float(scores[best])
+
+            if best_key is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            self.latency_saved += entry["generation_time"]
+            logger.info(
+                f"Answer cache hit (similarity {best_score:.3f}) saved ~{entry['generation_time']:.2f}s, "
+                f"hit rate {self.hits / (self.hits + self.misses):.0%}, total saved {self.latency_saved:.1f}s"
+            )
+            return entry["answer"], best_score
+
+    def store(self, model: str, index_version: int, question: str, vector: List[float],
+              answer: str, generation_time: float, store: str = ""):
+        """Remember a generated answer, evicting the least recently used entries"""
+        normalized = np.asarray(vector, dtype=np.float32)
+        normalized /= np.linalg.norm(normalized) or 1.0
+        key = (model, store, index_version, text_hash(question))
+        with self._lock:
+            self._entries[key] = {
+                "vector": normalized,
+                "answer": answer,
+                "created": time.time(),
+                "generation_time": generation_time
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, index_version: Optional[int] = None, store: Optional[str] = None):
+        """Drop answers computed against any other index version (all versions if None) of a store (all stores if None)"""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if (store is None or key[1] == store) and (index_version is None or key[2] != index_version)]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            logger.info(f"Invalidated {len(stale)} cached answers after re-indexing")
+
+    def stats(self) -> dict:
+        """Hit/miss counters and latency saved"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "latency_saved": self.latency_saved,
+            "entries": len(self._entries)
+        }
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Process-wide semantic answer cache"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
@@ -0,0 +1,198 @@
+# Structure- and meaning-aware chunking: token-bounded splitters, semantic grouping and chunk-size autotuning
+import os
+import logging
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from core.context import count_tokens, split_sentences
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_MAX_TOKENS = int(os.getenv("CHATDOC_MARKDOWN_MAX_TOKENS", "400"))
+# Sections and semantic chunks below this are merged with their neighbour
+MIN_CHUNK_TOKENS = int(os.getenv("CHATDOC_MIN_CHUNK_TOKENS", "40"))
+# Semantic chunks break where the distance between neighbouring sentences is in this top percentile
+SEMANTIC_BREAKPOINT_PERCENTILE = float(os.getenv("CHATDOC_SEMANTIC_BREAKPOINT_PERCENTILE", "85"))
+# Autotuning: tokens of each document it looks at, and what one extra chunk per 1k tokens costs in hit rate
+AUTOTUNE_SAMPLE_TOKENS = int(os.getenv("CHATDOC_AUTOTUNE_SAMPLE_TOKENS", "3000"))
+AUTOTUNE_CHUNK_COST = float(os.getenv("CHATDOC_AUTOTUNE_CHUNK_COST", "0.02"))
+AUTOTUNE_SIZES = (128, 256, 384, 512)
+AUTOTUNE_OVERLAPS = (0.0, 0.15)
+AUTOTUNE_QUERIES = 24
+
+def autotune_settings() -> Dict[str, Any]:
+    """Everything autotuning depends on besides the document, so a changed setup re-tunes"""
+    return {
+        "sample_tokens": AUTOTUNE_SAMPLE_TOKENS,
+        "chunk_cost": AUTOTUNE_CHUNK_COST,
+        "sizes": list(AUTOTUNE_SIZES),
+        "overlaps": list(AUTOTUNE_OVERLAPS),
+        "queries": AUTOTUNE_QUERIES
+    }
+
+HEADERS_TO_SPLIT_ON = [
+    ("#", "Header 1"),
+    ("##", "Header 2"),
+    ("###", "Header 3"),
+]
+
+def token_splitter(max_tokens: int, overlap_tokens: int = 0) -> RecursiveCharacterTextSplitter:
+    """Recursive splitter measuring chunks in prompt tokens, cutting at paragraphs, lines and words first"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=max(max_tokens, 1),
+        chunk_overlap=min(overlap_tokens, max_tokens // 2),
+        length_function=count_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+
+class BoundedMarkdownSplitter:
+    """Header sections, with oversized sections re-split and tiny neighbours under the same parent merged"""
+
+    def __init__(self, max_tokens: int = MARKDOWN_MAX_TOKENS, min_tokens: int = MIN_CHUNK_TOKENS):
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens // 2)
+        self.header_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=HEADERS_TO_SPLIT_ON)
+        self.section_splitter = token_splitter(max_tokens, max_tokens // 10)
+
+    def split_text(self, text: str) -> List[Document]:
+        merged: List[Tuple[Document, int]] = []
+        for section in self.header_splitter.split_text(text):
+            tokens = count_tokens(section.page_content)
+            previous = merged[-1] if merged else None
+            if (previous and previous[0].metadata.get("Header 1") == section.metadata.get("Header 1")
+                    and min(previous[1], tokens) < self.min_tokens and previous[1] + tokens <= self.max_tokens):
+                # Keep the first section's headers, the merged text still carries the sub-headings' content
+                merged[-1] = (Document(page_content=f"{previous[0].page_content}\n\n{section.page_content}",
+                                       metadata=previous[0].metadata), previous[1] + tokens)
+            else:
+                merged.append((section, tokens))
+
+        chunks = []
+        for section, tokens in merged:
+            if tokens <= self.max_tokens:
+                chunks.append(section)
+            else:
+                chunks.extend(Document(page_content=part, metadata=dict(section.metadata))
+                              for part in self.section_splitter.split_text(section.page_content))
+        return chunks
+
+class SentenceSplitter:
+    """First stage of semantic chunking: sentences (long ones cut to max_tokens), grouped later by embedding"""
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self.fallback = token_splitter(max_tokens)
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        units = []
+        for doc in documents:
+            for paragraph_index, paragraph in enumerate(doc.page_content.split("\n\n")):
+                for sentence in split_sentences(paragraph):
+                    sentence = sentence.strip()
+                    if not sentence:
+                        continue
+                    parts = [sentence] if count_tokens(sentence) <= self.max_tokens else self.fallback.split_text(sentence)
+                    for part in parts:
+                        # Paragraph starts are preferred breakpoints
+                        units.append(Document(page_content=part, metadata={**doc.metadata, "_paragraph_start": paragraph_index}))
+        return units
+
+def semantic_chunks(units: List[Document], embeddings: Embeddings, max_tokens: int,
+                    min_tokens: int = MIN_CHUNK_TOKENS,
+                    breakpoint_percentile: float = SEMANTIC_BREAKPOINT_PERCENTILE) -> List[Document]:
+    """Group consecutive sentences, breaking where meaning shifts, within [min_tokens, max_tokens]"""
+    if not units:
+        return []
+    vectors = np.asarray(embeddings.embed_documents([unit.page_content for unit in units]), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    # distances[i] is between unit i and unit i + 1
+    distances = 1.0 - np.sum(vectors[:-1] * vectors[1:], axis=1)
+    threshold = np.percentile(distances, breakpoint_percentile) if len(distances) else 0.0
+    min_tokens = min(min_tokens, max_tokens // 2)
+
+    chunks = []
+    current, current_tokens = [], 0
+
+    def flush():
+        metadata = {key: value for key, value in current[0].metadata.items() if key != "_paragraph_start"}
+        chunks.append(Document(page_content=" ".join(unit.page_content for unit in current), metadata=metadata))
+
+    for index, unit in enumerate(units):
+        # Measured with the joining space, which can cost a token of its own
+        tokens = count_tokens(f" {unit.page_content}" if current else unit.page_content)
+        if current:
+            same_source = unit.metadata.get("source") == current[0].metadata.get("source") \
+                and unit.metadata.get("page") == current[0].metadata.get("page")
+            shift = distances[index - 1] >= threshold
+            new_paragraph = unit.metadata["_paragraph_start"] != units[index - 1].metadata["_paragraph_start"]
+            if (not same_source or current_tokens + tokens > max_tokens
+                    or (current_tokens >= min_tokens and (shift or (new_paragraph and distances[index - 1] >= np.median(distances))))):
+                flush()
+                current, current_tokens = [], 0
+                tokens = count_tokens(unit.page_content)
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        flush()
+    return chunks
+
+def chunk_hit_rate(chunks: List[str], queries: List[str], embeddings: Embeddings, k: int = 3) -> float:
+    """Share of probe sentences whose own chunk ranks in the top k for them"""
+    if not chunks or not queries:
+        return 0.0
+    chunk_vectors = np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+    chunk_vectors /= np.maximum(np.linalg.norm(chunk_vectors, axis=1, keepdims=True), 1e-12)
+    query_vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+    top = np.argsort(-(query_vectors @ chunk_vectors.T), axis=1)[:, :k]
+    hits = 0
+    for query, ranked in zip(queries, top):
+        hits += any(query in chunks[i] for i in ranked)
+    return hits / len(queries)
+
+def autotune_chunking(documents: List[Document], embeddings: Embeddings,
+                      sizes: Tuple[int, ...] = AUTOTUNE_SIZES, overlaps: Tuple[float, ...] = AUTOTUNE_OVERLAPS,
+                      sample_tokens: int = AUTOTUNE_SAMPLE_TOKENS,
+                      chunk_cost: float = AUTOTUNE_CHUNK_COST) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+    """Pick chunk_size/chunk_overlap (tokens) maximizing probe-sentence hit rate minus a per-chunk cost
+
+    Probe sentences drawn from the document stand in for questions: a good chunking keeps each
+    sentence in a chunk that still ranks in the top k (chunk_hit_rate) for it, with as few chunks as possible.
+    """
+    sample = []
+    used = 0
+    for doc in documents:
+        if used >= sample_tokens:
+            break
+        sample.append(doc.page_content)
+        used += count_tokens(doc.page_content)
+    text = "\n\n".join(sample)
+    text = text[:sample_tokens * 6]  # bound the work on documents with very long pages
+
+    sentences = [s.strip() for s in split_sentences(text) if 8 <= len(s.split()) <= 60]
+    step = max(len(sentences) // AUTOTUNE_QUERIES, 1)
+    queries = sentences[::step][:AUTOTUNE_QUERIES]
+    sample_total = max(count_tokens(text), 1)
+
+    candidates = []
+    for size in sizes:
+        for overlap in overlaps:
+            chunks = token_splitter(size, int(size * overlap)).split_text(text)
+            hit_rate = chunk_hit_rate(chunks, queries, embeddings)
+            score = hit_rate - chunk_cost * len(chunks) * 1000 / sample_total
+            candidates.append({"chunk_size": size, "chunk_overlap": int(size * overlap), "chunks": len(chunks),
+                               "hit_rate": round(hit_rate, 3), "score": round(score, 4)})
+    if not queries:
+        # Too little prose to judge, the largest chunks are the cheapest
+        best = max(candidates, key=lambda c: (c["chunk_size"], -c["chunk_overlap"]))
+    else:
+        best = max(candidates, key=lambda c: (c["score"], c["chunk_size"]))
+    logger.info(f"Autotuned chunking: {best['chunk_size']} tokens, overlap {best['chunk_overlap']} "
+                f"(hit rate {best['hit_rate']}, {best['chunks']} chunks on a {sample_total}-token sample)")
+    return {"chunk_size": best["chunk_size"], "chunk_overlap": best["chunk_overlap"]}, candidates
+
+def tuned_params(timings: Dict[str, Any], doc_id: str, default: Dict[str, Any]) -> Dict[str, Any]:
+    """Chunk parameters autotuning picked for a document during ingestion, or the requested ones"""
+    return timings.get("autotuned", {}).get(doc_id, default)
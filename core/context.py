@@ -0,0 +1,92 @@
+# Packs retrieved chunks into a token-budgeted prompt context
+import os
+import re
+import logging
+import threading
+from typing import Dict, List, Tuple
+from langchain_core.documents import Document
+from core.cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CHATDOC_CONTEXT_TOKENS", "1500"))
+TOKENIZER_ENCODING = os.getenv("CHATDOC_TOKENIZER_ENCODING", "cl100k_base")
+# Rough characters per token for when the tiktoken encoding can't be loaded (e.g. offline)
+CHARS_PER_TOKEN = 4
+
+# Sentence ends are punctuation followed by whitespace, so "3.14" or "v1.2" stay whole
+SENTENCE_PATTERN = re.compile(r"(?:[^\n.!?]|[.!?](?=\S))+[.!?]*")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def get_encoding():
+    """tiktoken encoding used for budgeting, or None if it is unavailable"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                logger.warning(f"tiktoken encoding {TOKENIZER_ENCODING} unavailable, estimating tokens from length: {str(e)}")
+        return _encoding
+
+def count_tokens(text: str) -> int:
+    """Approximate prompt tokens of a text"""
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in SENTENCE_PATTERN.findall(text) if s.strip()]
+
+def pack_context(documents: List[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """Chunk text only, with sentences repeated by overlapping chunks removed, packed in rank order up to the budget"""
+    seen = set()
+    passages = []
+    used = 0
+    stats = {"chunks_retrieved": len(documents), "chunks_packed": 0, "duplicate_sentences": 0}
+    for doc in documents:
+        sentences = []
+        for sentence in split_sentences(doc.page_content):
+            key = normalize_text(sentence).lower().rstrip(".!? ")
+            if key in seen:
+                stats["duplicate_sentences"] += 1
+                continue
+            seen.add(key)
+            sentences.append(sentence)
+        if not sentences:
+            continue
+
+        # Take whole sentences while they fit, the last passage may be cut short.
+        # The passage marker and the separators are counted too, so the whole context fits the budget
+        marker = f"\n\n[{len(passages) + 1}] " if passages else "[1] "
+        kept = []
+        for sentence in sentences:
+            sentence = sentence.strip()
+            tokens = count_tokens(f" {sentence}") if kept else count_tokens(marker) + count_tokens(sentence)
+            if used + tokens > token_budget:
+                room = token_budget - used - count_tokens(marker)
+                if not passages and not kept and room > 0:
+                    # Never send an empty context because the top chunk opens with one huge sentence
+                    cut = sentence[:room * CHARS_PER_TOKEN]
+                    # chars/4 is only an estimate with a real tokenizer
+                    while count_tokens(cut) > room:
+                        cut = cut[:int(len(cut) * 0.9)]
+                    kept.append(cut)
+                    used += count_tokens(marker) + count_tokens(cut)
+                break
+            kept.append(sentence)
+            used += tokens
+        if kept:
+            passages.append(" ".join(kept))
+            stats["chunks_packed"] += 1
+        if len(kept) < len(sentences):
+            break
+
+    stats["context_tokens"] = used
+    return "\n\n".join(f"[{i + 1}] {passage}" for i, passage in enumerate(passages)), stats
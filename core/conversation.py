@@ -0,0 +1,145 @@
+# Conversation mode: a stable prompt prefix plus Ollama's generate context carried between turns
+import os
+import time
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from core.cache import text_hash
+from core.context import CONTEXT_TOKEN_BUDGET, pack_context, count_tokens
+from core.resources import KEEP_ALIVE, get_ollama_client
+from utils.helpers import span
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TURNS = int(os.getenv("CHATDOC_HISTORY_TURNS", "4"))
+# Once the carried context grows past this the conversation is rebased on a fresh, summarized prompt
+CONVERSATION_MAX_TOKENS = int(os.getenv("CHATDOC_CONVERSATION_MAX_TOKENS", "3000"))
+NUM_CTX = int(os.getenv("CHATDOC_NUM_CTX", "0"))  # 0 keeps the model's default window
+SUMMARY_MAX_TOKENS = 200
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant answering questions about the user's documents. "
+    "Answer based only on the provided context and the conversation so far. "
+    "If the context does not contain the answer, say so."
+)
+
+class Conversation:
+    """Per-session conversation state: pinned chunks, Ollama context tokens and a bounded history"""
+
+    def __init__(self, model: str, index_version: int):
+        self.model = model
+        self.index_version = index_version
+        self.context: List[int] = []
+        self.pinned = set()
+        self.turns: List[Tuple[str, str]] = []
+        self.summary = ""
+        self.summarized_turns = 0
+
+    def matches(self, model: str, index_version: int) -> bool:
+        return self.model == model and self.index_version == index_version
+
+    def _options(self) -> Optional[dict]:
+        return {"num_ctx": NUM_CTX} if NUM_CTX > 0 else None
+
+    def _summarize(self):
+        """Fold turns that fell out of the history window into the running summary"""
+        window_start = max(len(self.turns) - HISTORY_TURNS, 0)
+        older = self.turns[self.summarized_turns:window_start]
+        if not older:
+            return
+        transcript = "\n".join(f"User: {q}\nAssistant: {a}" for q, a in older)
+        try:
+            response = get_ollama_client().generate(
+                model=self.model,
+                prompt=(f"Previous summary: {self.summary}\n\n" if self.summary else "")
+                + f"Summarize this conversation in at most five sentences, keeping names and numbers:\n\n{transcript}",
+                options={**(self._options() or {}), "num_predict": SUMMARY_MAX_TOKENS},
+                keep_alive=KEEP_ALIVE
+            )
+            self.summary = response.response.strip()
+        except Exception as e:
+            # Keep the opening of each question instead, still bounded
+            logger.warning(f"Conversation summary failed, truncating history instead: {str(e)}")
+            self.summary = " ".join(filter(None, [self.summary] + [q[:200] for q, _ in older]))[-2000:]
+        self.summarized_turns = window_start
+
+    def _rebase_prompt(self, question: str, documents: List[Document], stats: dict) -> str:
+        """Full prompt for a fresh context: pinned chunks, summary, recent turns and the question"""
+        self._summarize()
+        context, packed = pack_context(documents, CONTEXT_TOKEN_BUDGET)
+        stats.update(packed)
+        self.pinned = {text_hash(doc.page_content) for doc in documents}
+        parts = [f"Context:\n{context}"]
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        recent = self.turns[max(len(self.turns) - HISTORY_TURNS, 0):]
+        if recent:
+            parts.append("Recent conversation:\n" + "\n".join(f"User: {q}\nAssistant: {a}" for q, a in recent))
+        parts.append(f"Question: {question}")
+        return "\n\n".join(parts)
+
+    def _follow_up_prompt(self, question: str, documents: List[Document], stats: dict) -> str:
+        """Only the new turn, chunks already in the carried context are not sent again"""
+        new_documents = [doc for doc in documents if text_hash(doc.page_content) not in self.pinned]
+        stats.update({"chunks_retrieved": len(documents), "chunks_packed": 0})
+        if not new_documents:
+            return f"Question: {question}"
+        context, packed = pack_context(new_documents, CONTEXT_TOKEN_BUDGET)
+        stats.update(packed, chunks_retrieved=len(documents))
+        self.pinned.update(text_hash(doc.page_content) for doc in new_documents)
+        return f"Additional context:\n{context}\n\nQuestion: {question}"
+
+    def stream(self, question: str, documents: List[Document], stats: Dict) -> Iterator[str]:
+        """Stream an answer, reusing the server-side KV cache of earlier turns where possible"""
+        start_time = time.perf_counter()
+        rebase = not self.context or len(self.context) > CONVERSATION_MAX_TOKENS
+        with span("prompt_build"):
+            if rebase:
+                self.context = []
+                prompt = self._rebase_prompt(question, documents, stats)
+            else:
+                prompt = self._follow_up_prompt(question, documents, stats)
+            reused = len(self.context)
+            stats.update({"prompt_tokens": count_tokens(prompt), "reused_tokens": reused, "rebased": rebase})
+
+        answer = []
+        final = None
+        for chunk in get_ollama_client().generate(
+            model=self.model,
+            prompt=prompt,
+            # The system prompt is part of the carried context after the first turn
+            system=SYSTEM_PROMPT if rebase else None,
+            context=self.context or None,
+            stream=True,
+            options=self._options(),
+            keep_alive=KEEP_ALIVE
+        ):
+            if chunk.response:
+                if "first_token" not in stats:
+                    stats["first_token"] = time.perf_counter() - start_time
+                answer.append(chunk.response)
+                yield chunk.response
+            if chunk.done:
+                final = chunk
+        stats["total"] = time.perf_counter() - start_time
+
+        self.turns.append((question, "".join(answer)))
+        if final is not None and final.context:
+            self.context = list(final.context)
+            stats.update(prefill_stats(final, reused))
+        logger.info(f"Conversation turn {len(self.turns)}: {stats}")
+
+def prefill_stats(final, reused: int) -> Dict[str, float]:
+    """Prefill time of this turn and the estimated time saved by tokens served from the KV cache"""
+    evaluated = final.prompt_eval_count or 0
+    prefill_seconds = (final.prompt_eval_duration or 0) / 1e9
+    # The returned context is the previous context + this prompt + the generated tokens
+    prompt_total = len(final.context) - (final.eval_count or 0)
+    cached = max(prompt_total - evaluated, 0) if reused else 0
+    per_token = prefill_seconds / evaluated if evaluated else 0.0
+    return {
+        "prefill": prefill_seconds,
+        "prefill_tokens": evaluated,
+        "cached_tokens": cached,
+        "prefill_saved": cached * per_token
+    }
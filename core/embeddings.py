@@ -1,49 +1,438 @@
-from langchain_ollama import OllamaEmbeddings
-# from langchain_community.vectorstores import Chroma
-from langchain_chroma import Chroma
-import chromadb
 import os
+import re
+import json
+import hashlib
+import time
 import logging
+import contextvars
+from itertools import islice, count
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from core.cache import get_embedding_cache, get_answer_cache
+from core.lexical import LEXICAL_INDEX_DIR, drop_lexical_index, get_lexical_index
+from utils.helpers import span, record_span
+from core.resources import get_chroma_client, get_chroma_store, get_numpy_store, get_embedder
+from core.vectorstore import NumpyVectorStore
 logger = logging.getLogger(__name__)
 
-def get_vector_store(documents=None, force_refresh=False):
-    """Get or create vector store"""
-    persist_directory = "data/vector_store"
-    
-    # Ensure the directory exists
+EMBEDDING_MODEL = "mxbai-embed-large" # mxbai-embed-large, llama3.2
+VECTOR_BACKEND = os.getenv("CHATDOC_VECTOR_BACKEND", "chroma")  # chroma, numpy, or snapshot to serve the published snapshot read-only
+# Each backend keeps its own directory and manifest, switching never mixes their indexes
+VECTOR_STORE_DIR = "data/vector_store" if VECTOR_BACKEND == "chroma" else f"data/vector_store_{VECTOR_BACKEND}"
+# The default workspace keeps the single-tenant layout, others get a collection in the same client and their own manifest
+DEFAULT_WORKSPACE = os.getenv("CHATDOC_DEFAULT_WORKSPACE", "default")
+WORKSPACES_DIR = os.path.join(VECTOR_STORE_DIR, "workspaces")
+MANIFEST_FILE = "index_manifest.json"
+EMBEDDING_BATCH_SIZE = int(os.getenv("CHATDOC_EMBED_BATCH_SIZE", "32"))
+EMBEDDING_WORKERS = int(os.getenv("CHATDOC_EMBED_WORKERS", "4"))
+LEXICAL_BATCH_SIZE = EMBEDDING_BATCH_SIZE * 100  # chunks of a streamed document per BM25 shard part
+
+def workspace_dir(workspace: Optional[str] = None) -> str:
+    """Index directory (manifest, BM25 shards, NumPy matrix) of a workspace"""
+    if not workspace or workspace == DEFAULT_WORKSPACE:
+        return VECTOR_STORE_DIR
+    # Readable and collision-free, and a valid Chroma collection name
+    slug = re.sub(r"[^a-z0-9_-]+", "-", workspace.lower()).strip("-_")[:40] or "ws"
+    return os.path.join(WORKSPACES_DIR, f"{slug}-{hashlib.sha1(workspace.encode('utf-8')).hexdigest()[:8]}")
+
+def chroma_location(persist_directory: str) -> Tuple[str, str]:
+    """(client path, collection name) holding a workspace's chunks in the shared Chroma client"""
+    if os.path.dirname(persist_directory) == WORKSPACES_DIR:
+        return VECTOR_STORE_DIR, f"ws-{os.path.basename(persist_directory)}"
+    return persist_directory, "langchain"
+
+def lexical_dir(persist_directory: str) -> str:
+    """BM25 shards belonging to a store"""
+    if VECTOR_BACKEND == "snapshot":
+        # A snapshot bundles its own
+        return os.path.join(os.path.dirname(persist_directory), "lexical")
+    if persist_directory == VECTOR_STORE_DIR:
+        return LEXICAL_INDEX_DIR
+    return os.path.join(persist_directory, "lexical")
+
+def get_embeddings():
+    """Shared Ollama embeddings behind the persistent content-hash cache"""
+    return get_embedder(EMBEDDING_MODEL)
+
+def chunk_id_prefix(doc_id: str, source_hash: str) -> str:
+    """ID prefix of a document's chunks, two documents with identical content don't share chunks"""
+    return hashlib.sha256(f"{doc_id}\0{source_hash}".encode("utf-8")).hexdigest()[:16]
+
+def chunk_id(doc_id: str, source_hash: str, offset: int) -> str:
+    """Stable chunk ID derived from the document, its source hash and the chunk offset"""
+    return f"{chunk_id_prefix(doc_id, source_hash)}:{offset}"
+
+def entry_chunk_ids(entry: dict, start: int = 0, stop: Optional[int] = None) -> List[str]:
+    """IDs a manifest entry's chunks are stored under"""
+    # Entries from before IDs included the doc_id have no prefix and used the bare source hash
+    prefix = entry.get("id_prefix", entry["source_hash"][:16])
+    return [f"{prefix}:{offset}" for offset in range(start, entry["chunks"] if stop is None else stop)]
+
+def load_manifest(persist_directory: str = VECTOR_STORE_DIR) -> dict:
+    """Load the per-document index manifest"""
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Error reading index manifest: {str(e)}")
+    return {"version": 0, "documents": {}}
+
+def save_manifest(manifest: dict, persist_directory: str = VECTOR_STORE_DIR):
+    """Atomically write the per-document index manifest"""
+    # A new workspace may not have written anything else yet
     os.makedirs(persist_directory, exist_ok=True)
-    
-    # Initialize embeddings with mxbai-embed-large
-    embeddings = OllamaEmbeddings(model="mxbai-embed-large") # mxbai-embed-large, llama3.2
-    
-    # Initialize ChromaDB client with explicit settings
-    chroma_client = chromadb.PersistentClient(
-        path=persist_directory,
-        settings=chromadb.Settings(
-            allow_reset=True,
-            is_persistent=True
-        )
+    path = os.path.join(persist_directory, MANIFEST_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def group_by_document(documents: List[Document]) -> Dict[str, List[Document]]:
+    """Group chunks by their source document, keeping upload order"""
+    groups = {}
+    for doc in documents:
+        doc_id = doc.metadata.get("doc_id") or doc.metadata.get("source", "unknown")
+        groups.setdefault(doc_id, []).append(doc)
+    return groups
+
+def chunk_signature(chunks: List[Document]) -> str:
+    """Hash of the chunk texts, changes whenever content or chunking changes"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.page_content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def iter_embedded_batches(
+    embeddings,
+    documents: Iterable[Document],
+    ids: Iterable[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_workers: int = EMBEDDING_WORKERS
+) -> Iterator[Tuple[List[str], List[Document], List[List[float]]]]:
+    """Embed documents in batches on a bounded worker pool, yielding batches as they finish"""
+    pairs = iter(zip(ids, documents))
+    # Only keep a couple of batches per worker in flight so huge uploads don't pile up in memory
+    max_in_flight = max_workers * 2
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed") as executor:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
+                batch = list(islice(pairs, batch_size))
+                if not batch:
+                    exhausted = True
+                    break
+                batch_ids = [pair[0] for pair in batch]
+                batch_docs = [pair[1] for pair in batch]
+                # Workers run in the caller's context, so the scheduler sees the job's session
+                future = executor.submit(contextvars.copy_context().run, embeddings.embed_documents, [doc.page_content for doc in batch_docs])
+                pending[future] = (batch_ids, batch_docs)
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_ids, batch_docs = pending.pop(future)
+                yield batch_ids, batch_docs, future.result()
+
+def upsert_vectors(vector_store, ids: List[str], vectors: List[List[float]], documents: List[Document]):
+    """Write already computed vectors without the store embedding the texts again"""
+    # Chroma's LangChain wrapper has no upsert of precomputed vectors, so its collection is used directly
+    store = vector_store if isinstance(vector_store, NumpyVectorStore) else vector_store._collection
+    store.upsert(
+        ids=ids,
+        embeddings=vectors,
+        metadatas=[doc.metadata for doc in documents],
+        documents=[doc.page_content for doc in documents]
     )
-    
-    # Create or load vector store
+
+def search_by_vectors(vector_store, vectors: List[List[float]], k: int) -> List[List[Document]]:
+    """Nearest chunks for many query vectors in one call to the store"""
+    if not vectors:
+        return []
+    if isinstance(vector_store, NumpyVectorStore):
+        return vector_store.similarity_search_by_vectors(vectors, k)
+    results = vector_store._collection.query(query_embeddings=vectors, n_results=k, include=["documents", "metadatas"])
+    return [
+        [Document(id=chunk_id, page_content=text, metadata=metadata or {}) for chunk_id, text, metadata in zip(ids, texts, metadatas)]
+        for ids, texts, metadatas in zip(results["ids"], results["documents"], results["metadatas"])
+    ]
+
+def embed_and_store(
+    vector_store,
+    documents: Iterable[Document],
+    ids: Iterable[str],
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_workers: int = EMBEDDING_WORKERS,
+    progress_callback: Optional[Callable[[int], None]] = None
+) -> int:
+    """Stream embedded batches into the vector store, reporting progress per batch"""
+    written = 0
+    # "embed" is the time spent waiting for the next embedded batch (for streamed files that includes loading)
+    wait_start = time.perf_counter()
+    for batch_ids, batch_docs, vectors in iter_embedded_batches(
+        vector_store.embeddings, documents, ids, batch_size, max_workers
+    ):
+        record_span("embed", time.perf_counter() - wait_start)
+        with span("persist"):
+            upsert_vectors(vector_store, batch_ids, vectors, batch_docs)
+        written += len(batch_ids)
+        if progress_callback:
+            progress_callback(len(batch_ids))
+        wait_start = time.perf_counter()
+    return written
+
+def index_documents(
+    vector_store,
+    documents: List[Document],
+    persist_directory: str = VECTOR_STORE_DIR,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    chunking: Optional[Dict[str, dict]] = None
+) -> dict:
+    """Add, update or skip each source document so only changed chunks are written"""
+    manifest = load_manifest(persist_directory)
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "removed_chunks": 0}
+
+    # Work out which documents changed first so progress has a real total
+    changed = []
+    for doc_id, chunks in group_by_document(documents).items():
+        signature = chunk_signature(chunks)
+        entry = manifest["documents"].get(doc_id)
+        if entry and entry["signature"] == signature:
+            stats["unchanged"] += 1
+        else:
+            changed.append((doc_id, chunks, signature, entry))
+
+    total = sum(len(chunks) for _, chunks, _, _ in changed)
+    done = 0
+
+    def report(count):
+        nonlocal done
+        done += count
+        if progress_callback:
+            progress_callback(done, total)
+
+    for doc_id, chunks, signature, entry in changed:
+        source_hash = chunks[0].metadata.get("source_hash") or signature
+        prefix = chunk_id_prefix(doc_id, source_hash)
+        ids = [f"{prefix}:{offset}" for offset in range(len(chunks))]
+        for chunk in chunks:
+            chunk.metadata["doc_id"] = doc_id
+            chunk.metadata["source_hash"] = source_hash
+        embed_and_store(vector_store, chunks, ids, progress_callback=report)
+
+        # Drop chunks from the previous version that the new one no longer covers
+        if entry:
+            old_ids = entry_chunk_ids(entry)
+            stale_ids = sorted(set(old_ids) - set(ids))
+            if stale_ids:
+                vector_store.delete(ids=stale_ids)
+            stats["removed_chunks"] += len(stale_ids)
+            stats["updated"] += 1
+        else:
+            stats["added"] += 1
+
+        manifest["documents"][doc_id] = {
+            "source_hash": source_hash,
+            "id_prefix": prefix,
+            "signature": signature,
+            "chunks": len(chunks),
+            # Strategy and parameters the chunks were cut with, carried into snapshots
+            "chunking": (chunking or {}).get(doc_id)
+        }
+
+    if stats["added"] or stats["updated"]:
+        manifest["version"] += 1
+        with span("persist"):
+            save_manifest(manifest, persist_directory)
+        get_answer_cache().invalidate(manifest["version"], persist_directory)
+    logger.info(f"Indexed documents: {stats}, embedding cache: {get_embedding_cache().stats()}")
+    return stats
+
+def index_stream(
+    vector_store,
+    doc_id: str,
+    source_hash: str,
+    signature: str,
+    chunks: Iterable[Document],
+    persist_directory: str = VECTOR_STORE_DIR,
+    progress_callback: Optional[Callable[[int, Optional[int]], None]] = None,
+    chunking: Optional[dict] = None
+) -> Optional[int]:
+    """Index one document from a chunk stream in bounded memory, None if it was already indexed.
+    A chunking dict filled in while streaming (autotuned parameters) is recorded as it is at the end"""
+    entry = load_manifest(persist_directory)["documents"].get(doc_id)
+    if entry and entry["signature"] == signature:
+        logger.info(f"{doc_id} is already indexed with the same content and chunking")
+        return None
+    prefix = chunk_id_prefix(doc_id, source_hash)
+
+    # BM25 gets the chunks in batches as they stream past, so large documents are found by exact terms too
+    lexical_index = get_lexical_index(lexical_dir(persist_directory))
+    # A new source writes new chunk IDs: its BM25 parts are staged so the old version stays searchable
+    # until this one is complete. The same source overwrites the old chunks, so the old version goes first
+    staged = entry is not None and entry.get("id_prefix") != prefix
+    lexical_doc_id = f"{doc_id}\0streaming" if staged else doc_id
+    lexical_index.remove_document(lexical_doc_id)
+
+    def add_lexical(start, batch):
+        lexical_index.append_chunks(lexical_doc_id, signature, [f"{prefix}:{start + i}" for i in range(len(batch))], batch)
+
+    def tagged(chunks):
+        batch, start = [], 0
+        for chunk in chunks:
+            chunk.metadata["doc_id"] = doc_id
+            chunk.metadata["source_hash"] = source_hash
+            batch.append(chunk)
+            if len(batch) >= LEXICAL_BATCH_SIZE:
+                add_lexical(start, batch)
+                start, batch = start + len(batch), []
+            yield chunk
+        if batch:
+            add_lexical(start, batch)
+
+    done = 0
+
+    def report(batch_count):
+        nonlocal done
+        done += batch_count
+        if progress_callback:
+            progress_callback(done, None)
+
+    ids = (f"{prefix}:{offset}" for offset in count())
+    try:
+        written = embed_and_store(vector_store, tagged(chunks), ids, progress_callback=report)
+    except Exception:
+        # The manifest still describes the old version, which the partial BM25 parts don't belong to
+        lexical_index.remove_document(lexical_doc_id)
+        raise
+    if staged:
+        lexical_index.rename_document(lexical_doc_id, doc_id)
+
+    # Reload, other documents may have been indexed while this one streamed
+    manifest = load_manifest(persist_directory)
+    entry = manifest["documents"].get(doc_id)
+    if entry:
+        # Same source keeps IDs below the new chunk count, anything else from the old version is stale
+        first_stale = written if entry.get("id_prefix") == prefix else 0
+        for start in range(first_stale, entry["chunks"], EMBEDDING_BATCH_SIZE * 100):
+            stop = min(start + EMBEDDING_BATCH_SIZE * 100, entry["chunks"])
+            vector_store.delete(ids=entry_chunk_ids(entry, start, stop))
+    manifest["documents"][doc_id] = {
+        "source_hash": source_hash,
+        "id_prefix": prefix,
+        "signature": signature,
+        "chunks": written,
+        "chunking": dict(chunking) if chunking is not None else None
+    }
+    manifest["version"] += 1
+    save_manifest(manifest, persist_directory)
+    get_answer_cache().invalidate(manifest["version"], persist_directory)
+    logger.info(f"Streamed {written} chunks of {doc_id} into the index")
+    return written
+
+def index_lexical(documents: List[Document], persist_directory: str = VECTOR_STORE_DIR) -> int:
+    """Add changed documents to the BM25 index under the same chunk IDs as the vector store"""
+    lexical_index = get_lexical_index(lexical_dir(persist_directory))
+    indexed = 0
+    for doc_id, chunks in group_by_document(documents).items():
+        signature = chunk_signature(chunks)
+        if lexical_index.has_document(doc_id, signature):
+            continue
+        source_hash = chunks[0].metadata.get("source_hash") or signature
+        prefix = chunk_id_prefix(doc_id, source_hash)
+        ids = [f"{prefix}:{offset}" for offset in range(len(chunks))]
+        lexical_index.add_document(doc_id, signature, ids, chunks)
+        indexed += len(chunks)
+    if indexed:
+        logger.info(f"Added {indexed} chunks to the lexical index")
+    return indexed
+
+def remove_document(vector_store, doc_id: str, persist_directory: str = VECTOR_STORE_DIR) -> bool:
+    """Delete a single document's chunks from the index"""
+    get_lexical_index(lexical_dir(persist_directory)).remove_document(doc_id)
+    manifest = load_manifest(persist_directory)
+    entry = manifest["documents"].pop(doc_id, None)
+    if entry is None:
+        logger.warning(f"Document not found in index: {doc_id}")
+        return False
+    ids = entry_chunk_ids(entry)
+    if ids:
+        vector_store.delete(ids=ids)
+    manifest["version"] += 1
+    save_manifest(manifest, persist_directory)
+    get_answer_cache().invalidate(manifest["version"], persist_directory)
+    logger.info(f"Removed {len(ids)} chunks for document {doc_id}")
+    return True
+
+def active_store_dir(workspace: Optional[str] = None) -> str:
+    """Store questions are answered from: the published snapshot when serving one, else the workspace's index"""
+    if VECTOR_BACKEND == "snapshot":
+        # Read per call, so a newly published snapshot is picked up by the next question
+        from core.snapshot import current_store_dir
+        return current_store_dir()
+    return workspace_dir(workspace)
+
+def get_index_version(persist_directory: Optional[str] = None) -> int:
+    """Counter bumped whenever the indexed content changes"""
+    return load_manifest(persist_directory or active_store_dir())["version"]
+
+def list_indexed_documents(persist_directory: Optional[str] = None) -> Dict[str, dict]:
+    """Documents currently held in the index"""
+    return load_manifest(persist_directory or active_store_dir())["documents"]
+
+def open_vector_store(persist_directory: str = VECTOR_STORE_DIR):
+    """Shared handle of the configured backend's store"""
+    if VECTOR_BACKEND in ("numpy", "snapshot"):
+        # Snapshots are NumPy stores, opening one only maps its files
+        return get_numpy_store(persist_directory, EMBEDDING_MODEL)
+    return get_chroma_store(*chroma_location(persist_directory), EMBEDDING_MODEL)
+
+def open_lexical_index(persist_directory: str = VECTOR_STORE_DIR):
+    """BM25 index that belongs to a store"""
+    return get_lexical_index(lexical_dir(persist_directory))
+
+def release_store(persist_directory: str):
+    """Drop the cached handles and BM25 index of an idle store, they are reopened from disk on next use"""
+    drop_lexical_index(lexical_dir(persist_directory))
+    if VECTOR_BACKEND in ("numpy", "snapshot"):
+        get_numpy_store.clear(persist_directory, EMBEDDING_MODEL)
+    else:
+        get_chroma_store.clear(*chroma_location(persist_directory), EMBEDDING_MODEL)
+
+def get_vector_store(documents=None, force_refresh=False, progress_callback=None, persist_directory=VECTOR_STORE_DIR,
+                     chunking=None):
+    """Get the shared vector store, indexing new documents incrementally; chunking is recorded per doc_id"""
+    if VECTOR_BACKEND == "snapshot":
+        if documents:
+            raise RuntimeError("Serving a read-only snapshot, ingest into a chroma or numpy index and export it")
+        return open_vector_store(active_store_dir())
+
     if documents and force_refresh:
-        # Reset existing collections when new documents are added
+        # Full rebuild of this workspace only: drop its collection and forget what it indexed
         try:
-            chroma_client.reset()
-            logger.info("Reset ChromaDB collections for new documents")
+            if VECTOR_BACKEND == "numpy":
+                get_numpy_store(persist_directory, EMBEDDING_MODEL).reset()
+            else:
+                client_path, collection_name = chroma_location(persist_directory)
+                if collection_name in [c if isinstance(c, str) else c.name for c in get_chroma_client(client_path).list_collections()]:
+                    get_chroma_client(client_path).delete_collection(collection_name)
+            save_manifest({"version": get_index_version(persist_directory) + 1, "documents": {}}, persist_directory)
+            # Other workspaces keep their handles
+            release_store(persist_directory)
+            get_answer_cache().invalidate(store=persist_directory)
+            get_lexical_index(lexical_dir(persist_directory)).clear()
+            logger.info(f"Reset the vector store of {persist_directory} for new documents")
         except Exception as e:
-            logger.warning(f"Error resetting ChromaDB: {str(e)}")
-        
-        return Chroma.from_documents(
-            documents=documents,
-            embedding=embeddings,
-            persist_directory=persist_directory,
-            client=chroma_client
-        )
-    else:
-        # Load existing vector store
-        return Chroma(
-            embedding_function=embeddings,
-            persist_directory=persist_directory,
-            client=chroma_client
-        )
+            logger.warning(f"Error resetting the vector store: {str(e)}")
+
+    # Client and embedder are shared across sessions, only indexing work happens here
+    vector_store = open_vector_store(persist_directory)
+
+    if documents:
+        index_lexical(documents, persist_directory)
+        index_documents(vector_store, documents, persist_directory, progress_callback, chunking=chunking)
+    return vector_store
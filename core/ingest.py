@@ -0,0 +1,316 @@
+# Document loading and splitting, run in a process pool for multi-file ingestion
+import os
+import time
+import json
+import hashlib
+import logging
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from langchain_community.document_loaders import (
+    TextLoader,
+    Docx2txtLoader,
+    UnstructuredWordDocumentLoader,
+    UnstructuredMarkdownLoader
+)
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.schema import Document
+from core.chunking import (
+    AUTOTUNE_SAMPLE_TOKENS,
+    BoundedMarkdownSplitter,
+    SentenceSplitter,
+    autotune_chunking,
+    autotune_settings,
+    semantic_chunks,
+    token_splitter
+)
+from utils.helpers import get_file_extension
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("CHATDOC_INGEST_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("CHATDOC_PDF_PAGES_PER_TASK", "25"))
+# Files at least this large are streamed loader -> splitter -> embedder instead of loaded whole
+STREAMING_THRESHOLD_BYTES = int(float(os.getenv("CHATDOC_STREAMING_THRESHOLD_MB", "64")) * 1024 * 1024)
+STREAM_BLOCK_CHARS = int(os.getenv("CHATDOC_STREAM_BLOCK_CHARS", str(1 << 20)))
+# Server folder the UI may ingest from, unset disables folder ingestion from the browser
+INGEST_ROOT = os.getenv("CHATDOC_INGEST_ROOT", "")
+
+# Formats parsed and split in worker processes, tabular and geo formats stay in the UI process
+TEXT_FORMATS = {'.txt', '.pdf', '.docx', '.doc', '.md'}
+
+CHUNKING_STRATEGIES = {
+    'recursive': 'Recursive Character (Smart)',
+    'token': 'Token-based',
+    'markdown': 'Markdown-aware',
+    'semantic': 'Semantic (embedding boundaries)',
+    'auto': 'Autotuned per document'
+}
+# Strategies whose size settings are prompt tokens rather than characters
+TOKEN_STRATEGIES = {'token', 'markdown', 'semantic', 'auto'}
+
+def get_text_splitter(strategy: str, params: Dict[str, Any]):
+    """Get appropriate text splitter based on strategy"""
+    if strategy == 'recursive':
+        return RecursiveCharacterTextSplitter(
+            chunk_size=params['chunk_size'],
+            chunk_overlap=params['chunk_overlap'],
+            length_function=len,
+            separators=["\n\n", "\n", " ", ""]
+        )
+    elif strategy in ('token', 'auto'):
+        # 'auto' arrives here with the parameters tuned for the file
+        return token_splitter(params['chunk_size'], params['chunk_overlap'])
+    elif strategy == 'markdown':
+        # Header sections, bounded to chunk_size tokens
+        return BoundedMarkdownSplitter(**({'max_tokens': params['chunk_size']} if 'chunk_size' in params else {}))
+    elif strategy == 'semantic':
+        # Sentences here, grouped at embedding-similarity breaks by group_semantic_chunks
+        return SentenceSplitter(params['chunk_size'])
+    else:
+        raise ValueError(f"Unknown chunking strategy: {strategy}")
+
+def split_documents(text_splitter, documents: List[Document]) -> List[Document]:
+    """Split documents, also for splitters that only implement split_text"""
+    if hasattr(text_splitter, "split_documents"):
+        return text_splitter.split_documents(documents)
+    chunks = []
+    for doc in documents:
+        for chunk in text_splitter.split_text(doc.page_content):
+            chunk.metadata = {**doc.metadata, **chunk.metadata}
+            chunks.append(chunk)
+    return chunks
+
+def get_loader(file_path: str, file_extension: str, strategy: Optional[str] = None):
+    """Loader for the text-like formats"""
+    if file_extension == '.txt':
+        return TextLoader(file_path)
+    elif file_extension in ['.docx', '.doc']:
+        try:
+            return Docx2txtLoader(file_path)
+        except Exception:
+            # Fallback to UnstructuredWordDocumentLoader if Docx2txtLoader fails
+            return UnstructuredWordDocumentLoader(file_path)
+    elif file_extension == '.md':
+        # The markdown splitter needs the raw '#' headers, which Unstructured strips
+        if strategy == 'markdown':
+            return TextLoader(file_path, encoding="utf-8")
+        return UnstructuredMarkdownLoader(file_path)
+    raise ValueError(f"Unsupported file type: {file_extension}")
+
+def file_sha256(file_path: str) -> str:
+    """Content hash of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def pdf_page_count(file_path: str) -> int:
+    """Number of pages in a PDF"""
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def load_pdf_pages(file_path: str, start: int, end: int) -> List[Document]:
+    """Pages [start, end) of a PDF, with the same metadata PyPDFLoader produces"""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [
+        Document(page_content=reader.pages[page].extract_text() or "", metadata={"source": file_path, "page": page})
+        for page in range(start, min(end, len(reader.pages)))
+    ]
+
+def load_and_split(task: tuple) -> Tuple[List[Document], Dict[str, float]]:
+    """Worker entry point: load one file (or PDF page range) and split it into chunks"""
+    file_path, file_extension, page_range, source_metadata, strategy, chunk_params = task
+    start_time = time.perf_counter()
+    if file_extension == '.pdf':
+        documents = load_pdf_pages(file_path, *page_range)
+    else:
+        documents = get_loader(file_path, file_extension, strategy).load()
+    loaded_time = time.perf_counter()
+
+    chunks = split_documents(get_text_splitter(strategy, chunk_params), documents)
+    for chunk in chunks:
+        chunk.metadata.update(source_metadata)
+    return chunks, {"load": loaded_time - start_time, "split": time.perf_counter() - loaded_time}
+
+def build_tasks(files: List[Tuple[str, dict]], strategy: str, chunk_params: Dict[str, Any],
+                pages_per_task: int = PDF_PAGES_PER_TASK,
+                file_params: Optional[Dict[str, Dict[str, Any]]] = None) -> List[tuple]:
+    """One task per file, PDFs fanned out into page ranges"""
+    tasks = []
+    for file_path, source_metadata in files:
+        # Autotuned files carry their own chunk parameters
+        chunk_params = (file_params or {}).get(file_path, chunk_params)
+        file_extension = get_file_extension(source_metadata.get("doc_id", file_path))
+        if file_extension == '.pdf':
+            pages = pdf_page_count(file_path)
+            for start in range(0, pages, pages_per_task):
+                tasks.append((file_path, file_extension, (start, start + pages_per_task), source_metadata, strategy, chunk_params))
+        else:
+            tasks.append((file_path, file_extension, None, source_metadata, strategy, chunk_params))
+    return tasks
+
+_ingest_pool = None
+_ingest_pool_lock = threading.Lock()
+
+def get_ingest_pool() -> ProcessPoolExecutor:
+    """Process pool shared by all ingestion jobs"""
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            _ingest_pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS)
+            logger.info(f"Started ingestion pool with {INGEST_WORKERS} workers")
+        return _ingest_pool
+
+def sample_documents(file_path: str, file_extension: str, sample_tokens: int = AUTOTUNE_SAMPLE_TOKENS) -> List[Document]:
+    """The first few pages (or characters) of a file, enough to tune its chunking on"""
+    if file_extension == '.pdf':
+        return load_pdf_pages(file_path, 0, 5)
+    if file_extension in ['.txt', '.md']:
+        first_block = next(iter_text_blocks(file_path, sample_tokens * 6), None)
+        return [first_block] if first_block else []
+    return get_loader(file_path, file_extension).load()
+
+def autotune_files(files: List[Tuple[str, dict]], timings: dict) -> Dict[str, Dict[str, Any]]:
+    """Tuned chunk_size/chunk_overlap per file path"""
+    from core.embeddings import get_embeddings
+    embeddings = get_embeddings()
+    file_params = {}
+    start_time = time.perf_counter()
+    for file_path, source_metadata in files:
+        doc_id = source_metadata.get("doc_id", file_path)
+        samples = sample_documents(file_path, get_file_extension(doc_id))
+        file_params[file_path], _ = autotune_chunking(samples, embeddings)
+        timings.setdefault("autotuned", {})[doc_id] = file_params[file_path]
+    timings["autotune"] = time.perf_counter() - start_time
+    return file_params
+
+def group_semantic_chunks(units: List[Document], chunk_params: Dict[str, Any]) -> List[Document]:
+    """Second stage of semantic chunking, in this process so sentence embeddings go through the shared scheduler"""
+    from core.embeddings import get_embeddings
+    return semantic_chunks(units, get_embeddings(), chunk_params['chunk_size'])
+
+def iter_ingested_chunks(files: List[Tuple[str, dict]], strategy: str, chunk_params: Dict[str, Any],
+                         timings: Optional[dict] = None) -> Iterator[Document]:
+    """Single ordered stream of chunks from files parsed and split across the process pool"""
+    timings = timings if timings is not None else {}
+    start_time = time.perf_counter()
+    timings.update({"load": 0.0, "split": 0.0, "chunks": 0})
+    file_params = autotune_files(files, timings) if strategy == 'auto' else None
+    tasks = build_tasks(files, strategy, chunk_params, file_params=file_params)
+    timings["tasks"] = len(tasks)
+
+    # Results come back in task order so chunk offsets, and therefore chunk IDs, stay stable
+    if len(tasks) > 1:
+        results = get_ingest_pool().map(load_and_split, tasks)
+    else:
+        results = map(load_and_split, tasks)
+    for chunks, task_timings in results:
+        timings["load"] += task_timings["load"]
+        timings["split"] += task_timings["split"]
+        if strategy == 'semantic':
+            group_start = time.perf_counter()
+            chunks = group_semantic_chunks(chunks, chunk_params)
+            timings["split"] += time.perf_counter() - group_start
+        timings["chunks"] += len(chunks)
+        yield from chunks
+    timings["wall"] = time.perf_counter() - start_time
+    logger.info(f"Ingestion timings: {timings}")
+
+def find_documents(directory: str) -> List[str]:
+    """Supported files under a directory, in a stable order"""
+    paths = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if get_file_extension(name) in TEXT_FORMATS:
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+def within_ingest_root(path: str, root: str = INGEST_ROOT) -> bool:
+    """Whether a path resolves (symlinks included) to somewhere below the ingest root"""
+    if not root:
+        return False
+    root = os.path.realpath(root)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+def find_ingestible_documents(folder: str, root: str = INGEST_ROOT) -> List[str]:
+    """Supported files under a folder given relative to the ingest root, refusing anything outside it"""
+    if not root:
+        raise ValueError("Folder ingestion is disabled, set CHATDOC_INGEST_ROOT to allow it")
+    path = os.path.join(root, folder)
+    if not within_ingest_root(path, root):
+        raise ValueError(f"{folder} is outside the ingest root")
+    if not os.path.isdir(path):
+        raise ValueError(f"Folder not found: {folder}")
+    # Symlinks inside the folder must not lead out of the root either
+    return [file_path for file_path in find_documents(path) if within_ingest_root(file_path, root)]
+
+def ingest_key(source_hash: str, strategy: str, chunk_params: Dict[str, Any]) -> str:
+    """Identity of a file plus the chunking that was applied to it"""
+    settings = {"strategy": strategy, **chunk_params}
+    if strategy == 'auto':
+        # Parameters are picked per file, so the tuning setup decides the chunks
+        settings["autotune"] = autotune_settings()
+    settings = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(f"{source_hash}:{settings}".encode("utf-8")).hexdigest()
+
+def iter_text_blocks(file_path: str, block_chars: int = STREAM_BLOCK_CHARS) -> Iterator[Document]:
+    """Read a text/markdown file in blocks cut at paragraph boundaries"""
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        carry = ""
+        offset = 0
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                break
+            text = carry + block
+            # Cut at the last paragraph (or line) break so chunks don't straddle blocks mid-sentence
+            cut = text.rfind("\n\n")
+            if cut <= 0:
+                cut = text.rfind("\n")
+            if cut <= 0:
+                cut = len(text)
+            yield Document(page_content=text[:cut], metadata={"source": file_path, "offset": offset})
+            offset += cut
+            carry = text[cut:]
+        if carry.strip():
+            yield Document(page_content=carry, metadata={"source": file_path, "offset": offset})
+
+def iter_pdf_pages(file_path: str) -> Iterator[Document]:
+    """PDF pages one at a time"""
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    for page in range(len(reader.pages)):
+        yield Document(page_content=reader.pages[page].extract_text() or "", metadata={"source": file_path, "page": page})
+
+def iter_stream_chunks(file_path: str, source_metadata: dict, strategy: str,
+                       chunk_params: Dict[str, Any], chunking: Optional[dict] = None) -> Iterator[Document]:
+    """Chunks of one large file, produced a page or block at a time; autotuned parameters are added to chunking"""
+    file_extension = get_file_extension(source_metadata.get("doc_id", file_path))
+    if file_extension == '.pdf':
+        pieces = iter_pdf_pages(file_path)
+    elif file_extension in ['.txt', '.md']:
+        pieces = iter_text_blocks(file_path)
+    else:
+        pieces = get_loader(file_path, file_extension).lazy_load()
+    if strategy == 'auto':
+        # Tuned on the first page or block, the rest of the file is split the same way
+        first = next(pieces, None)
+        if first is None:
+            return
+        pieces = itertools.chain([first], pieces)
+        from core.embeddings import get_embeddings
+        chunk_params, _ = autotune_chunking([first], get_embeddings())
+        if chunking is not None:
+            chunking.update(chunk_params)
+    text_splitter = get_text_splitter(strategy, chunk_params)
+    for piece in pieces:
+        chunks = split_documents(text_splitter, [piece])
+        if strategy == 'semantic':
+            chunks = group_semantic_chunks(chunks, chunk_params)
+        for chunk in chunks:
+            chunk.metadata.update(source_metadata)
+            yield chunk
@@ -0,0 +1,263 @@
+# Background ingestion jobs: parse, split and index uploads off the Streamlit script thread
+import os
+import time
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from core.chunking import tuned_params
+from core.ingest import STREAMING_THRESHOLD_BYTES, ingest_key, iter_ingested_chunks, iter_stream_chunks
+from core.embeddings import (
+    EMBEDDING_BATCH_SIZE,
+    VECTOR_STORE_DIR,
+    chunk_id,
+    chunk_id_prefix,
+    get_vector_store,
+    index_documents,
+    index_lexical,
+    index_stream,
+    list_indexed_documents,
+    remove_document
+)
+from core.scheduler import current_session_id, request_context
+from core.workspaces import WORKSPACE_MAX_CHUNKS, check_chunk_quota, get_workspace_registry, quota_guard, workspace_chunks
+from utils.helpers import PeakRssTracker, trace, record_span
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs remembered for deduplication and status display
+JOB_HISTORY = int(os.getenv("CHATDOC_JOB_HISTORY", "20"))
+# Chunks of a streamed document kept for the document viewer
+STREAM_PREVIEW_CHUNKS = 50
+
+def job_key(files: List[Tuple[str, dict]], documents: List[Document], strategy: str, chunk_params: Dict[str, Any],
+            persist_directory: str = VECTOR_STORE_DIR) -> str:
+    """Identity of an ingestion: the workspace, every file hash and the chunking applied to it"""
+    keys = [persist_directory]
+    keys += sorted(ingest_key(metadata["source_hash"], strategy, chunk_params) for _, metadata in files)
+    # Structured files are summarized, not chunked, so only their content matters
+    keys += sorted({ingest_key(doc.metadata.get("source_hash", ""), "structured", {}) for doc in documents})
+    return hashlib.sha256(json.dumps(keys).encode("utf-8")).hexdigest()
+
+class IngestionJob:
+    """One ingestion of a set of staged files, with progress readable from any session"""
+
+    def __init__(self, key: str, files: List[Tuple[str, dict]], documents: List[Document],
+                 strategy: str, chunk_params: Dict[str, Any], staging_dir: Optional[str] = None,
+                 persist_directory: str = VECTOR_STORE_DIR):
+        self.key = key
+        self.persist_directory = persist_directory  # the workspace's index
+        self.files = files
+        self.documents = documents
+        self.strategy = strategy
+        self.chunk_params = chunk_params
+        self.staging_dir = staging_dir
+        # Embedding slots are queued under the submitting session, apart from its own questions
+        self.session = f"ingest:{current_session_id()}"
+        self.status = "queued"  # queued, running, done or failed
+        self.stage = "queued"
+        self.done = 0
+        self.total: Optional[int] = None
+        self.chunks: List[Document] = []  # what the document viewer shows once the job is done
+        self.stats: Dict[str, Any] = {}
+        self.signatures: Dict[str, str] = {}  # doc_id -> manifest signature written by this job
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def doc_ids(self) -> List[str]:
+        ids = [metadata["doc_id"] for _, metadata in self.files]
+        ids += [doc.metadata["doc_id"] for doc in self.documents if "doc_id" in doc.metadata]
+        return list(dict.fromkeys(ids))
+
+    def still_indexed(self) -> bool:
+        """True while the index holds exactly what this job wrote"""
+        indexed = list_indexed_documents(self.persist_directory)
+        return all(doc_id in indexed and indexed[doc_id]["signature"] == signature
+                   for doc_id, signature in self.signatures.items())
+
+    def chunking(self, timings: dict) -> Dict[str, dict]:
+        """Strategy and parameters per document, as recorded in the index manifest"""
+        chunking = {doc_id: {"strategy": "structured"} for doc_id in self.doc_ids()}
+        for _, metadata in self.files:
+            chunking[metadata["doc_id"]] = {"strategy": self.strategy, **tuned_params(timings, metadata["doc_id"], self.chunk_params)}
+        return chunking
+
+    def report(self, done: int, total: Optional[int]):
+        self.done, self.total = done, total
+
+    def _cleanup(self):
+        if self.staging_dir:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            self.staging_dir = None
+
+    def run(self):
+        with request_context(self.session):
+            self._run()
+
+    def _run(self):
+        self.status = "running"
+        rss = PeakRssTracker()
+        try:
+            text_files = [(path, metadata) for path, metadata in self.files if os.path.getsize(path) < STREAMING_THRESHOLD_BYTES]
+            streamed_files = [(path, metadata) for path, metadata in self.files if os.path.getsize(path) >= STREAMING_THRESHOLD_BYTES]
+            vector_store = get_vector_store(persist_directory=self.persist_directory)
+
+            with get_workspace_registry().pin(self.persist_directory), trace("ingestion", files=len(self.files)):
+                # Parse and split text documents across worker processes
+                self.stage = "parsing"
+                timings = {}
+                chunks = list(iter_ingested_chunks(text_files, self.strategy, self.chunk_params, timings)) if text_files else []
+                if text_files:
+                    # Summed over the worker processes, so they can exceed the wall time
+                    record_span("load", timings["load"])
+                    record_span("split", timings["split"])
+                    self.stats["timings"] = timings
+                chunks.extend(self.documents)
+                rss.sample()
+                # Fail before any embedding work rather than halfway through
+                batch_doc_ids = {chunk.metadata.get("doc_id") for chunk in chunks}
+                check_chunk_quota(self.persist_directory, batch_doc_ids, len(chunks))
+
+                # Very large files go loader -> splitter -> embedder without ever being held whole
+                previews = []
+                for file_path, metadata in streamed_files:
+                    self.stage = f"streaming {metadata['doc_id']}"
+                    signature = ingest_key(metadata["source_hash"], self.strategy, self.chunk_params)
+                    preview = []
+
+                    def keep_preview(stream):
+                        for chunk in stream:
+                            if len(preview) < STREAM_PREVIEW_CHUNKS:
+                                preview.append(chunk)
+                            yield chunk
+
+                    def report_stream(done, total):
+                        rss.sample()
+                        self.report(done, total)
+
+                    # The chunk count of a streamed file is only known at the end, so the quota is checked on the way
+                    remaining = WORKSPACE_MAX_CHUNKS - workspace_chunks(self.persist_directory, batch_doc_ids | {metadata["doc_id"]}) - len(chunks)
+                    if WORKSPACE_MAX_CHUNKS and remaining <= 0:
+                        raise RuntimeError(f"Workspace chunk quota of {WORKSPACE_MAX_CHUNKS} chunks is used up")
+                    guard = {"chunks": 0, "exceeded": False}
+                    # Autotuning adds the parameters it picked while the file streams, the manifest records those
+                    chunking = {"strategy": self.strategy, **self.chunk_params}
+                    try:
+                        written = index_stream(
+                            vector_store,
+                            metadata["doc_id"],
+                            metadata["source_hash"],
+                            signature,
+                            keep_preview(quota_guard(iter_stream_chunks(file_path, metadata, self.strategy, self.chunk_params, chunking),
+                                                     remaining if WORKSPACE_MAX_CHUNKS else 0, guard)),
+                            progress_callback=report_stream,
+                            chunking=chunking,
+                            persist_directory=self.persist_directory
+                        )
+                    except RuntimeError:
+                        if guard["exceeded"]:
+                            self._drop_partial_stream(vector_store, metadata, guard["chunks"])
+                        raise
+                    self.stats.setdefault("streamed", {})[metadata["doc_id"]] = written
+                    self.signatures[metadata["doc_id"]] = signature
+                    previews.extend(preview)
+
+            if chunks:
+                # Build the BM25 index first so exact-term lookups work before embedding finishes
+                self.stage = "indexing"
+                self.report(0, len(chunks))
+                with trace("indexing", chunks=len(chunks)):
+                    index_lexical(chunks, self.persist_directory)
+                    self.stats["index"] = index_documents(vector_store, chunks, persist_directory=self.persist_directory,
+                                                          progress_callback=self.report, chunking=self.chunking(timings))
+                indexed = list_indexed_documents(self.persist_directory)
+                for doc_id in dict.fromkeys(chunk.metadata.get("doc_id") for chunk in chunks):
+                    if doc_id in indexed:
+                        self.signatures[doc_id] = indexed[doc_id]["signature"]
+
+            self.chunks = chunks or previews
+            self.stats.update({
+                "documents": len(self.doc_ids()),
+                "chunks": len(chunks),
+                "avg_chunk_chars": sum(len(chunk.page_content) for chunk in chunks) // len(chunks) if chunks else 0,
+                "memory": rss.summary()
+            })
+            self.status = "done"
+            logger.info(f"Ingestion job {self.key[:12]} done: {self.stats}")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Ingestion job {self.key[:12]} failed: {str(e)}")
+        finally:
+            self.stage = self.status
+            self.finished_at = time.time()
+            # Chunks carry everything the index needs, the staged files are no longer read
+            self.files = [(None, metadata) for _, metadata in self.files]
+            self._cleanup()
+
+    def _drop_partial_stream(self, vector_store, metadata: dict, written: int):
+        """Delete the chunks a streamed document wrote before it hit the quota, nothing of it stays searchable"""
+        ids = [chunk_id(metadata["doc_id"], metadata["source_hash"], offset) for offset in range(written)]
+        for start in range(0, len(ids), EMBEDDING_BATCH_SIZE * 100):
+            vector_store.delete(ids=ids[start:start + EMBEDDING_BATCH_SIZE * 100])
+        # Only an older version of the same source shares chunk ids with the new one and was partly overwritten,
+        # any other indexed version is untouched and stays searchable
+        entry = list_indexed_documents(self.persist_directory).get(metadata["doc_id"])
+        if entry and entry.get("id_prefix") == chunk_id_prefix(metadata["doc_id"], metadata["source_hash"]):
+            remove_document(vector_store, metadata["doc_id"], self.persist_directory)
+        logger.warning(f"Dropped {written} chunks of {metadata['doc_id']} streamed past the workspace quota")
+
+class IngestionJobs:
+    """Process-wide ingestion queue, identical submissions share one job"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        # One job at a time keeps manifest updates ordered, each job parallelizes internally
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-job")
+
+    def submit(self, files: List[Tuple[str, dict]], documents: List[Document], strategy: str,
+               chunk_params: Dict[str, Any], staging_dir: Optional[str] = None,
+               persist_directory: str = VECTOR_STORE_DIR) -> IngestionJob:
+        """Queue an ingestion unless the same files and chunking are queued, running or still indexed"""
+        key = job_key(files, documents, strategy, chunk_params, persist_directory)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and (not job.finished or (job.status == "done" and job.still_indexed())):
+                logger.info(f"Ingestion job {key[:12]} already {job.status}, not resubmitting")
+                if staging_dir and staging_dir != job.staging_dir:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+                return job
+            job = IngestionJob(key, files, documents, strategy, chunk_params, staging_dir, persist_directory)
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            for old_key in [k for k, old in self._jobs.items() if old.finished][:max(len(self._jobs) - JOB_HISTORY, 0)]:
+                del self._jobs[old_key]
+        self._pool.submit(job.run)
+        logger.info(f"Queued ingestion job {key[:12]} for {len(job.doc_ids())} document(s)")
+        return job
+
+    def get(self, key: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(key)
+
+_ingestion_jobs = None
+_ingestion_jobs_lock = threading.Lock()
+
+def get_ingestion_jobs() -> IngestionJobs:
+    """Process-wide ingestion job queue"""
+    global _ingestion_jobs
+    with _ingestion_jobs_lock:
+        if _ingestion_jobs is None:
+            _ingestion_jobs = IngestionJobs()
+        return _ingestion_jobs
@@ -0,0 +1,201 @@
+# In-process BM25 inverted index persisted next to the vector store
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_DIR = os.getenv("CHATDOC_LEXICAL_INDEX_DIR", "data/lexical_index")
+TOKEN_PATTERN = re.compile(r"\w[\w.\-/:]*")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, keeping IDs like 'A-12' or '3.5' intact"""
+    return [token.strip(".-/:") for token in TOKEN_PATTERN.findall(text.lower())]
+
+class BM25Index:
+    """Inverted index with per-document shards so updates only touch the changed document"""
+
+    def __init__(self, directory: str = LEXICAL_INDEX_DIR, k1: float = 1.5, b: float = 0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.chunks: Dict[str, Tuple[str, dict]] = {}
+        self.documents: Dict[str, dict] = {}
+        self.total_length = 0
+        self._load()
+
+    def _shard_path(self, doc_id: str, part: Optional[int] = None) -> str:
+        name = hashlib.sha1(doc_id.encode("utf-8")).hexdigest()
+        # Streamed documents are written in parts, one file per batch
+        return os.path.join(self.directory, f"{name}.json" if part is None else f"{name}.part{part:06d}.json")
+
+    def _shard_files(self, doc_id: str) -> List[str]:
+        name = hashlib.sha1(doc_id.encode("utf-8")).hexdigest()
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                if f == f"{name}.json" or (f.startswith(f"{name}.part") and f.endswith(".json"))]
+
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r") as f:
+                    self._add_shard(json.load(f))
+            except Exception as e:
+                logger.warning(f"Skipping unreadable lexical index shard {name}: {str(e)}")
+        logger.info(f"Loaded lexical index with {len(self.chunks)} chunks from {self.directory}")
+
+    def _add_shard(self, shard: dict):
+        chunk_ids = []
+        for chunk in shard["chunks"]:
+            cid = chunk["id"]
+            for term, count in chunk["tf"].items():
+                self.postings.setdefault(term, {})[cid] = count
+            self.lengths[cid] = chunk["length"]
+            self.total_length += chunk["length"]
+            self.chunks[cid] = (chunk["text"], chunk["metadata"])
+            chunk_ids.append(cid)
+        # Parts of a streamed document add up to one entry
+        entry = self.documents.setdefault(shard["doc_id"], {"signature": shard["signature"], "chunk_ids": []})
+        entry["chunk_ids"].extend(chunk_ids)
+
+    def _drop(self, doc_id: str):
+        entry = self.documents.pop(doc_id, None)
+        if entry is None:
+            return
+        for cid in entry["chunk_ids"]:
+            text, _ = self.chunks.pop(cid)
+            self.total_length -= self.lengths.pop(cid)
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(cid, None)
+                    if not postings:
+                        del self.postings[term]
+
+    def has_document(self, doc_id: str, signature: str) -> bool:
+        """True when this exact version of the document is already indexed"""
+        entry = self.documents.get(doc_id)
+        return entry is not None and entry["signature"] == signature
+
+    def _build_shard(self, doc_id: str, signature: str, ids: List[str], chunks: List[Document]) -> dict:
+        shard = {
+            "doc_id": doc_id,
+            "signature": signature,
+            "chunks": []
+        }
+        for cid, chunk in zip(ids, chunks):
+            terms = tokenize(chunk.page_content)
+            shard["chunks"].append({
+                "id": cid,
+                "text": chunk.page_content,
+                "metadata": chunk.metadata,
+                "tf": dict(Counter(terms)),
+                "length": len(terms)
+            })
+        return shard
+
+    def _write_shard(self, shard: dict, path: str):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(shard, f)
+        os.replace(f"{path}.tmp", path)
+
+    def add_document(self, doc_id: str, signature: str, ids: List[str], chunks: List[Document]):
+        """Index (or re-index) one source document and persist its shard"""
+        shard = self._build_shard(doc_id, signature, ids, chunks)
+        with self._lock:
+            self.remove_document(doc_id)
+            self._add_shard(shard)
+            self._write_shard(shard, self._shard_path(doc_id))
+
+    def append_chunks(self, doc_id: str, signature: str, ids: List[str], chunks: List[Document]):
+        """Add one batch of a streamed document as its own shard part; remove the old version first"""
+        shard = self._build_shard(doc_id, signature, ids, chunks)
+        with self._lock:
+            part = len(self._shard_files(doc_id))
+            self._add_shard(shard)
+            self._write_shard(shard, self._shard_path(doc_id, part))
+
+    def rename_document(self, doc_id: str, new_doc_id: str):
+        """Move a document's shards to another id, replacing whatever that id held"""
+        with self._lock:
+            self.remove_document(new_doc_id)
+            entry = self.documents.pop(doc_id, None)
+            if entry is None:
+                return
+            self.documents[new_doc_id] = entry
+            # One part at a time, a streamed document is never loaded whole
+            for part, path in enumerate(sorted(self._shard_files(doc_id))):
+                with open(path, "r") as f:
+                    shard = json.load(f)
+                shard["doc_id"] = new_doc_id
+                self._write_shard(shard, self._shard_path(new_doc_id, part))
+                os.remove(path)
+
+    def remove_document(self, doc_id: str):
+        """Forget one source document"""
+        with self._lock:
+            self._drop(doc_id)
+            for path in self._shard_files(doc_id):
+                os.remove(path)
+
+    def clear(self):
+        """Forget every document"""
+        with self._lock:
+            for doc_id in list(self.documents):
+                self.remove_document(doc_id)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[Document, float]]:
+        """Top-k chunks by BM25 score"""
+        with self._lock:
+            n = len(self.lengths)
+            if not n:
+                return []
+            avg_length = self.total_length / n or 1.0
+            scores = Counter()
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for cid, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[cid] / avg_length)
+                    scores[cid] += idf * tf * (self.k1 + 1) / (tf + norm)
+            results = []
+            for cid, score in scores.most_common(k):
+                text, metadata = self.chunks[cid]
+                results.append((Document(id=cid, page_content=text, metadata=dict(metadata)), score))
+            return results
+
+_lexical_indexes: Dict[str, BM25Index] = {}
+_lexical_index_lock = threading.Lock()
+
+def get_lexical_index(directory: str = LEXICAL_INDEX_DIR) -> BM25Index:
+    """Process-wide BM25 index per directory: the default workspace's, another workspace's or a snapshot's"""
+    with _lexical_index_lock:
+        if directory not in _lexical_indexes:
+            # Indexes of snapshots or workspaces deleted since are not needed any more
+            for stale in [path for path in _lexical_indexes if path != LEXICAL_INDEX_DIR and not os.path.isdir(path)]:
+                del _lexical_indexes[stale]
+            _lexical_indexes[directory] = BM25Index(directory)
+        return _lexical_indexes[directory]
+
+def drop_lexical_index(directory: str):
+    """Forget an idle index, it is loaded from its shards again on next use"""
+    with _lexical_index_lock:
+        _lexical_indexes.pop(directory, None)
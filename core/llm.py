@@ -1,11 +1,20 @@
 # from langchain_community.llms import Ollama
-from langchain_ollama import OllamaLLM
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda
 from langchain.prompts import PromptTemplate
-import ollama
 import streamlit as st
+import time
+from typing import List, Optional
+from langchain_core.documents import Document
 import logging
+from core.resources import get_llm_handle
+from core.lexical import get_lexical_index
+from core.retrieval import HybridRetriever
+from core.rerank import RERANK_CANDIDATES, get_reranker
+from core.context import CONTEXT_TOKEN_BUDGET, pack_context, count_tokens
+from core.embeddings import open_lexical_index, open_vector_store
+from core.models import get_model_manager
+from utils.helpers import span
 logger = logging.getLogger(__name__)
 
 def extract_model_names(models_info):
@@ -25,21 +34,34 @@ def extract_model_names(models_info):
 def get_available_models():
     """Get list of available Ollama models"""
     try:
-        models_info = ollama.list()
+        models_info = get_model_manager().list_models()
         model_names = extract_model_names(models_info)
         return model_names if model_names else ("llama3.2:latest",)
     except Exception as e:
         st.error(f"Error fetching models: {str(e)}")
         return ("llama3.2")
 
-def get_llm():
-    """Initialize and return Ollama LLM with selected model"""
-    selected_model = st.session_state.get('selected_model', 'llama3.2')
-    return OllamaLLM(model=selected_model)
+def get_llm(model_name=None):
+    """Return the shared Ollama LLM handle for the selected model"""
+    selected_model = model_name or st.session_state.get('selected_model', 'llama3.2')
+    return get_llm_handle(selected_model)
 
-def get_llm_chain(vector_store):
+def get_retriever(vector_store, lexical_index=None):
+    """Hybrid retriever over the vector store and the shared lexical index"""
+    # BM25 and vector hits fused, falls back to BM25 alone if the embedder is slow or down.
+    # With a reranker the fused pool is wide and only the reranked, deduplicated top k reach the prompt
+    reranker = get_reranker()
+    return HybridRetriever(
+        vector_store=vector_store,
+        lexical_index=lexical_index or get_lexical_index(),
+        k=3,
+        candidate_k=RERANK_CANDIDATES if reranker else 10,
+        reranker=reranker
+    )
+
+def get_llm_chain(vector_store, model_name=None, lexical_index=None):
     """Create and return the RAG chain"""
-    llm = get_llm()
+    llm = get_llm(model_name)
     
     template = """Answer the question based only on the following context:
     {context}
@@ -53,16 +75,49 @@ def get_llm_chain(vector_store):
         input_variables=["context", "question"]
     )
     
-    retriever = vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 3}
-    )
+    retriever = get_retriever(vector_store, lexical_index)
     
+    def build_prompt(inputs: dict) -> str:
+        # Only deduplicated chunk text within the token budget is prefilled, no Document reprs or metadata
+        # Batch callers pass documents they already retrieved for many questions at once
+        documents = inputs.get("documents")
+        if documents is None:
+            with span("retrieve"):
+                documents = retriever.invoke(inputs["question"])
+        with span("prompt_build"):
+            context, stats = pack_context(documents, CONTEXT_TOKEN_BUDGET)
+            prompt_text = prompt.format(context=context, question=inputs["question"])
+            stats["prompt_tokens"] = count_tokens(prompt_text)
+        if inputs.get("stats") is not None:
+            inputs["stats"].update(stats)
+        logger.info(f"Prompt packed: {stats}")
+        return prompt_text
+
+    # Invoked with {"question": ..., "stats": dict, "documents": optional}, stats receives the per-request token counts
     rag_chain = (
-        {"context": retriever, "question": RunnablePassthrough()}
-        | prompt
+        RunnableLambda(build_prompt)
         | llm
         | StrOutputParser()
     )
     
     return rag_chain
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_cached_llm_chain(model_name: str, store_path: str, index_version: int):
+    """RAG chain shared across sessions, rebuilt only when the model or index changes"""
+    logger.info(f"Building RAG chain for {model_name} on index version {index_version}")
+    return get_llm_chain(open_vector_store(store_path), model_name, open_lexical_index(store_path))
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_cached_retriever(store_path: str, index_version: int):
+    """Retriever shared across sessions, for callers that build their own prompts"""
+    return get_retriever(open_vector_store(store_path), open_lexical_index(store_path))
+
+def stream_answer(chain, question: str, timings: dict, documents: Optional[List[Document]] = None):
+    """Stream answer tokens, recording time-to-first-token, total time and prompt tokens in timings"""
+    start_time = time.perf_counter()
+    for token in chain.stream({"question": question, "stats": timings, "documents": documents}):
+        if "first_token" not in timings:
+            timings["first_token"] = time.perf_counter() - start_time
+        yield token
+    timings["total"] = time.perf_counter() - start_time
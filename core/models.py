@@ -0,0 +1,127 @@
+# Model lifecycle: cached model list, background warm-up and keep-alive of the chat and embedding models
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from core.resources import KEEP_ALIVE, get_ollama_client
+from core.scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+MODEL_LIST_TTL = float(os.getenv("CHATDOC_MODEL_LIST_TTL", "60"))
+
+class ModelState:
+    """Load state and cold/warm first-token latencies of one model"""
+
+    def __init__(self):
+        self.status = "cold"  # cold, loading or warm
+        self.last_used = 0.0
+        self.load_seconds: Optional[float] = None
+        self.cold = []
+        self.warm = []
+
+    def is_warm(self) -> bool:
+        if self.status != "warm":
+            return False
+        return KEEP_ALIVE < 0 or time.time() - self.last_used < KEEP_ALIVE
+
+class ModelManager:
+    """Process-wide view of the Ollama models, shared by every session"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = None
+        self._listed_at = 0.0
+        self._states: Dict[str, ModelState] = {}
+        self._warmup_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-warmup")
+
+    def list_models(self):
+        """ollama.list() result, refreshed at most every MODEL_LIST_TTL seconds"""
+        with self._lock:
+            if self._models is not None and time.time() - self._listed_at < MODEL_LIST_TTL:
+                return self._models
+        try:
+            models = get_ollama_client().list()
+        except Exception:
+            # Serve the last known list while the server is briefly unreachable
+            if self._models is not None:
+                logger.warning("Listing Ollama models failed, using the cached list")
+                return self._models
+            raise
+        with self._lock:
+            self._models, self._listed_at = models, time.time()
+        return models
+
+    def state(self, model: str) -> ModelState:
+        with self._lock:
+            return self._states.setdefault(model, ModelState())
+
+    def is_warm(self, model: str) -> bool:
+        return self.state(model).is_warm()
+
+    def ensure_warm(self, model: str, embedding: bool = False):
+        """Load the model in the background unless it is loaded or already loading"""
+        state = self.state(model)
+        with self._lock:
+            if state.status == "loading" or state.is_warm():
+                return
+            state.status = "loading"
+        self._warmup_pool.submit(self._warm_up, model, embedding)
+
+    def _warm_up(self, model: str, embedding: bool):
+        state = self.state(model)
+        start_time = time.perf_counter()
+        try:
+            client = get_ollama_client()
+            with get_scheduler().slot(model, session="warm-up"):
+                # An empty generate loads an LLM without producing tokens, embedders need one input
+                if embedding:
+                    response = client.embed(model=model, input="warm-up", keep_alive=KEEP_ALIVE)
+                else:
+                    response = client.generate(model=model, prompt="", keep_alive=KEEP_ALIVE)
+            load = getattr(response, "load_duration", None)
+            state.load_seconds = load / 1e9 if load else time.perf_counter() - start_time
+            state.last_used = time.time()
+            state.status = "warm"
+            logger.info(f"Warmed up {model} in {state.load_seconds:.2f}s, keep-alive {KEEP_ALIVE}s")
+        except Exception as e:
+            state.status = "cold"
+            logger.warning(f"Warm-up of {model} failed: {str(e)}")
+
+    def record_request(self, model: str, was_warm: bool, first_token: Optional[float] = None):
+        """Every request extends the keep-alive, first-token latency is split by cold/warm start"""
+        state = self.state(model)
+        with self._lock:
+            state.status = "warm"
+            state.last_used = time.time()
+            if first_token is not None:
+                samples = state.warm if was_warm else state.cold
+                samples.append(first_token)
+                del samples[:-100]
+
+    def stats(self) -> Dict[str, dict]:
+        """State, warm-up time and average cold/warm first-token latency per model"""
+        with self._lock:
+            return {
+                model: {
+                    "status": "warm" if state.is_warm() else ("loading" if state.status == "loading" else "cold"),
+                    "load_seconds": state.load_seconds,
+                    "cold_first_token_avg": sum(state.cold) / len(state.cold) if state.cold else None,
+                    "warm_first_token_avg": sum(state.warm) / len(state.warm) if state.warm else None,
+                    "requests": len(state.cold) + len(state.warm)
+                }
+                for model, state in self._states.items()
+            }
+
+_model_manager = None
+_model_manager_lock = threading.Lock()
+
+def get_model_manager() -> ModelManager:
+    """Process-wide model manager"""
+    global _model_manager
+    with _model_manager_lock:
+        if _model_manager is None:
+            _model_manager = ModelManager()
+        return _model_manager
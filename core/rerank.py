@@ -0,0 +1,126 @@
+# Second-stage reranking of a wide candidate pool, with MMR to drop overlapping chunks
+import os
+import time
+import logging
+import threading
+from typing import List, Optional
+from langchain_core.documents import Document
+from core.lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+RERANKER = os.getenv("CHATDOC_RERANKER", "lexical")  # lexical, cross-encoder or none
+RERANK_CANDIDATES = int(os.getenv("CHATDOC_RERANK_CANDIDATES", "50"))
+RERANK_BUDGET_MS = float(os.getenv("CHATDOC_RERANK_BUDGET_MS", "150"))
+RERANK_MODEL = os.getenv("CHATDOC_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+MMR_LAMBDA = float(os.getenv("CHATDOC_MMR_LAMBDA", "0.7"))
+# Chunks this similar to one already selected are treated as duplicates and skipped outright
+DUPLICATE_THRESHOLD = float(os.getenv("CHATDOC_DUPLICATE_THRESHOLD", "0.8"))
+
+class LexicalOverlapScorer:
+    """Query term and bigram coverage of each chunk, cheap enough for any pool size"""
+
+    batch_size = 64
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        terms = tokenize(query)
+        if not terms:
+            return [0.0] * len(texts)
+        query_terms = set(terms)
+        query_bigrams = set(zip(terms, terms[1:]))
+        scores = []
+        for text in texts:
+            tokens = tokenize(text)
+            covered = len(query_terms.intersection(tokens)) / len(query_terms)
+            bigrams = len(query_bigrams.intersection(zip(tokens, tokens[1:]))) / len(query_bigrams) if query_bigrams else 0.0
+            scores.append(covered + 0.5 * bigrams)
+        return scores
+
+class CrossEncoderScorer:
+    """Small CPU cross-encoder from sentence-transformers, loaded on first use"""
+
+    batch_size = 16
+
+    def __init__(self, model_name: str = RERANK_MODEL):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        return [float(s) for s in self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)]
+
+def _token_set(doc: Document) -> set:
+    return set(tokenize(doc.page_content))
+
+def _similarity(a: set, b: set) -> float:
+    # Jaccard over token sets, chunks sharing a 200 char overlap score high without needing their vectors
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def mmr_select(documents: List[Document], scores: List[float], k: int, mmr_lambda: float = MMR_LAMBDA) -> List[Document]:
+    """Greedy maximal marginal relevance over reranker scores"""
+    if not documents:
+        return []
+    # Normalize scores to [0, 1] so they trade off against similarity on the same scale
+    low, high = min(scores), max(scores)
+    relevance = [(s - low) / (high - low) if high > low else 1.0 for s in scores]
+    token_sets = [_token_set(doc) for doc in documents]
+    selected: List[int] = []
+    remaining = list(range(len(documents)))
+    redundancy = [0.0] * len(documents)
+    while remaining and len(selected) < k:
+        best = max(remaining, key=lambda i: mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy[i])
+        selected.append(best)
+        remaining.remove(best)
+        for i in remaining:
+            redundancy[i] = max(redundancy[i], _similarity(token_sets[i], token_sets[best]))
+        remaining = [i for i in remaining if redundancy[i] < DUPLICATE_THRESHOLD]
+    return [documents[i] for i in selected]
+
+class Reranker:
+    """Score candidates under a latency budget, then pick a diverse top k with MMR"""
+
+    def __init__(self, scorer, budget_ms: float = RERANK_BUDGET_MS, mmr_lambda: float = MMR_LAMBDA):
+        self.scorer = scorer
+        self.budget_ms = budget_ms
+        self.mmr_lambda = mmr_lambda
+
+    def rerank(self, query: str, candidates: List[Document], k: int) -> List[Document]:
+        if len(candidates) <= 1:
+            return candidates[:k]
+        start_time = time.perf_counter()
+        deadline = start_time + self.budget_ms / 1000
+        scores: List[float] = []
+        # Candidates arrive in first-stage order, score them best first in batches until the budget runs out
+        for start in range(0, len(candidates), self.scorer.batch_size):
+            if scores and time.perf_counter() > deadline:
+                break
+            batch = candidates[start:start + self.scorer.batch_size]
+            scores.extend(self.scorer.score(query, [doc.page_content for doc in batch]))
+        scored = len(scores)
+        if scored < len(candidates):
+            logger.warning(f"Rerank budget of {self.budget_ms:.0f}ms hit after {scored}/{len(candidates)} candidates")
+            # Unscored candidates keep their first-stage order, below everything that was scored
+            floor = min(scores)
+            scores.extend(floor - 1 - i for i in range(len(candidates) - scored))
+        results = mmr_select(candidates, scores, k, self.mmr_lambda)
+        logger.info(f"Reranked {scored} candidates to {len(results)} in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+        return results
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> Optional[Reranker]:
+    """Process-wide reranker for CHATDOC_RERANKER, None when reranking is off"""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None and RERANKER != "none":
+            scorer = None
+            if RERANKER == "cross-encoder":
+                try:
+                    scorer = CrossEncoderScorer()
+                except Exception as e:
+                    logger.warning(f"Cross-encoder unavailable, using lexical overlap reranking: {str(e)}")
+            _reranker = Reranker(scorer or LexicalOverlapScorer())
+            logger.info(f"Using {type(_reranker.scorer).__name__} reranker with a {RERANK_BUDGET_MS:.0f}ms budget")
+        return _reranker
@@ -0,0 +1,63 @@
+# Process-wide handles shared by every Streamlit session
+import os
+import logging
+import chromadb
+import ollama
+import streamlit as st
+from langchain_chroma import Chroma
+from langchain_ollama import OllamaEmbeddings, OllamaLLM
+from core.cache import CachedEmbeddings
+from core.scheduler import GENERATION_TIMEOUT, ScheduledEmbeddings
+from core.vectorstore import NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+# Seconds Ollama keeps a model loaded after its last request, -1 keeps it loaded until the server stops
+KEEP_ALIVE = int(os.getenv("CHATDOC_KEEP_ALIVE", "1800"))
+
+@st.cache_resource(show_spinner=False)
+def get_chroma_client(path: str):
+    """One ChromaDB client per store path"""
+    os.makedirs(path, exist_ok=True)
+    logger.info(f"Opening ChromaDB client at {path}")
+    return chromadb.PersistentClient(
+        path=path,
+        settings=chromadb.Settings(
+            allow_reset=True,
+            is_persistent=True
+        )
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_embedder(model: str):
+    """One cached embeddings object per embedding model"""
+    logger.info(f"Creating embedder for {model}")
+    # Cache hits never reach the scheduler, misses are queued and batched in front of Ollama
+    return CachedEmbeddings(ScheduledEmbeddings(OllamaEmbeddings(model=model, keep_alive=KEEP_ALIVE), model), model)
+
+@st.cache_resource(show_spinner=False)
+def get_llm_handle(model: str):
+    """One Ollama LLM handle per chat model"""
+    logger.info(f"Creating LLM handle for {model}")
+    # Read timeout, so a stream that stops sending tokens doesn't keep its connection open forever
+    return OllamaLLM(model=model, keep_alive=KEEP_ALIVE, client_kwargs={"timeout": GENERATION_TIMEOUT})
+
+@st.cache_resource(show_spinner=False)
+def get_ollama_client():
+    """Raw Ollama client (honours OLLAMA_HOST) for calls LangChain doesn't expose, like generate context"""
+    return ollama.Client(timeout=GENERATION_TIMEOUT)
+
+@st.cache_resource(show_spinner=False)
+def get_chroma_store(path: str, collection_name: str, embedding_model: str):
+    """One collection of the shared client, bound to the shared embedder"""
+    return Chroma(
+        collection_name=collection_name,
+        embedding_function=get_embedder(embedding_model),
+        persist_directory=path,
+        client=get_chroma_client(path)
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_numpy_store(path: str, embedding_model: str):
+    """Memory-mapped NumPy vector store bound to the shared embedder"""
+    return NumpyVectorStore(path, get_embedder(embedding_model))
@@ -0,0 +1,90 @@
+# Retrievers combining the vector store with the in-process lexical index
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from core.cache import text_hash
+from core.embeddings import search_by_vectors
+from utils.helpers import span, record_span
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_MODE = os.getenv("CHATDOC_RETRIEVAL_MODE", "hybrid")  # hybrid, vector or lexical
+VECTOR_SEARCH_TIMEOUT = float(os.getenv("CHATDOC_VECTOR_SEARCH_TIMEOUT", "10"))
+
+# Vector searches run here so a slow embedder can be abandoned for the lexical results
+_vector_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vector-search")
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], rrf_k: int = 60) -> List[Document]:
+    """Merge ranked lists, scoring each chunk by the sum of 1 / (rrf_k + rank)"""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = text_hash(doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + vector similarity retriever fused with reciprocal rank fusion"""
+
+    vector_store: Any
+    lexical_index: Any
+    k: int = 3
+    candidate_k: int = 10
+    rrf_k: int = 60
+    mode: str = RETRIEVAL_MODE
+    vector_timeout: float = VECTOR_SEARCH_TIMEOUT
+
+    reranker: Any = None
+
+    def _top_k(self, query: str, candidates: List[Document]) -> List[Document]:
+        if self.reranker is None:
+            return candidates[:self.k]
+        with span("rerank"):
+            return self.reranker.rerank(query, candidates, self.k)
+
+    def _lexical(self, query: str) -> List[Document]:
+        with span("lexical_search"):
+            return [doc for doc, _ in self.lexical_index.search(query, self.candidate_k)]
+
+    def _fuse(self, query: str, lexical: List[Document], vector: List[Document]) -> List[Document]:
+        if self.mode == "vector" or not lexical:
+            return self._top_k(query, vector)
+        return self._top_k(query, reciprocal_rank_fusion([vector, lexical], self.rrf_k)[:self.candidate_k])
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Vector-only mode only searches BM25 when the vector search fails
+        lexical = self._lexical(query) if self.mode != "vector" else None
+        if self.mode == "lexical":
+            return self._top_k(query, lexical)
+
+        # Includes embedding the query, which is where most of the time goes on a cold cache
+        vector_start = time.perf_counter()
+        future = _vector_search_pool.submit(self.vector_store.similarity_search, query, k=self.candidate_k)
+        try:
+            vector = future.result(timeout=self.vector_timeout)
+            record_span("vector_search", time.perf_counter() - vector_start)
+        except FutureTimeoutError:
+            logger.warning(f"Vector search exceeded {self.vector_timeout}s, answering from the lexical index")
+            return self._top_k(query, lexical if lexical is not None else self._lexical(query))
+        except Exception as e:
+            logger.warning(f"Vector search failed, answering from the lexical index: {str(e)}")
+            return self._top_k(query, lexical if lexical is not None else self._lexical(query))
+        return self._fuse(query, lexical, vector)
+
+    def retrieve_batch(self, queries: List[str], query_vectors: List[List[float]]) -> List[List[Document]]:
+        """Retrieve for many already embedded queries with one vector search call"""
+        if self.mode == "vector":
+            lexical = [[] for _ in queries]
+        else:
+            lexical = [[doc for doc, _ in self.lexical_index.search(query, self.candidate_k)] for query in queries]
+        if self.mode == "lexical":
+            return [self._top_k(query, hits) for query, hits in zip(queries, lexical)]
+        vector = search_by_vectors(self.vector_store, query_vectors, self.candidate_k)
+        return [self._fuse(query, lexical_hits, vector_hits) for query, lexical_hits, vector_hits in zip(queries, lexical, vector)]
@@ -0,0 +1,335 @@
+# Shared asyncio scheduler in front of Ollama: per-model concurrency, fair per-session queues, batched query embeddings
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from queue import Empty, Queue
+from typing import Callable, Dict, Iterator, List, Optional
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+LLM_CONCURRENCY = int(os.getenv("CHATDOC_LLM_CONCURRENCY", "1"))
+EMBED_CONCURRENCY = int(os.getenv("CHATDOC_EMBED_CONCURRENCY", "4"))
+QUEUE_TIMEOUT = float(os.getenv("CHATDOC_QUEUE_TIMEOUT", "60"))
+GENERATION_TIMEOUT = float(os.getenv("CHATDOC_GENERATION_TIMEOUT", "300"))
+EMBED_BATCH_WINDOW_MS = float(os.getenv("CHATDOC_EMBED_BATCH_WINDOW_MS", "10"))
+EMBED_BATCH_MAX = int(os.getenv("CHATDOC_EMBED_BATCH_MAX", "32"))
+# Slot wait of work running for a session outside its script thread (ingestion jobs), 0 waits as long as it takes
+BACKGROUND_QUEUE_TIMEOUT = float(os.getenv("CHATDOC_BACKGROUND_QUEUE_TIMEOUT", "0"))
+
+# Session and queue timeout that background work inherits from whoever started it
+_request_context: contextvars.ContextVar = contextvars.ContextVar("chatdoc_request_context", default=None)
+
+@contextmanager
+def request_context(session: str, queue_timeout: float = BACKGROUND_QUEUE_TIMEOUT):
+    """Queue the requests made inside the block under a session, with their own slot wait limit"""
+    token = _request_context.set({"session": session, "queue_timeout": queue_timeout})
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+def current_queue_timeout() -> Optional[float]:
+    """Slot wait limit of the calling context, None for no limit"""
+    context = _request_context.get()
+    timeout = context["queue_timeout"] if context is not None else QUEUE_TIMEOUT
+    return timeout or None
+
+def current_session_id() -> str:
+    """Streamlit session of the calling thread, the session background work runs for, or a shared id"""
+    context = _request_context.get()
+    if context is not None:
+        return context["session"]
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        ctx = None
+    return ctx.session_id if ctx is not None else "background"
+
+class ModelQueue:
+    """Slots of one model, handed out round-robin across the sessions waiting for them"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # session -> its waiting futures, in the order sessions get served
+        self.sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self.granted = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.batches = 0
+        self.batched_requests = 0
+
+    def depth(self) -> int:
+        return sum(1 for waiting in self.sessions.values() for future in waiting if not future.done())
+
+    def dispatch(self):
+        while self.active < self.limit and self.sessions:
+            session, waiting = next(iter(self.sessions.items()))
+            future = waiting.popleft()
+            # Served sessions go to the back so one busy user can't starve the others
+            if waiting:
+                self.sessions.move_to_end(session)
+            else:
+                del self.sessions[session]
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+class RequestScheduler:
+    """Event loop on a daemon thread; Streamlit script threads call in through the sync helpers"""
+
+    def __init__(self, llm_concurrency: int = LLM_CONCURRENCY, embed_concurrency: int = EMBED_CONCURRENCY):
+        self.llm_concurrency = llm_concurrency
+        self.embed_concurrency = embed_concurrency
+        self.loop = asyncio.new_event_loop()
+        self.queues: Dict[str, ModelQueue] = {}
+        # model -> session -> texts waiting to be embedded, served round-robin like the slots
+        self._pending: Dict[str, "OrderedDict[str, deque]"] = {}
+        self._armed = set()
+        self._flushing: Dict[str, int] = {}
+        self._thread = threading.Thread(target=self.loop.run_forever, name="request-scheduler", daemon=True)
+        self._thread.start()
+
+    def _queue(self, model: str) -> ModelQueue:
+        if model not in self.queues:
+            limit = self.embed_concurrency if "embed" in model else self.llm_concurrency
+            self.queues[model] = ModelQueue(limit)
+        return self.queues[model]
+
+    async def _acquire(self, model: str, session: str):
+        queue = self._queue(model)
+        future = self.loop.create_future()
+        queue.sessions.setdefault(session, deque()).append(future)
+        queue.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Granted just as the caller gave up
+            if future.done() and not future.cancelled():
+                self._release(model)
+            raise
+
+    def _release(self, model: str):
+        queue = self.queues[model]
+        queue.active -= 1
+        queue.dispatch()
+
+    def _record_wait(self, model: str, waited: float):
+        queue = self.queues[model]
+        queue.granted += 1
+        queue.wait_total += waited
+        queue.wait_max = max(queue.wait_max, waited)
+
+    def _count(self, model: str, counter: str):
+        queue = self._queue(model)
+        setattr(queue, counter, getattr(queue, counter) + 1)
+
+    @contextmanager
+    def slot(self, model: str, session: Optional[str] = None, timeout: Optional[float] = None, timings: Optional[dict] = None):
+        """Hold one of the model's slots for the duration of the block"""
+        session = session or current_session_id()
+        timeout = timeout or current_queue_timeout()
+        start_time = time.perf_counter()
+        pending = asyncio.run_coroutine_threadsafe(self._acquire(model, session), self.loop)
+        try:
+            pending.result(timeout=timeout)
+        except BaseException as e:
+            # Timed out, or the Streamlit script was stopped because the user left or reran.
+            # If the slot was granted in the meantime it is ours and has to go back
+            if not pending.cancel() and pending.done() and not pending.cancelled() and pending.exception() is None:
+                self.loop.call_soon_threadsafe(self._release, model)
+            self.loop.call_soon_threadsafe(self._count, model, "timeouts" if isinstance(e, FutureTimeoutError) else "cancelled")
+            if isinstance(e, FutureTimeoutError):
+                raise TimeoutError(f"{model} is busy, no slot within {timeout:g}s") from None
+            raise
+        waited = time.perf_counter() - start_time
+        self.loop.call_soon_threadsafe(self._record_wait, model, waited)
+        if timings is not None:
+            timings["queued"] = waited
+        try:
+            yield
+        finally:
+            self.loop.call_soon_threadsafe(self._release, model)
+
+    def stream(self, model: str, tokens: Callable[[], Iterator[str]], timings: Optional[dict] = None,
+               timeout: float = GENERATION_TIMEOUT) -> Iterator[str]:
+        """Run a token stream inside a model slot, abandoning it past the generation timeout"""
+        with self.slot(model, timings=timings):
+            deadline = time.perf_counter() + timeout
+            # Tokens are pulled on a reader thread, so a stream that stalls without sending any still hits the deadline
+            received: Queue = Queue()
+            stop = threading.Event()
+            done = object()
+
+            def read():
+                iterator = tokens()
+                try:
+                    for token in iterator:
+                        if stop.is_set():
+                            break
+                        received.put((token, None))
+                    received.put((done, None))
+                except BaseException as e:
+                    received.put((None, e))
+                finally:
+                    # Closes the HTTP stream so Ollama stops generating for a client that is gone
+                    if hasattr(iterator, "close"):
+                        iterator.close()
+
+            # Carries the trace context, so spans recorded while streaming land in the question's trace
+            threading.Thread(target=contextvars.copy_context().run, args=(read,), name=f"stream-{model}", daemon=True).start()
+            try:
+                while True:
+                    try:
+                        token, error = received.get(timeout=max(deadline - time.perf_counter(), 0))
+                    except Empty:
+                        self.loop.call_soon_threadsafe(self._count, model, "timeouts")
+                        raise TimeoutError(f"Generation exceeded {timeout:g}s") from None
+                    if error is not None:
+                        raise error
+                    if token is done:
+                        return
+                    yield token
+            finally:
+                # The reader stops at its next token; the client's read timeout ends a stream that never sends one
+                stop.set()
+
+    async def _embed(self, model: str, embed: Callable[[List[str]], List[List[float]]], text: str, session: str) -> List[float]:
+        future = self.loop.create_future()
+        sessions = self._pending.setdefault(model, OrderedDict())
+        sessions.setdefault(session, deque()).append((text, future))
+        # A batch already waiting for a slot takes this text along, no need for another one
+        if model not in self._armed and not self._flushing.get(model):
+            self._armed.add(model)
+            self.loop.call_later(EMBED_BATCH_WINDOW_MS / 1000, self._window_closed, model, embed)
+        if sum(len(waiting) for waiting in sessions.values()) % EMBED_BATCH_MAX == 0:
+            self.loop.create_task(self._flush(model, embed))
+        return await future
+
+    def _window_closed(self, model: str, embed: Callable[[List[str]], List[List[float]]]):
+        self._armed.discard(model)
+        self.loop.create_task(self._flush(model, embed))
+
+    def _take_batch(self, model: str) -> list:
+        """Up to EMBED_BATCH_MAX waiting texts, one per session in turn so a big backlog can't crowd out the others"""
+        sessions = self._pending.get(model) or OrderedDict()
+        batch = []
+        while sessions and len(batch) < EMBED_BATCH_MAX:
+            session, waiting = next(iter(sessions.items()))
+            text, future = waiting.popleft()
+            if waiting:
+                sessions.move_to_end(session)
+            else:
+                del sessions[session]
+            # Callers that already gave up are dropped
+            if not future.done():
+                batch.append((text, future))
+        return batch
+
+    async def _flush(self, model: str, embed: Callable[[List[str]], List[List[float]]]):
+        sessions = self._pending.get(model)
+        if not sessions:
+            return
+        # The slot is queued for the session next in line, so batches take turns with that session's other requests
+        self._flushing[model] = self._flushing.get(model, 0) + 1
+        try:
+            await self._acquire(model, next(iter(sessions)))
+        finally:
+            self._flushing[model] -= 1
+        live = self._take_batch(model)
+        # Whatever didn't fit goes out in the next batch without waiting for another request to arrive
+        if self._pending.get(model) and not self._flushing[model]:
+            self.loop.create_task(self._flush(model, embed))
+        if not live:
+            self._release(model)
+            return
+        queue = self.queues[model]
+        queue.batches += 1
+        queue.batched_requests += len(live)
+        try:
+            vectors = await self.loop.run_in_executor(None, embed, [text for text, _ in live])
+            for (_, future), vector in zip(live, vectors):
+                if not future.done():
+                    future.set_result(vector)
+        except Exception as e:
+            for _, future in live:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._release(model)
+
+    def embed(self, model: str, embed: Callable[[List[str]], List[List[float]]], text: str,
+              timeout: float = QUEUE_TIMEOUT) -> List[float]:
+        """Embed one text, coalesced with other sessions' requests arriving within the batch window"""
+        pending = asyncio.run_coroutine_threadsafe(self._embed(model, embed, text, current_session_id()), self.loop)
+        try:
+            return pending.result(timeout=timeout)
+        except FutureTimeoutError:
+            pending.cancel()
+            self.loop.call_soon_threadsafe(self._count, model, "timeouts")
+            raise TimeoutError(f"Embedding with {model} took longer than {timeout:g}s") from None
+        except BaseException:
+            pending.cancel()
+            raise
+
+    async def _snapshot(self) -> Dict[str, dict]:
+        return {
+            model: {
+                "limit": queue.limit,
+                "active": queue.active,
+                "queued": queue.depth(),
+                "sessions_waiting": len(queue.sessions),
+                "granted": queue.granted,
+                "timeouts": queue.timeouts,
+                "cancelled": queue.cancelled,
+                "wait_avg": queue.wait_total / queue.granted if queue.granted else 0.0,
+                "wait_max": queue.wait_max,
+                "embed_batches": queue.batches,
+                "avg_batch_size": queue.batched_requests / queue.batches if queue.batches else 0.0
+            }
+            for model, queue in self.queues.items()
+        }
+
+    def metrics(self) -> Dict[str, dict]:
+        """Queue depth, active slots and wait times per model"""
+        return asyncio.run_coroutine_threadsafe(self._snapshot(), self.loop).result(timeout=5)
+
+class ScheduledEmbeddings(Embeddings):
+    """Routes an embedder through the scheduler, batching single queries across sessions"""
+
+    def __init__(self, embeddings: Embeddings, model_name: str):
+        self.embeddings = embeddings
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with get_scheduler().slot(self.model_name):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return get_scheduler().embed(self.model_name, self.embeddings.embed_documents, text)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(llm_concurrency: Optional[int] = None) -> RequestScheduler:
+    """Process-wide scheduler shared by every Streamlit session; llm_concurrency only applies to the first call"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(llm_concurrency or LLM_CONCURRENCY)
+            logger.info(f"Started request scheduler (LLM concurrency {_scheduler.llm_concurrency}, "
+                        f"embedding concurrency {_scheduler.embed_concurrency})")
+        elif llm_concurrency and llm_concurrency != _scheduler.llm_concurrency:
+            logger.warning(f"Request scheduler already running with LLM concurrency {_scheduler.llm_concurrency}, ignoring {llm_concurrency}")
+        return _scheduler
@@ -0,0 +1,223 @@
+# Versioned index snapshots: export the live index once, publish it atomically, serve it memory-mapped from any replica
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from core.embeddings import (
+    EMBEDDING_MODEL,
+    VECTOR_STORE_DIR,
+    get_embeddings,
+    lexical_dir,
+    load_manifest,
+    open_vector_store,
+    save_manifest
+)
+from core.vectorstore import VECTOR_DTYPE, NumpyVectorStore
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.getenv("CHATDOC_SNAPSHOT_DIR", "data/snapshots")
+# Published snapshots kept besides the current one, for rollback and replicas still on an older one
+SNAPSHOT_KEEP = int(os.getenv("CHATDOC_SNAPSHOT_KEEP", "3"))
+SNAPSHOT_FORMAT = 1
+CURRENT_FILE = "CURRENT"
+INFO_FILE = "snapshot.json"
+EXPORT_BATCH_SIZE = 1000
+
+def fsync_tree(path: str):
+    """Flush every file and directory below path, so a rename never publishes half-written data"""
+    for root, _, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(root, name), "rb") as f:
+                os.fsync(f.fileno())
+        fsync_dir(root)
+
+def fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def iter_store_records(vector_store, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Tuple[List[str], np.ndarray, List[dict], List[str]]]:
+    """(ids, vectors, metadatas, documents) of every chunk in a Chroma or NumPy store, without re-embedding"""
+    if isinstance(vector_store, NumpyVectorStore):
+        yield from vector_store.iter_records(batch_size)
+        return
+    offset = 0
+    while True:
+        batch = vector_store._collection.get(limit=batch_size, offset=offset,
+                                             include=["embeddings", "metadatas", "documents"])
+        if not batch["ids"]:
+            return
+        yield batch["ids"], np.asarray(batch["embeddings"], dtype=np.float32), batch["metadatas"], batch["documents"]
+        offset += len(batch["ids"])
+
+def load_snapshot_info(path: str) -> dict:
+    """Description of a snapshot, checked against this build's format and embedding model"""
+    with open(os.path.join(path, INFO_FILE), "r") as f:
+        info = json.load(f)
+    if info.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Snapshot {path} has format {info.get('format')}, this version reads {SNAPSHOT_FORMAT}")
+    if info["embedding_model"] != EMBEDDING_MODEL:
+        # Questions would be embedded into a different vector space than the chunks
+        raise ValueError(f"Snapshot {path} was embedded with {info['embedding_model']}, the app uses {EMBEDDING_MODEL}")
+    return info
+
+def list_snapshots(root: str = SNAPSHOT_DIR) -> List[dict]:
+    """Published snapshots, oldest first"""
+    snapshots = []
+    if not os.path.isdir(root):
+        return snapshots
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name.startswith(".") or not os.path.isfile(os.path.join(path, INFO_FILE)):
+            continue
+        with open(os.path.join(path, INFO_FILE), "r") as f:
+            snapshots.append({**json.load(f), "path": path})
+    return sorted(snapshots, key=lambda info: info["created_at"])
+
+def current_snapshot(root: str = SNAPSHOT_DIR) -> Optional[str]:
+    """Path of the published snapshot, None if nothing was published yet"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, name) if name else None
+
+def publish_snapshot(name: str, root: str = SNAPSHOT_DIR) -> str:
+    """Point CURRENT at a snapshot in one rename; also how to roll back to an older one"""
+    path = os.path.join(root, name)
+    load_snapshot_info(path)
+    pointer = os.path.join(root, CURRENT_FILE)
+    temporary = f"{pointer}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, pointer)
+    fsync_dir(root)
+    logger.info(f"Published snapshot {name}")
+    return path
+
+def prune_snapshots(root: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP) -> List[str]:
+    """Delete all but the newest keep snapshots, never the current one or the one this process serves"""
+    protected = {current_snapshot(root), (_served or {}).get("path")}
+    snapshots = [info["path"] for info in list_snapshots(root) if info["path"] not in protected]
+    removed = snapshots[:max(len(snapshots) - keep, 0)]
+    for path in removed:
+        # Replicas still serving it keep their open maps, unlinked files stay readable until closed
+        shutil.rmtree(path, ignore_errors=True)
+        logger.info(f"Pruned snapshot {os.path.basename(path)}")
+    return removed
+
+def export_snapshot(vector_store=None, persist_directory: str = VECTOR_STORE_DIR, root: str = SNAPSHOT_DIR,
+                    name: Optional[str] = None, dtype: str = VECTOR_DTYPE, publish: bool = True) -> dict:
+    """Copy the live index (chunks, vectors, BM25 shards, manifest) into a new snapshot and optionally publish it"""
+    start_time = time.perf_counter()
+    manifest = load_manifest(persist_directory)
+    if not manifest["documents"]:
+        raise ValueError(f"Nothing is indexed in {persist_directory}")
+    vector_store = vector_store if vector_store is not None else open_vector_store(persist_directory)
+    name = name or f"{time.strftime('%Y%m%dT%H%M%S')}-v{manifest['version']}"
+    target = os.path.join(root, name)
+    if os.path.exists(target):
+        raise FileExistsError(f"Snapshot {name} already exists")
+
+    # Built under a hidden name and renamed into place, readers never see a partial snapshot
+    building = os.path.join(root, f".building-{name}-{os.getpid()}")
+    os.makedirs(building)
+    try:
+        store = NumpyVectorStore(os.path.join(building, "vectors"), get_embeddings(), dtype)
+        chunks = 0
+        for ids, vectors, metadatas, documents in iter_store_records(vector_store):
+            # Chunks of a document indexed after the manifest was read belong to the next snapshot
+            keep = [i for i, metadata in enumerate(metadatas) if (metadata or {}).get("doc_id") in manifest["documents"]]
+            if keep:
+                store.upsert([ids[i] for i in keep], vectors[keep], [metadatas[i] for i in keep], [documents[i] for i in keep])
+                chunks += len(keep)
+        # Trained here once, so replicas only map the lists
+        store.build_ivf()
+        stats = store.stats()
+        # Replicas open it without compacting or cleaning up files
+        store.freeze()
+        store.close()
+        save_manifest(manifest, os.path.join(building, "vectors"))
+
+        lexical_target = os.path.join(building, "lexical")
+        if os.path.isdir(lexical_dir(persist_directory)):
+            shutil.copytree(lexical_dir(persist_directory), lexical_target)
+        else:
+            os.makedirs(lexical_target)
+
+        info = {
+            "format": SNAPSHOT_FORMAT,
+            "name": name,
+            "created_at": time.time(),
+            "index_version": manifest["version"],
+            "embedding_model": EMBEDDING_MODEL,
+            "dim": stats["dim"],
+            "dtype": stats["dtype"],
+            "chunks": chunks,
+            "ivf_lists": stats["ivf_lists"],
+            "documents": {
+                doc_id: {"chunks": entry["chunks"], "source_hash": entry["source_hash"], "chunking": entry.get("chunking")}
+                for doc_id, entry in manifest["documents"].items()
+            }
+        }
+        with open(os.path.join(building, INFO_FILE), "w") as f:
+            json.dump(info, f, indent=2)
+        fsync_tree(building)
+        os.rename(building, target)
+        fsync_dir(root)
+    except Exception:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+
+    logger.info(f"Exported snapshot {name}: {chunks} chunks of {len(manifest['documents'])} documents "
+                f"in {time.perf_counter() - start_time:.1f}s")
+    if publish:
+        publish_snapshot(name, root)
+        prune_snapshots(root)
+    return {**info, "path": target}
+
+_served = None
+_served_lock = threading.Lock()
+
+def current_store_dir(root: str = SNAPSHOT_DIR) -> str:
+    """Vector store directory of the published snapshot, validated the first time it is served"""
+    global _served
+    path = current_snapshot(root)
+    if path is None or not os.path.isdir(path):
+        # CURRENT lost or pointing at a deleted snapshot: keep serving what this process served, else the newest
+        fallback = _served["path"] if _served is not None and os.path.isdir(_served["path"]) else None
+        if fallback is None:
+            snapshots = list_snapshots(root)
+            fallback = snapshots[-1]["path"] if snapshots else None
+        if fallback is None:
+            raise FileNotFoundError(f"No snapshot published in {root}, export one with python snapshot.py export")
+        logger.warning(f"{os.path.join(root, CURRENT_FILE)} names no snapshot, serving {os.path.basename(fallback)}")
+        path = fallback
+    with _served_lock:
+        if _served is None or _served["path"] != path:
+            _served = {**load_snapshot_info(path), "path": path}
+            logger.info(f"Serving snapshot {_served['name']} with {_served['chunks']} chunks")
+    return os.path.join(path, "vectors")
+
+def served_snapshot() -> Optional[dict]:
+    """Info of the snapshot this process last served"""
+    return _served
+
+def preview_documents(store_dir: str, limit: int) -> List[Document]:
+    """First chunks of a snapshot, for the document viewer of a read-only replica"""
+    store = open_vector_store(store_dir)
+    for ids, _, metadatas, documents in store.iter_records(limit):
+        return [Document(id=chunk_id, page_content=text, metadata=metadata)
+                for chunk_id, text, metadata in zip(ids, documents, metadatas)]
+    return []
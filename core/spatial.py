@@ -0,0 +1,160 @@
+# Spatial index and geometry-aware answers for GeoJSON uploads
+import os
+import re
+import logging
+from io import StringIO
+from typing import List, Optional
+import geopandas as gpd
+from pandas.api.types import is_string_dtype
+import streamlit as st
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+MAP_SIMPLIFY_TOLERANCE = float(os.getenv("CHATDOC_MAP_SIMPLIFY_TOLERANCE", "0.0005"))  # degrees
+MAX_FEATURES_SHOWN = 5
+
+AREA_TERMS = r"\b(area|size|km²|km2|square (kilometres|kilometers|metres|meters))\b"
+PROXIMITY_TERMS = r"\b(near|nearest|close to|closest|around|neighbou?rs?|adjacent|borders?|bordering|next to)\b"
+# Words a geometry question may contain besides its keywords and a feature name, anything else
+# ("population", "employer", "who") asks about something the geometry can't answer
+SPATIAL_WORDS = {
+    "a", "an", "the", "of", "in", "is", "are", "was", "were", "which", "what", "there", "does", "do", "has", "have",
+    "by", "to", "me", "show", "list", "tell", "give", "please", "and", "or", "with", "its", "one", "ones", "how", "many",
+    "feature", "features", "district", "districts", "area", "areas", "region", "regions", "polygon", "polygons",
+    "zone", "zones", "place", "places", "neighbourhood", "neighbourhoods", "neighborhood", "neighborhoods",
+    "largest", "biggest", "smallest", "size", "km", "km2", "km²", "square", "kilometres", "kilometers", "metres", "meters",
+    "near", "nearest", "close", "closest", "around", "neighbour", "neighbours", "neighbor", "neighbors",
+    "adjacent", "border", "borders", "bordering", "next",
+}
+
+class SpatialLayer:
+    """Parsed GeoDataFrame with its STRtree index, metric projection and simplified map layer"""
+
+    def __init__(self, gdf: gpd.GeoDataFrame):
+        if gdf.crs is None:
+            gdf = gdf.set_crs(epsg=4326)
+        self.gdf = gdf.to_crs(epsg=4326).reset_index(drop=True)
+        # Areas and distances need a metric CRS, UTM for the layer's own region
+        self.metric = self.gdf.to_crs(self.gdf.estimate_utm_crs())
+        self.sindex = self.metric.sindex
+        self.areas = self.metric.geometry.area
+        # "Near" is measured between centroids, so adjacent polygons don't all come out at 0 km
+        self.centroids = self.metric.geometry.centroid
+        self.centroid_index = self.centroids.sindex
+        self.property_columns = [c for c in self.gdf.columns if c != "geometry"]
+        self.name_column = next(
+            (c for c in self.property_columns if "name" in str(c).lower()),
+            next((c for c in self.property_columns if is_string_dtype(self.gdf[c])), None)
+        )
+        self._map_json = None
+
+    def feature_name(self, i: int) -> str:
+        if self.name_column is None:
+            return f"Feature {i + 1}"
+        return str(self.gdf.iloc[i][self.name_column])
+
+    def find_feature(self, text: str) -> Optional[int]:
+        """Index of the feature whose name appears in the text, longest name first"""
+        if self.name_column is None:
+            return None
+        lowered = text.lower()
+        names = self.gdf[self.name_column].astype(str)
+        matches = [(len(name), i) for i, name in enumerate(names) if name and name.lower() in lowered]
+        return max(matches)[1] if matches else None
+
+    def names_property(self, text: str) -> bool:
+        """Whether the question mentions one of the layer's attribute columns"""
+        lowered = text.lower()
+        return any(re.search(rf"(?<!\w){re.escape(str(c).lower())}(?!\w)", lowered) for c in self.property_columns)
+
+    def map_json(self, tolerance: float = MAP_SIMPLIFY_TOLERANCE) -> str:
+        """Simplified GeoJSON for rendering, computed once per layer"""
+        if self._map_json is None:
+            simplified = self.gdf.copy()
+            simplified["geometry"] = simplified.geometry.simplify(tolerance, preserve_topology=True)
+            self._map_json = simplified.to_json()
+        return self._map_json
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_spatial_layer(content_hash: str, _geojson_str: str) -> SpatialLayer:
+    """Parse and index a GeoJSON document once per content hash"""
+    logger.info(f"Building spatial index for GeoJSON {content_hash[:12]}")
+    return SpatialLayer(gpd.read_file(StringIO(_geojson_str)))
+
+def feature_documents(layer: SpatialLayer, metadata: dict) -> List[Document]:
+    """One retrievable chunk per feature with its properties, area and centroid"""
+    centroids = layer.centroids.to_crs(epsg=4326)
+    documents = []
+    for i, row in enumerate(layer.gdf[layer.property_columns].itertuples(index=False)):
+        properties = ", ".join(f"{c}: {v}" for c, v in zip(layer.property_columns, row))
+        content = (
+            f"{layer.feature_name(i)} ({layer.gdf.geometry.iloc[i].geom_type}). {properties}. "
+            f"Area: {layer.areas.iloc[i] / 1e6:,.2f} km². "
+            f"Centroid: lat {centroids.iloc[i].y:.5f}, lon {centroids.iloc[i].x:.5f}."
+        )
+        documents.append(Document(page_content=content, metadata={**metadata, "feature": i}))
+    return documents
+
+def nearest_features(layer: SpatialLayer, target: int, k: int) -> List[tuple]:
+    """(feature, centroid distance in metres) of the k features closest to target, via STRtree window queries"""
+    centroid = layer.centroids.iloc[target]
+    # Start with a window about one typical feature wide and widen until it holds k neighbours
+    radius = max(float(layer.areas.median()) ** 0.5, 1.0)
+    candidates = []
+    for _ in range(32):
+        candidates = [int(i) for i in layer.centroid_index.query(centroid.buffer(radius), predicate="intersects") if i != target]
+        if len(candidates) >= k or len(candidates) == len(layer.gdf) - 1:
+            break
+        radius *= 2
+    distances = layer.centroids.iloc[candidates].distance(centroid).sort_values().head(k)
+    return list(zip(distances.index, distances.tolist()))
+
+def _only_geometry(layer: SpatialLayer, text: str, feature: Optional[int] = None) -> bool:
+    """Whether the question asks nothing besides geometry, given the feature name it mentions"""
+    if layer.names_property(text):
+        return False
+    if feature is not None:
+        text = text.replace(layer.feature_name(feature).lower(), " ")
+    return all(word in SPATIAL_WORDS for word in re.findall(r"[^\W\d_]+|\d+", text))
+
+def _feature_list(layer: SpatialLayer, indices, values=None, unit="") -> str:
+    lines = []
+    for rank, i in enumerate(indices):
+        value = f" ({values[rank]:,.2f} {unit})" if values is not None else ""
+        lines.append(f"- {layer.feature_name(i)}{value}")
+    return "\n".join(lines)
+
+def answer_spatial_question(layer: SpatialLayer, question: str) -> Optional[str]:
+    """Answer size, proximity and adjacency questions from the spatial index, or None"""
+    text = question.lower()
+
+    if re.search(r"\b(largest|biggest|smallest)\b", text) and re.search(AREA_TERMS, text):
+        if not _only_geometry(layer, text):
+            return None
+        smallest = "smallest" in text
+        ranked = layer.areas.sort_values(ascending=smallest).head(MAX_FEATURES_SHOWN)
+        label = "Smallest" if smallest else "Largest"
+        return f"{label} features by area:\n\n" + _feature_list(layer, ranked.index, (ranked / 1e6).tolist(), "km²")
+
+    if re.search(PROXIMITY_TERMS, text):
+        target = layer.find_feature(question)
+        if target is None or not _only_geometry(layer, text, target):
+            return None
+        geometry = layer.metric.geometry.iloc[target]
+        name = layer.feature_name(target)
+        if re.search(r"\b(neighbou?rs?|adjacent|borders?|bordering)\b", text):
+            candidates = layer.sindex.query(geometry, predicate="intersects")
+            neighbours = [int(i) for i in candidates if i != target]
+            if not neighbours:
+                return f"No features border {name}."
+            return f"Features bordering {name}:\n\n" + _feature_list(layer, neighbours)
+        nearest = nearest_features(layer, target, MAX_FEATURES_SHOWN)
+        return f"Features nearest to {name}:\n\n" + _feature_list(
+            layer, [i for i, _ in nearest], [d / 1000 for _, d in nearest], "km")
+
+    if re.search(r"\b(how many)\b", text) and re.search(r"\b(features|districts|areas|regions|polygons)\b", text) \
+            and _only_geometry(layer, text):
+        return f"There are **{len(layer.gdf):,}** features."
+
+    return None
@@ -0,0 +1,224 @@
+# Columnar query path for CSV/JSON uploads
+import os
+import re
+import numbers
+import logging
+from typing import List, Optional
+import pandas as pd
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+ROW_GROUP_SIZE = int(os.getenv("CHATDOC_ROW_GROUP_SIZE", "1000"))
+MAX_SUMMARY_COLUMNS = 30
+MAX_GROUPS_SHOWN = 20
+
+# Matched against the question with column names blanked out, so "Total Flights" is not a sum
+AGGREGATIONS = [
+    ("nunique", r"\b(unique|distinct)\b"),
+    ("count", r"\b(how many|count|number of)\b"),
+    ("mean", r"\b(average|mean|avg)\b"),
+    ("median", r"\bmedian\b"),
+    ("sum", r"\b(sum|total)\b"),
+    ("max", r"\b(max|maximum|highest|largest|biggest|most)\b"),
+    ("min", r"\b(min|minimum|lowest|smallest|least)\b"),
+]
+
+# Words that may be left over once columns, filters, group-by and the aggregation are parsed.
+# Anything else ("astronauts from Japan", a person's name, "columns") is a constraint this path can't apply.
+FILLER_WORDS = {
+    "a", "an", "the", "of", "in", "is", "are", "was", "were", "be", "there", "what", "which", "who", "whose",
+    "does", "do", "has", "have", "with", "where", "that", "and", "all", "for", "to", "by", "per", "each",
+    "row", "rows", "record", "records", "entry", "entries", "value", "values", "table", "data", "dataset",
+    "file", "overall", "me", "tell", "give", "show", "please", "find", "get", "how", "many", "number",
+}
+
+# Longest phrases first so "greater than or equal to" wins over "greater than"
+COMPARISONS = {
+    "greater than or equal to": ">=", "less than or equal to": "<=", "at least": ">=", "at most": "<=",
+    "greater than": ">", "more than": ">", "above": ">", "over": ">",
+    "less than": "<", "below": "<", "under": "<",
+    "is not": "!=", "equals": "==", "is": "==",
+    ">=": ">=", "<=": "<=", "!=": "!=", "==": "==", "=": "==", ">": ">", "<": "<",
+}
+
+def _column_pattern(column: str) -> str:
+    name = re.escape(str(column).lower())
+    # Let "area_km" also match "area km" in the question, and don't rely on \b around names like "time (h)"
+    return r"(?<!\w)" + name.replace("_", "[ _]").replace("\\ ", "[ _]") + r"(?!\w)"
+
+def column_spans(df: pd.DataFrame, question: str) -> List[tuple]:
+    """(column, start, end) of every column mentioned in the question, in order of appearance"""
+    text = question.lower()
+    found = []
+    # Longest names first so "area_km" isn't shadowed by "area"
+    for column in sorted(df.columns, key=lambda c: len(str(c)), reverse=True):
+        if column == "geometry":
+            continue
+        match = re.search(_column_pattern(column), text)
+        if match and not any(start <= match.start() < end for _, start, end in found):
+            found.append((column, match.start(), match.end()))
+    return sorted(found, key=lambda item: item[1])
+
+def find_columns(df: pd.DataFrame, question: str) -> List[str]:
+    """Columns mentioned in the question, in order of appearance"""
+    return [column for column, _, _ in column_spans(df, question)]
+
+def _filter_matches(question: str, columns: List[str]) -> List[tuple]:
+    """(column, operator, value, start, end) of each parsed condition"""
+    text = question.lower()
+    operators = "|".join(re.escape(op) for op in sorted(COMPARISONS, key=len, reverse=True))
+    matches = []
+    for column in columns:
+        pattern = rf"{_column_pattern(column)}\s*({operators})\s*(\"[^\"]+\"|'[^']+'|-?\d+(?:\.\d+)?|[\w\-]+)"
+        match = re.search(pattern, text)
+        if match:
+            value = match.group(2).strip("\"'")
+            matches.append((column, COMPARISONS[match.group(1)], value, match.start(), match.end()))
+    return matches
+
+def parse_filters(df: pd.DataFrame, question: str, columns: List[str]) -> List[tuple]:
+    """(column, operator, value) conditions such as "price above 10" or "city is 'Munich'" """
+    return [(column, operator, value) for column, operator, value, _, _ in _filter_matches(question, columns)]
+
+def _blank(text: str, spans) -> str:
+    """Text with the given spans replaced by spaces, positions unchanged"""
+    chars = list(text)
+    for start, end in spans:
+        chars[start:end] = " " * (end - start)
+    return "".join(chars)
+
+def apply_filters(df: pd.DataFrame, filters: List[tuple]) -> pd.DataFrame:
+    """Vectorized boolean mask over all conditions"""
+    mask = pd.Series(True, index=df.index)
+    for column, operator, value in filters:
+        series = df[column]
+        try:
+            number = float(value)
+            series = pd.to_numeric(series, errors="coerce")
+        except ValueError:
+            number = None
+            series = series.astype(str).str.lower()
+        target = number if number is not None else value.lower()
+        if operator == "==":
+            mask &= series == target
+        elif operator == "!=":
+            mask &= series != target
+        elif number is None:
+            continue
+        elif operator == ">":
+            mask &= series > target
+        elif operator == ">=":
+            mask &= series >= target
+        elif operator == "<":
+            mask &= series < target
+        elif operator == "<=":
+            mask &= series <= target
+    return df[mask]
+
+def _format_value(value) -> str:
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}"
+    if isinstance(value, numbers.Real):
+        return f"{value:,.4g}" if abs(value) < 1e6 else f"{value:,.2f}"
+    return str(value)
+
+def answer_tabular_question(df: pd.DataFrame, question: str) -> Optional[str]:
+    """Answer aggregate/filter questions with pandas, or None to fall back to RAG"""
+    text = question.lower()
+    spans = column_spans(df, question)
+    columns = [column for column, _, _ in spans]
+    # Aggregation words inside a column name ("Total Flights", "Max Speed") don't count
+    outside_columns = _blank(text, [(start, end) for _, start, end in spans])
+    aggregation_match = next(((name, match) for name, pattern in AGGREGATIONS
+                              for match in [re.search(pattern, outside_columns)] if match), None)
+    if aggregation_match is None:
+        return None
+    aggregation, keyword = aggregation_match
+
+    matches = _filter_matches(question, columns)
+    filters = [(column, operator, value) for column, operator, value, _, _ in matches]
+    group_by, group_match = next(((c, match) for c in columns
+                                  for match in [re.search(rf"\b(by|per|for each)\s+{_column_pattern(c)}", text)] if match),
+                                 (None, None))
+    filter_columns = {c for c, _, _ in filters}
+    numeric_targets = [c for c in columns if c != group_by and c not in filter_columns
+                       and pd.api.types.is_numeric_dtype(df[c])]
+    target = numeric_targets[0] if numeric_targets else next(
+        (c for c in columns if c != group_by and c not in filter_columns), None)
+
+    # Anything not parsed into column, filter, group-by or aggregation is a constraint pandas would silently ignore
+    parsed = [(start, end) for *_, start, end in matches] + [keyword.span()]
+    parsed += [(start, end) for column, start, end in spans if column in (target, group_by)]
+    if group_match:
+        parsed.append(group_match.span())
+    leftover = [word for word in re.findall(r"[a-z0-9]+", _blank(text, parsed)) if word not in FILLER_WORDS]
+    unused_columns = [c for c in columns if c not in (target, group_by) and c not in filter_columns]
+    if leftover or unused_columns:
+        logger.info(f"Not answering from the table, unparsed parts: {leftover + unused_columns}")
+        return None
+
+    filtered = apply_filters(df, filters) if filters else df
+    condition = " and ".join(f"`{c}` {op} {v}" for c, op, v in filters)
+    scope = f" where {condition} ({len(filtered):,} of {len(df):,} rows)" if filters else ""
+
+    if aggregation == "count" and target is not None and not group_by:
+        # "How many flights did X make" counts something in a column, not rows
+        return None
+    if aggregation == "count":
+        if group_by:
+            counts = filtered[group_by].value_counts().head(MAX_GROUPS_SHOWN)
+            lines = "\n".join(f"- {key}: **{value:,}**" for key, value in counts.items())
+            return f"Rows per `{group_by}`{scope}:\n\n{lines}"
+        return f"There are **{len(filtered):,}** rows{scope}."
+
+    if target is None:
+        return None
+    if aggregation not in ("nunique", "count") and not pd.api.types.is_numeric_dtype(df[target]):
+        return None
+
+    if group_by:
+        grouped = filtered.groupby(group_by)[target].agg(aggregation).sort_values(ascending=False)
+        lines = "\n".join(f"- {key}: **{_format_value(value)}**" for key, value in grouped.head(MAX_GROUPS_SHOWN).items())
+        return f"{aggregation} of `{target}` per `{group_by}`{scope}:\n\n{lines}"
+
+    if filtered.empty:
+        return f"No rows match{scope}."
+    value = filtered[target].agg(aggregation)
+    answer = f"The {aggregation} of `{target}`{scope} is **{_format_value(value)}**."
+    if aggregation in ("max", "min"):
+        row = filtered.loc[filtered[target].idxmax() if aggregation == "max" else filtered[target].idxmin()]
+        details = ", ".join(f"{k}: {v}" for k, v in row.drop(labels=["geometry"], errors="ignore").head(8).items())
+        answer += f"\n\nRow: {details}"
+    return answer
+
+def summarize_dataframe(df: pd.DataFrame, metadata: dict, row_group_size: int = ROW_GROUP_SIZE) -> List[Document]:
+    """One schema document plus one compact summary per row group, instead of the whole table text"""
+    name = metadata.get("doc_id", metadata.get("source", "table"))
+    columns = [c for c in df.columns if c != "geometry"][:MAX_SUMMARY_COLUMNS]
+    numeric = [c for c in columns if pd.api.types.is_numeric_dtype(df[c])]
+    categorical = [c for c in columns if c not in numeric]
+
+    schema = [f"Table {name} has {len(df):,} rows and {len(df.columns)} columns."]
+    schema.append("Columns: " + ", ".join(f"{c} ({df[c].dtype})" for c in columns))
+    documents = [Document(page_content="\n".join(schema), metadata={**metadata, "row_start": 0, "row_end": len(df)})]
+
+    for start in range(0, len(df), row_group_size):
+        group = df.iloc[start:start + row_group_size]
+        lines = [f"Table {name} rows {start + 1}-{start + len(group)} of {len(df):,}."]
+        if numeric:
+            stats = group[numeric].agg(["min", "max", "mean"])
+            for c in numeric:
+                lines.append(f"{c}: min {_format_value(stats.at['min', c])}, "
+                             f"max {_format_value(stats.at['max', c])}, mean {_format_value(stats.at['mean', c])}")
+        for c in categorical:
+            top = group[c].astype(str).value_counts().head(5)
+            lines.append(f"{c}: " + ", ".join(f"{k} ({v})" for k, v in top.items()))
+        sample = group[columns].head(3).to_dict("records")
+        lines.append("Sample rows: " + "; ".join(str(row) for row in sample))
+        documents.append(Document(
+            page_content="\n".join(lines),
+            metadata={**metadata, "row_start": start, "row_end": start + len(group)}
+        ))
+    logger.info(f"Summarized {len(df):,} rows of {name} into {len(documents)} documents")
+    return documents
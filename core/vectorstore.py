@@ -0,0 +1,452 @@
+# In-process vector store: a memory-mapped, quantized NumPy matrix searched with batched dot products
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DTYPE = os.getenv("CHATDOC_VECTOR_DTYPE", "float16")  # float16 or int8
+# Exact search below this many rows, IVF above it; 0 always searches exactly
+IVF_MIN_ROWS = int(os.getenv("CHATDOC_IVF_MIN_ROWS", "20000"))
+IVF_PROBES = int(os.getenv("CHATDOC_IVF_PROBES", "16"))
+# Searches below this size run on a float32 copy held in RAM, larger matrices are scanned from the memory map.
+# NumPy has no fast float16/int8 matmul, so the copy trades memory for BLAS speed on small and mid corpora
+DENSE_CACHE_MB = float(os.getenv("CHATDOC_VECTOR_RAM_MB", "256"))
+# Rows converted to float32 at a time, bounds the scratch memory of a full scan
+SEARCH_BLOCK_ROWS = 65536
+# Rewrite the matrix once this share of its rows belongs to deleted or replaced chunks
+COMPACT_DEAD_FRACTION = 0.3
+
+def normalize(vectors) -> np.ndarray:
+    """float32 rows scaled to unit length, so dot products are cosine similarities"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Unit rows as float16, or as int8 with one float32 scale per row"""
+    if dtype == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1) / 127.0, 1e-12).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+    return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+
+def top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Best k scores per query row, highest first"""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        rows = np.take_along_axis(np.broadcast_to(rows, (len(scores), rows.shape[-1])), part, axis=1)
+    else:
+        rows = np.broadcast_to(rows, scores.shape)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
+
+def hit_lists(rows: np.ndarray, scores: np.ndarray) -> List[List[Tuple[int, float]]]:
+    """(row, score) pairs per query, without the masked-out rows"""
+    return [[(row, score) for row, score in zip(row_ids.tolist(), row_scores.tolist()) if score > -np.inf]
+            for row_ids, row_scores in zip(rows, scores)]
+
+class IVFIndex:
+    """Spherical k-means partition of the rows; a query only scans the lists of its nearest centroids"""
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.rows = len(assignments)  # rows added later are scanned exhaustively until the next training
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+
+    @classmethod
+    def train(cls, matrix_rows, n_rows: int, iterations: int = 8, sample_size: int = 20000, seed: int = 0) -> "IVFIndex":
+        """Train on a sample, then assign every row in blocks"""
+        rng = np.random.default_rng(seed)
+        n_lists = int(min(max(np.sqrt(n_rows), 16), 4096))
+        sample = normalize(matrix_rows(np.sort(rng.choice(n_rows, min(sample_size, n_rows), replace=False))))
+        centroids = sample[rng.choice(len(sample), min(n_lists, len(sample)), replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            # Empty lists restart on random points rather than disappearing
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize(sums)
+        assignments = np.empty(n_rows, dtype=np.int32)
+        for start in range(0, n_rows, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, n_rows)
+            assignments[start:stop] = np.argmax(matrix_rows(np.arange(start, stop)) @ centroids.T, axis=1)
+        return cls(centroids, assignments)
+
+    def candidates(self, query: np.ndarray, probes: int, total_rows: int) -> np.ndarray:
+        probed = np.argpartition(-(self.centroids @ query), min(probes, len(self.centroids)) - 1)[:probes]
+        return np.concatenate([self.lists[i] for i in probed] + [np.arange(self.rows, total_rows)])
+
+class NumpyVectorStore(VectorStore):
+    """Unit-normalized float16/int8 matrix on disk, memory-mapped and searched with batched NumPy dot products
+
+    Chunk ids, texts and metadata live in SQLite next to the matrix, together with the row count,
+    so a write only becomes visible once its SQLite transaction commits.
+    """
+
+    def __init__(self, path: str, embedding_function: Embeddings, dtype: str = VECTOR_DTYPE):
+        self.path = path
+        self._embeddings = embedding_function
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._ivf_lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, "chunks.sqlite3"), check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self._ivf: Optional[IVFIndex] = None
+        self._dense: Optional[np.ndarray] = None
+        self._load(dtype)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def _meta(self) -> dict:
+        return {key: json.loads(value) for key, value in self._conn.execute("SELECT key, value FROM meta")}
+
+    def _write_meta(self, **values):
+        self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               [(key, json.dumps(value)) for key, value in values.items()])
+
+    def _file(self, name: str, generation: Optional[int] = None, ext: str = "bin") -> str:
+        return os.path.join(self.path, f"{name}.{self.generation if generation is None else generation}.{ext}")
+
+    def _load(self, dtype: str):
+        meta = self._meta()
+        # An existing matrix keeps its dtype, the setting applies to new stores
+        self.dtype = meta.get("dtype", dtype)
+        self.dim = meta.get("dim")
+        self.rows = meta.get("rows", 0)
+        self.generation = meta.get("generation", 0)
+        # Set on published snapshots, which replicas share and nothing may change
+        self.read_only = meta.get("read_only", False)
+        self._map()
+        self._alive = np.zeros(self.rows, dtype=bool)
+        live_rows = [row for (row,) in self._conn.execute("SELECT row FROM chunks")]
+        self._alive[live_rows] = True
+        self._ivf = None
+        ivf_path = self._file("ivf", ext="npz")
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as saved:
+                if len(saved["assignments"]) <= self.rows:
+                    self._ivf = IVFIndex(saved["centroids"], saved["assignments"])
+        # Files of an older generation are left behind when a compaction was interrupted
+        for name in os.listdir(self.path) if not self.read_only else []:
+            if name.split(".")[0] in ("vectors", "scales", "ivf") and f".{self.generation}." not in name:
+                os.remove(os.path.join(self.path, name))
+        if self.rows:
+            logger.info(f"Opened vector matrix at {self.path}: {int(self._alive.sum())} live of {self.rows} rows, {self.dtype}")
+
+    def _map(self):
+        self._dense = None
+        if not self.rows:
+            self._vectors = np.zeros((0, self.dim or 0), dtype=self.dtype)
+            self._scales = np.zeros(0, dtype=np.float32)
+            return
+        # Pages are only read when a search touches them, so a cold start costs next to nothing
+        self._vectors = np.memmap(self._file("vectors"), dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+        self._scales = np.memmap(self._file("scales"), dtype=np.float32, mode="r", shape=(self.rows,))
+
+    def _append_file(self, path: str, data: np.ndarray, valid_bytes: int):
+        # Bytes past the committed rows come from a write that never committed
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.truncate(valid_bytes)
+            f.seek(valid_bytes)
+            f.write(data.tobytes())
+
+    def _rows_for(self, ids: List[str]) -> List[int]:
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows += [row for (row,) in self._conn.execute(
+                f"SELECT row FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)]
+        return rows
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"Vector store at {self.path} is a read-only snapshot")
+
+    def freeze(self):
+        """Mark the store read-only, for good"""
+        with self._lock:
+            with self._conn:
+                self._write_meta(read_only=True)
+            self.read_only = True
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], metadatas: List[dict], documents: List[str]):
+        """Write precomputed vectors; replaced ids keep their old rows as dead space until compaction"""
+        self._check_writable()
+        if not ids:
+            return
+        vectors, scales = quantize(normalize(embeddings), self.dtype)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the store's {self.dim}")
+            start = self.rows
+            itemsize = np.dtype(self.dtype).itemsize
+            self._append_file(self._file("vectors"), vectors, start * self.dim * itemsize)
+            self._append_file(self._file("scales"), scales, start * 4)
+            replaced = self._rows_for(ids)
+            with self._conn:
+                self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, id, document, metadata) VALUES (?, ?, ?, ?)",
+                    [(start + i, chunk_id, text, json.dumps(metadata or {}))
+                     for i, (chunk_id, text, metadata) in enumerate(zip(ids, documents, metadatas))]
+                )
+                self._write_meta(dtype=self.dtype, dim=self.dim, rows=start + len(ids), generation=self.generation)
+            self.rows = start + len(ids)
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            self._alive[replaced] = False
+            self._map()
+            self._maybe_compact()
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        self.upsert(ids, self._embeddings.embed_documents(texts), metadatas or [{} for _ in texts], texts)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        self._check_writable()
+        if not ids:
+            return False
+        with self._lock:
+            rows = self._rows_for(list(ids))
+            with self._conn:
+                self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._alive[rows] = False
+            self._maybe_compact()
+        return True
+
+    def _maybe_compact(self):
+        dead = self.rows - int(self._alive.sum())
+        if dead and dead >= COMPACT_DEAD_FRACTION * self.rows:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite only the live rows into a new file generation, switched over in one SQLite commit"""
+        live = np.flatnonzero(self._alive)
+        generation = self.generation + 1
+        with open(self._file("vectors", generation), "wb") as vectors_file, open(self._file("scales", generation), "wb") as scales_file:
+            for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+                block = live[start:start + SEARCH_BLOCK_ROWS]
+                vectors_file.write(np.ascontiguousarray(self._vectors[block]).tobytes())
+                scales_file.write(np.ascontiguousarray(self._scales[block]).tobytes())
+        with self._conn:
+            # Ascending order never collides: every new row number is at most the old one
+            self._conn.executemany("UPDATE chunks SET row = ? WHERE row = ?",
+                                   [(new, int(old)) for new, old in enumerate(live) if new != old])
+            self._write_meta(rows=len(live), generation=generation)
+        old_generation = self.generation
+        self.generation, self.rows = generation, len(live)
+        self._alive = np.ones(len(live), dtype=bool)
+        self._ivf = None
+        self._map()
+        for name in ("vectors", "scales"):
+            os.remove(self._file(name, old_generation))
+        ivf_path = self._file("ivf", old_generation, "npz")
+        if os.path.exists(ivf_path):
+            os.remove(ivf_path)
+        logger.info(f"Compacted vector matrix to {len(live)} rows")
+
+    def reset(self):
+        """Drop every chunk and vector"""
+        self._check_writable()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM chunks")
+                self._conn.execute("DELETE FROM meta")
+            for name in os.listdir(self.path):
+                if name.endswith((".bin", ".npz")):
+                    os.remove(os.path.join(self.path, name))
+            self._load(self.dtype)
+
+    def _matrix_rows(self, vectors: np.ndarray, scales: np.ndarray):
+        def rows(index: np.ndarray) -> np.ndarray:
+            return np.asarray(vectors[index], dtype=np.float32) * scales[index, None]
+        return rows
+
+    def _dense_matrix(self, vectors: np.ndarray, scales: np.ndarray, rows: int, generation: int) -> Optional[np.ndarray]:
+        if rows * (self.dim or 0) * 4 > DENSE_CACHE_MB * 1024 * 1024:
+            return None
+        dense = self._dense
+        if dense is None or len(dense) != rows:
+            # Rebuilt lazily after writes, so an ingestion converts the matrix once rather than per batch
+            dense = np.asarray(vectors, dtype=np.float32) * scales[:, None]
+            with self._lock:
+                if self.rows == rows and self.generation == generation:
+                    self._dense = dense
+        return dense
+
+    def _ensure_ivf(self, vectors: np.ndarray, scales: np.ndarray, rows: int, generation: int) -> Optional[IVFIndex]:
+        if not IVF_MIN_ROWS or rows < IVF_MIN_ROWS:
+            return None
+        # Retrained once a quarter of the rows arrived after the last training
+        with self._ivf_lock:
+            if self._ivf is not None and rows <= self._ivf.rows * 1.25:
+                return self._ivf
+            logger.info(f"Training IVF index over {rows} rows")
+            ivf = IVFIndex.train(self._matrix_rows(vectors, scales), rows)
+            with self._lock:
+                # A compaction in the meantime renumbered the rows this was trained on
+                if self.generation == generation:
+                    self._ivf = ivf
+                    if not self.read_only:
+                        np.savez(self._file("ivf", ext="npz"), centroids=ivf.centroids, assignments=ivf.assignments)
+            return ivf
+
+    def search_vectors(self, queries, k: int = 4) -> List[List[Tuple[int, float]]]:
+        """Top-k (row, cosine similarity) for each query vector, exact in blocks or through the IVF lists"""
+        return self._search(queries, k)[1]
+
+    def _search(self, queries, k: int) -> Tuple[int, List[List[Tuple[int, float]]]]:
+        """Hits and the file generation their row numbers belong to"""
+        queries = normalize(queries)
+        # Searches run on this snapshot without the lock; a compaction meanwhile renumbers the rows,
+        # which the generation tells the caller about
+        with self._lock:
+            vectors, scales, alive, rows, generation = self._vectors, self._scales, self._alive, self.rows, self.generation
+        if not rows:
+            return generation, [[] for _ in queries]
+        dense = self._dense_matrix(vectors, scales, rows, generation)
+        matrix_rows = (lambda index: dense[index]) if dense is not None else self._matrix_rows(vectors, scales)
+
+        ivf = self._ensure_ivf(vectors, scales, rows, generation)
+        if ivf is not None:
+            results = []
+            for query in queries:
+                candidates = ivf.candidates(query, IVF_PROBES, rows)
+                candidates = np.sort(candidates[alive[candidates]])
+                best_scores, best_rows = top_k((matrix_rows(candidates) @ query)[None, :], candidates[None, :], k)
+                results.extend(hit_lists(best_rows, best_scores))
+            return generation, results
+
+        if dense is not None:
+            scores = queries @ dense.T
+            if not alive.all():
+                scores[:, ~alive] = -np.inf
+            best_scores, best_rows = top_k(scores, np.arange(rows)[None, :], k)
+            return generation, hit_lists(best_rows, best_scores)
+
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, rows, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, rows)
+            # One matmul for every query against the block, int8 rows are rescaled after the product
+            scores = (queries @ np.asarray(vectors[start:stop], dtype=np.float32).T) * scales[start:stop]
+            scores[:, ~alive[start:stop]] = -np.inf
+            block_scores, block_rows = top_k(scores, np.arange(start, stop)[None, :], k)
+            best_scores, best_rows = top_k(np.concatenate([best_scores, block_scores], axis=1),
+                                           np.concatenate([best_rows, block_rows], axis=1), k)
+        return generation, hit_lists(best_rows, best_scores)
+
+    def _documents(self, hits: List[Tuple[int, float]]) -> List[Tuple[Document, float]]:
+        # Called with the lock held, so the rows still mean what they meant to the search
+        if not hits:
+            return []
+        records = {row: (chunk_id, text, metadata) for row, chunk_id, text, metadata in self._conn.execute(
+            f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(hits))})",
+            [row for row, _ in hits]
+        )}
+        # Rows deleted since the search are skipped
+        return [(Document(id=records[row][0], page_content=records[row][1], metadata=json.loads(records[row][2])), score)
+                for row, score in hits if row in records]
+
+    def _search_documents(self, embeddings: List[List[float]], k: int) -> List[List[Tuple[Document, float]]]:
+        while True:
+            generation, hits = self._search(embeddings, k)
+            with self._lock:
+                if self.generation == generation:
+                    return [self._documents(query_hits) for query_hits in hits]
+            logger.debug("Vector matrix was compacted during a search, searching again")
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4) -> List[List[Document]]:
+        """Batched search, one matrix product per block for all queries"""
+        return [[doc for doc, _ in results] for results in self._search_documents(embeddings, k)]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        return self._search_documents([embedding], k)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embeddings.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    def iter_records(self, batch_size: int = 1000) -> Iterator[Tuple[List[str], np.ndarray, List[dict], List[str]]]:
+        """(ids, float32 vectors, metadatas, documents) of every live chunk, in row order"""
+        last_row = -1
+        while True:
+            with self._lock:
+                records = self._conn.execute(
+                    "SELECT row, id, document, metadata FROM chunks WHERE row > ? ORDER BY row LIMIT ?",
+                    (last_row, batch_size)
+                ).fetchall()
+                vectors, scales = self._vectors, self._scales
+            if not records:
+                return
+            rows = np.array([row for row, _, _, _ in records])
+            yield ([chunk_id for _, chunk_id, _, _ in records], self._matrix_rows(vectors, scales)(rows),
+                   [json.loads(metadata) for _, _, _, metadata in records], [text for _, _, text, _ in records])
+            last_row = int(rows[-1])
+
+    def build_ivf(self) -> bool:
+        """Train the IVF lists now instead of on the first search, True if the store is large enough to use them"""
+        with self._lock:
+            vectors, scales, rows, generation = self._vectors, self._scales, self.rows, self.generation
+        return self._ensure_ivf(vectors, scales, rows, generation) is not None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Row counts and on-disk size of the matrix"""
+        with self._lock:
+            live = int(self._alive.sum())
+            return {
+                "rows": self.rows,
+                "live": live,
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "matrix_bytes": self.rows * (self.dim or 0) * np.dtype(self.dtype).itemsize + self.rows * 4,
+                "ivf_lists": len(self._ivf.centroids) if self._ivf is not None else 0
+            }
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, path: str = "data/vector_store_numpy", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,225 @@
+# Multi-tenant workspaces: chunk quotas, eviction of idle workspaces and spilling of session data to disk
+import os
+import sys
+import time
+import pickle
+import hashlib
+import shutil
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from langchain_core.documents import Document
+from core.embeddings import list_indexed_documents, release_store
+from core.scheduler import current_session_id
+
+logger = logging.getLogger(__name__)
+
+# Chunks one workspace may hold in the index, 0 for no limit
+WORKSPACE_MAX_CHUNKS = int(os.getenv("CHATDOC_WORKSPACE_MAX_CHUNKS", "200000"))
+# Workspaces whose store handles and BM25 index stay cached, least recently used dropped first
+MAX_OPEN_WORKSPACES = int(os.getenv("CHATDOC_MAX_OPEN_WORKSPACES", "16"))
+WORKSPACE_IDLE_SECONDS = float(os.getenv("CHATDOC_WORKSPACE_IDLE_SECONDS", "1800"))
+# DataFrames, GeoJSON and chunk lists a session keeps in memory, the least recently used beyond it go to disk
+SESSION_MEMORY_MB = float(os.getenv("CHATDOC_SESSION_MEMORY_MB", "256"))
+SPILL_DIR = os.getenv("CHATDOC_SPILL_DIR", "data/session_spill")
+
+def workspace_chunks(persist_directory: str, excluding: Iterable[str] = ()) -> int:
+    """Chunks a workspace holds, without the documents about to be replaced"""
+    excluded = set(excluding)
+    return sum(entry["chunks"] for doc_id, entry in list_indexed_documents(persist_directory).items() if doc_id not in excluded)
+
+def check_chunk_quota(persist_directory: str, doc_ids: Iterable[str], new_chunks: int, limit: int = WORKSPACE_MAX_CHUNKS):
+    """Refuse an ingestion that would take the workspace past its chunk quota"""
+    if not limit:
+        return
+    used = workspace_chunks(persist_directory, doc_ids)
+    if used + new_chunks > limit:
+        raise RuntimeError(f"Workspace chunk quota exceeded: {used} indexed + {new_chunks} new > {limit} chunks. "
+                           f"Delete documents or use a coarser chunking")
+
+def quota_guard(chunks: Iterable[Document], remaining: int, state: dict) -> Iterator[Document]:
+    """Pass a chunk stream through until the workspace quota runs out"""
+    for chunk in chunks:
+        if remaining and state["chunks"] >= remaining:
+            state["exceeded"] = True
+            raise RuntimeError(f"Workspace chunk quota exceeded after {state['chunks']} chunks of a streamed document")
+        state["chunks"] += 1
+        yield chunk
+
+class WorkspaceRegistry:
+    """Open workspaces in least recently used order; idle ones drop their cached store handles and BM25 index"""
+
+    def __init__(self, max_open: int = MAX_OPEN_WORKSPACES, idle_seconds: float = WORKSPACE_IDLE_SECONDS):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._last_used: "OrderedDict[str, float]" = OrderedDict()
+        self._pinned: Dict[str, int] = {}
+        self.evictions = 0
+
+    def touch(self, persist_directory: str) -> List[str]:
+        """Mark a workspace as used and drop the handles of the ones past the limits"""
+        now = time.time()
+        with self._lock:
+            self._last_used[persist_directory] = now
+            self._last_used.move_to_end(persist_directory)
+            evict = []
+            # Oldest first; a workspace with a running ingestion keeps its handles
+            for directory, last_used in self._last_used.items():
+                over_limit = len(self._last_used) - len(evict) > self.max_open
+                if directory != persist_directory and not self._pinned.get(directory) \
+                        and (over_limit or now - last_used > self.idle_seconds):
+                    evict.append(directory)
+            for directory in evict:
+                del self._last_used[directory]
+            self.evictions += len(evict)
+        for directory in evict:
+            # Frees a NumPy store's vectors; Chroma's shared client keeps the collection's segments loaded
+            release_store(directory)
+            logger.info(f"Released idle workspace {directory}")
+        if evict:
+            # Cached chains hold the released stores, they are rebuilt on the next question
+            from core.llm import get_cached_llm_chain, get_cached_retriever
+            get_cached_llm_chain.clear()
+            get_cached_retriever.clear()
+        return evict
+
+    @contextmanager
+    def pin(self, persist_directory: str):
+        """Keep a workspace open while background work writes to it"""
+        with self._lock:
+            self._pinned[persist_directory] = self._pinned.get(persist_directory, 0) + 1
+        try:
+            self.touch(persist_directory)
+            yield
+        finally:
+            with self._lock:
+                self._pinned[persist_directory] -= 1
+                if not self._pinned[persist_directory]:
+                    del self._pinned[persist_directory]
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            return {
+                "open": len(self._last_used),
+                "max_open": self.max_open,
+                "evictions": self.evictions,
+                "idle_seconds": {directory: round(now - last_used) for directory, last_used in self._last_used.items()}
+            }
+
+_workspace_registry = None
+_workspace_registry_lock = threading.Lock()
+
+def get_workspace_registry() -> WorkspaceRegistry:
+    """Process-wide registry of open workspaces"""
+    global _workspace_registry
+    with _workspace_registry_lock:
+        if _workspace_registry is None:
+            _workspace_registry = WorkspaceRegistry()
+        return _workspace_registry
+
+def estimate_bytes(value: Any) -> int:
+    """Rough resident size of a session value"""
+    if hasattr(value, "memory_usage"):
+        # DataFrames and GeoDataFrames, including their string columns
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, list):
+        return sum(sys.getsizeof(doc.page_content) + sys.getsizeof(str(doc.metadata)) if isinstance(doc, Document)
+                   else sys.getsizeof(doc) for doc in value)
+    return sys.getsizeof(value)
+
+class SessionSpill:
+    """Session values within a memory budget, the least recently used ones pickled to disk and loaded back on access"""
+
+    def __init__(self, session_id: str, budget_mb: float = SESSION_MEMORY_MB, directory: str = SPILL_DIR):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.directory = os.path.join(directory, str(os.getpid()), session_id)
+        self._lock = threading.RLock()
+        # key -> {"value", "bytes", "path"}; value is None while spilled
+        self._items: "OrderedDict[str, dict]" = OrderedDict()
+        self.spills = 0
+        # Spilled files go with the session
+        weakref.finalize(self, shutil.rmtree, self.directory, True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.pkl")
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self.pop(key)
+            self._items[key] = {"value": value, "bytes": estimate_bytes(value), "path": None}
+            self._enforce(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            self._items.move_to_end(key)
+            if item["value"] is None:
+                with open(item["path"], "rb") as f:
+                    item["value"] = pickle.load(f)
+                os.remove(item["path"])
+                item["path"] = None
+                self._enforce(key)
+            return item["value"]
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return default
+            if item["path"]:
+                with open(item["path"], "rb") as f:
+                    item["value"] = pickle.load(f)
+                os.remove(item["path"])
+            return item["value"]
+
+    def keys(self, prefix: str = "") -> List[str]:
+        with self._lock:
+            return [key for key in self._items if key.startswith(prefix)]
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(item["bytes"] for item in self._items.values() if item["value"] is not None)
+
+    def _enforce(self, keep: str):
+        """Spill the least recently used values until the session fits its budget"""
+        resident = self.memory_bytes()
+        for key, item in self._items.items():
+            if resident <= self.budget:
+                break
+            if key == keep or item["value"] is None:
+                continue
+            os.makedirs(self.directory, exist_ok=True)
+            item["path"] = self._path(key)
+            with open(item["path"], "wb") as f:
+                pickle.dump(item["value"], f, protocol=pickle.HIGHEST_PROTOCOL)
+            item["value"] = None
+            resident -= item["bytes"]
+            self.spills += 1
+            logger.info(f"Spilled {key} ({item['bytes'] / (1024 * 1024):.1f} MB) of session {os.path.basename(self.directory)} to disk")
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident_mb": round(self.memory_bytes() / (1024 * 1024), 1),
+                "spilled": sum(1 for item in self._items.values() if item["value"] is None),
+                "items": len(self._items),
+                "budget_mb": round(self.budget / (1024 * 1024), 1)
+            }
+
+def get_session_data(session_state) -> SessionSpill:
+    """This session's spillable data, created on first use"""
+    if "session_data" not in session_state:
+        session_state["session_data"] = SessionSpill(current_session_id())
+    return session_state["session_data"]
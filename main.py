@@ -1,16 +1,20 @@
 # type: ignore
 import os
 import streamlit as st
-import ollama
 from core.llm import extract_model_names
 from components.upload import handle_file_upload
 from components.chat import display_chat_interface
-from utils.helpers import setup_logging
-from core.embeddings import get_vector_store
+from core.embeddings import EMBEDDING_MODEL
+from core.models import get_model_manager
+from core.scheduler import get_scheduler
+from core.workspaces import get_workspace_registry
+from utils.helpers import setup_logging, get_metrics, start_metrics_server
 os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
 logger = setup_logging()
 
 def main():
+    # Prometheus /metrics and /metrics.json when CHATDOC_METRICS_PORT is set
+    start_metrics_server()
     st.set_page_config(
         page_title="ChatDocument",
         page_icon="📚",
@@ -22,7 +26,9 @@ def main():
         st.title("🤖 Select LLM Model")
         # Model selection
         try:
-            models_info = ollama.list()
+            model_manager = get_model_manager()
+            # Cached with a TTL instead of hitting Ollama on every rerun
+            models_info = model_manager.list_models()
             available_models = extract_model_names(models_info)
             if not available_models:
                 available_models = ("llama3.2:latest",)
@@ -41,20 +47,31 @@ def main():
                 index=current_index
             )
             st.session_state.selected_model = selected_model
+
+            # Load the chat and embedding models in the background so the first question doesn't pay for it
+            model_manager.ensure_warm(selected_model)
+            model_manager.ensure_warm(EMBEDDING_MODEL, embedding=True)
+            model_stats = model_manager.stats()
+            status_icons = {"warm": "🔥", "loading": "⏳", "cold": "❄️"}
+            st.caption(" | ".join(
+                f"{status_icons[model_stats[m]['status']]} {m}" for m in (selected_model, EMBEDDING_MODEL) if m in model_stats
+            ))
         except Exception as e:
             st.error(f"Error loading models: {str(e)}")
             st.session_state.selected_model = "llama3.2:latest"
         st.title("📗 Upload Document")
+        # New uploads are queued as background ingestion jobs, other reruns only read their status
         documents = handle_file_upload()
-        
-        if documents:
-            st.session_state['documents'] = documents
-            # Create vector store with force_refresh=True for new documents
-            vector_store = get_vector_store(documents, force_refresh=True)
-            st.session_state['vector_store'] = vector_store
-            st.success(f"Document processed: {len(documents)} chunks created")
-        elif 'documents' in st.session_state:
-            documents = st.session_state['documents']
+
+        # Queue depth and wait times of the shared Ollama scheduler
+        with st.expander("⚙️ Request Queue"):
+            st.json(get_scheduler().metrics())
+        with st.expander("🌡️ Model Latency"):
+            st.json(get_model_manager().stats())
+        with st.expander("📈 Stage Latency"):
+            st.dataframe(get_metrics().snapshot(), hide_index=True)
+        with st.expander("🗂️ Open Workspaces"):
+            st.json(get_workspace_registry().stats())
     
     # Main chat interface
     display_chat_interface(documents)
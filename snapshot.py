@@ -0,0 +1,58 @@
+# Export, publish and prune index snapshots that replicas serve with CHATDOC_VECTOR_BACKEND=snapshot
+# Usage: python snapshot.py export [--name NAME] [--no-publish] | publish NAME | list | prune [--keep N]
+import os
+import sys
+import json
+import logging
+import argparse
+os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
+from core.embeddings import VECTOR_BACKEND, VECTOR_STORE_DIR
+from core.snapshot import (
+    SNAPSHOT_DIR,
+    SNAPSHOT_KEEP,
+    current_snapshot,
+    export_snapshot,
+    list_snapshots,
+    prune_snapshots,
+    publish_snapshot
+)
+from core.vectorstore import VECTOR_DTYPE
+
+logger = logging.getLogger("snapshot")
+
+def main():
+    parser = argparse.ArgumentParser(description="Versioned snapshots of the persisted index")
+    parser.add_argument("--root", default=SNAPSHOT_DIR, help="Directory holding the snapshots and the CURRENT pointer")
+    parser.add_argument("--log-level", default="INFO")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help=f"Snapshot the live index in {VECTOR_STORE_DIR}")
+    export.add_argument("--name", help="Snapshot name, defaults to a timestamp and the index version")
+    export.add_argument("--dtype", default=VECTOR_DTYPE, choices=["float16", "int8"])
+    export.add_argument("--no-publish", action="store_true", help="Build it without pointing CURRENT at it")
+    publish = commands.add_parser("publish", help="Point CURRENT at a snapshot, also used to roll back")
+    publish.add_argument("name")
+    commands.add_parser("list", help="Snapshots, oldest first, with the current one marked")
+    prune = commands.add_parser("prune", help="Delete old snapshots")
+    prune.add_argument("--keep", type=int, default=SNAPSHOT_KEEP)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.command == "export":
+        if VECTOR_BACKEND == "snapshot":
+            parser.error("Export from the live index: run with CHATDOC_VECTOR_BACKEND set to chroma or numpy")
+        info = export_snapshot(root=args.root, name=args.name, dtype=args.dtype, publish=not args.no_publish)
+        print(json.dumps({key: info[key] for key in ("name", "path", "chunks", "dtype", "ivf_lists", "index_version")}))
+    elif args.command == "publish":
+        print(publish_snapshot(args.name, args.root))
+    elif args.command == "list":
+        current = current_snapshot(args.root)
+        for info in list_snapshots(args.root):
+            marker = "*" if info["path"] == current else " "
+            print(f"{marker} {info['name']}  {info['chunks']} chunks, {len(info['documents'])} documents, "
+                  f"{info['dtype']}, {info['embedding_model']}")
+    elif args.command == "prune":
+        for path in prune_snapshots(args.root, args.keep):
+            print(f"removed {path}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+# Shared setup: repo root importable, persistent caches and indexes in a throwaway directory
+import os
+import sys
+import hashlib
+import tempfile
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DOCS = os.path.join(ROOT, "data", "sample_docs")
+sys.path.insert(0, ROOT)
+
+# Read by core modules at import time, so set before any test imports them
+_scratch = tempfile.mkdtemp(prefix="chatdoc-tests-")
+os.environ.setdefault("CHATDOC_EMBEDDING_CACHE_PATH", os.path.join(_scratch, "embedding_cache", "cache.sqlite3"))
+os.environ.setdefault("CHATDOC_LEXICAL_INDEX_DIR", os.path.join(_scratch, "lexical_index"))
+os.environ.setdefault("CHATDOC_SPILL_DIR", os.path.join(_scratch, "session_spill"))
+os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
+
+class HashEmbeddings(Embeddings):
+    """Deterministic offline embeddings: the same text always maps to the same unit vector"""
+
+    def __init__(self, dim: int = 32):
+        self.dim = dim
+        self.calls = 0
+
+    def embed_query(self, text: str):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self.embed_query(text) for text in texts]
+
+@pytest.fixture
+def numpy_store(tmp_path):
+    from core.vectorstore import NumpyVectorStore
+    store = NumpyVectorStore(str(tmp_path / "vectors"), HashEmbeddings(), "float16")
+    yield store
+    store.close()
@@ -0,0 +1,140 @@
+import numpy as np
+import core.scheduler
+from conftest import HashEmbeddings
+from core.cache import CachedEmbeddings, EmbeddingCache
+from core.scheduler import RequestScheduler, ScheduledEmbeddings
+
+def test_only_unseen_texts_reach_the_model():
+    model = HashEmbeddings()
+    cache = EmbeddingCache(":memory:")
+    embeddings = CachedEmbeddings(model, "hash-model", cache)
+
+    first = embeddings.embed_documents(["alpha", "beta", "alpha"])
+    assert model.calls == 1
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 0
+    assert first[0] == first[2]
+
+    # Whitespace differences share the cached vector
+    second = embeddings.embed_documents(["alpha", "beta  "])
+    assert model.calls == 1
+    assert cache.stats()["hits"] == 2
+    # Stored as float32, so equal up to that precision
+    assert np.allclose(second, first[:2], atol=1e-6)
+
+    embeddings.embed_documents(["alpha", "gamma"])
+    assert model.calls == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 3, 3)
+
+def test_vectors_are_kept_per_model():
+    cache = EmbeddingCache(":memory:")
+    CachedEmbeddings(HashEmbeddings(), "one", cache).embed_documents(["alpha"])
+    other = HashEmbeddings()
+    CachedEmbeddings(other, "two", cache).embed_documents(["alpha"])
+    assert other.calls == 1
+
+def test_eviction_trims_the_cache_below_its_limit():
+    cache = EmbeddingCache(":memory:", max_entries=10)
+    embeddings = CachedEmbeddings(HashEmbeddings(), "hash-model", cache)
+    embeddings.embed_documents([f"text {i}" for i in range(11)])
+    assert cache.stats()["entries"] == 9
+
+class QueryPrefixEmbeddings(HashEmbeddings):
+    """Embeds queries differently from documents, like instruction-tuned embedders"""
+
+    def __init__(self):
+        super().__init__()
+        self.queries = 0
+
+    def embed_query(self, text: str):
+        self.queries += 1
+        return super().embed_query(f"query: {text}")
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [HashEmbeddings.embed_query(self, text) for text in texts]
+
+def test_single_and_batched_queries_share_one_cache_entry():
+    model = QueryPrefixEmbeddings()
+    cache = EmbeddingCache(":memory:")
+    embeddings = CachedEmbeddings(model, "hash-model", cache)
+    single = embeddings.embed_query("boiler pressure")
+    batched = embeddings.embed_queries(["boiler pressure", "pump schedule", "pump schedule"])
+    assert np.allclose(batched[0], single, atol=1e-6)
+    # Misses are embedded as queries, never as documents
+    assert model.queries == 2 and model.calls == 0
+    assert np.allclose(embeddings.embed_query("pump schedule"), QueryPrefixEmbeddings().embed_query("pump schedule"), atol=1e-6)
+    assert model.queries == 2
+    assert cache.stats()["entries"] == 2
+
+def test_batched_query_misses_go_out_as_one_scheduler_batch(monkeypatch):
+    scheduler = RequestScheduler()
+    monkeypatch.setattr(core.scheduler, "_scheduler", scheduler)
+    monkeypatch.setattr(core.scheduler, "EMBED_BATCH_WINDOW_MS", 200)
+    model = HashEmbeddings()
+    embeddings = CachedEmbeddings(ScheduledEmbeddings(model, "embed-model"), "embed-model", EmbeddingCache(":memory:"))
+    texts = [f"question {i}" for i in range(5)]
+    assert np.allclose(embeddings.embed_queries(texts), [model.embed_query(text) for text in texts], atol=1e-6)
+    metrics = scheduler.metrics()["embed-model"]
+    assert metrics["embed_batches"] == 1 and metrics["avg_batch_size"] == 5
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def test_answer_cache_matches_questions_above_the_threshold():
+    from core.cache import SemanticAnswerCache
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("llama", 1, "What is the pump pressure?", unit(1, 0, 0), "2 bar", generation_time=3.0)
+    answer, similarity = cache.lookup("llama", 1, unit(1, 0.2, 0))
+    assert answer == "2 bar" and 0.95 <= similarity < 1
+    # cos ~0.89, a different question
+    assert cache.lookup("llama", 1, unit(1, 0.5, 0)) is None
+    assert (cache.stats()["hits"], cache.stats()["misses"], cache.stats()["latency_saved"]) == (1, 1, 3.0)
+
+def test_answer_cache_keeps_model_store_and_index_version_apart():
+    from core.cache import SemanticAnswerCache
+    cache = SemanticAnswerCache()
+    cache.store("llama", 1, "question", unit(1, 0), "answer", 1.0, store="data/a")
+    assert cache.lookup("llama", 1, unit(1, 0), store="data/a")
+    assert cache.lookup("mistral", 1, unit(1, 0), store="data/a") is None
+    assert cache.lookup("llama", 2, unit(1, 0), store="data/a") is None
+    assert cache.lookup("llama", 1, unit(1, 0), store="data/b") is None
+
+def test_answer_cache_invalidation_drops_other_versions_of_one_store():
+    from core.cache import SemanticAnswerCache
+    cache = SemanticAnswerCache()
+    cache.store("llama", 1, "question", unit(1, 0), "old", 1.0, store="data/a")
+    cache.store("llama", 1, "question", unit(1, 0), "other tenant", 1.0, store="data/b")
+    cache.store("llama", 2, "question", unit(1, 0), "new", 1.0, store="data/a")
+    cache.invalidate(2, "data/a")
+    assert cache.lookup("llama", 1, unit(1, 0), store="data/a") is None
+    assert cache.lookup("llama", 2, unit(1, 0), store="data/a")[0] == "new"
+    assert cache.lookup("llama", 1, unit(1, 0), store="data/b")[0] == "other tenant"
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+
+def test_answer_cache_expires_after_the_ttl(monkeypatch):
+    import core.cache
+    from core.cache import SemanticAnswerCache
+    now = [1000.0]
+    monkeypatch.setattr(core.cache.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store("llama", 1, "question", unit(1, 0), "answer", 1.0)
+    now[0] += 59
+    assert cache.lookup("llama", 1, unit(1, 0))
+    now[0] += 2
+    assert cache.lookup("llama", 1, unit(1, 0)) is None
+    assert cache.stats()["entries"] == 0
+
+def test_answer_cache_evicts_the_least_recently_used():
+    from core.cache import SemanticAnswerCache
+    cache = SemanticAnswerCache(max_entries=2)
+    cache.store("llama", 1, "first", unit(1, 0, 0), "one", 1.0)
+    cache.store("llama", 1, "second", unit(0, 1, 0), "two", 1.0)
+    # A hit makes the first one recent again, so the second goes
+    assert cache.lookup("llama", 1, unit(1, 0, 0))
+    cache.store("llama", 1, "third", unit(0, 0, 1), "three", 1.0)
+    assert cache.lookup("llama", 1, unit(0, 1, 0)) is None
+    assert cache.lookup("llama", 1, unit(1, 0, 0))[0] == "one"
+    assert cache.lookup("llama", 1, unit(0, 0, 1))[0] == "three"
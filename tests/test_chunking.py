@@ -0,0 +1,91 @@
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from conftest import HashEmbeddings
+from core.chunking import AUTOTUNE_SIZES, BoundedMarkdownSplitter, SentenceSplitter, autotune_chunking, semantic_chunks
+from core.context import count_tokens
+from core.ingest import load_and_split
+
+MARKDOWN = """# Setup
+
+Install the package and its dependencies before anything else.
+
+## Requirements
+
+Python 3.11 is needed.
+
+## Configuration
+
+Set the environment variables described below before the first start.
+
+# Usage
+
+Start the app and upload a document to ask questions about it.
+"""
+
+class TopicEmbeddings(Embeddings):
+    """Sentences about the same topic word share one direction, so meaning shifts are known"""
+
+    TOPICS = ("river", "engine", "violin")
+
+    def embed_documents(self, texts):
+        vectors = []
+        for text in texts:
+            vector = np.zeros(len(self.TOPICS))
+            vector[[i for i, topic in enumerate(self.TOPICS) if topic in text.lower()][0]] = 1.0
+            vectors.append(vector.tolist())
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+def test_markdown_strategy_keeps_headers_through_load_and_split(tmp_path):
+    path = tmp_path / "guide.md"
+    path.write_text(MARKDOWN, encoding="utf-8")
+    chunks, _ = load_and_split((str(path), ".md", None, {"doc_id": "guide.md"}, "markdown", {"chunk_size": 400}))
+    assert [chunk.metadata.get("Header 1") for chunk in chunks] == ["Setup", "Usage"]
+    # Short subsections are merged into their parent's chunk, keeping the first section's headers
+    assert "Python 3.11 is needed." in chunks[0].page_content
+    assert "Set the environment variables" in chunks[0].page_content
+    assert all(chunk.metadata["doc_id"] == "guide.md" for chunk in chunks)
+
+def test_markdown_sections_are_bounded_and_never_merged_across_top_headers():
+    long_section = " ".join(f"Sentence number {i} about the installation." for i in range(200))
+    text = f"# Long\n\n{long_section}\n\n# Short\n\nTiny.\n\n## Also short\n\nSmall too."
+    splitter = BoundedMarkdownSplitter(max_tokens=100, min_tokens=40)
+    chunks = splitter.split_text(text)
+    long_parts = [chunk for chunk in chunks if chunk.metadata.get("Header 1") == "Long"]
+    assert len(long_parts) > 1
+    assert all(count_tokens(chunk.page_content) <= 100 for chunk in chunks)
+    short = [chunk for chunk in chunks if chunk.metadata.get("Header 1") == "Short"]
+    assert len(short) == 1 and "Small too." in short[0].page_content
+
+def test_semantic_chunks_break_where_the_topic_changes():
+    text = ("The river runs north. The river floods in spring. The river is wide. "
+            "The engine is loud. The engine needs oil. The engine is new. "
+            "The violin is old. The violin is tuned.")
+    units = SentenceSplitter(200).split_documents([Document(page_content=text, metadata={"source": "a.txt"})])
+    chunks = semantic_chunks(units, TopicEmbeddings(), max_tokens=200, min_tokens=1, breakpoint_percentile=80)
+    topics = [{topic for topic in TopicEmbeddings.TOPICS if topic in chunk.page_content} for chunk in chunks]
+    assert topics == [{"river"}, {"engine"}, {"violin"}]
+    assert all("_paragraph_start" not in chunk.metadata for chunk in chunks)
+
+def test_semantic_chunks_respect_the_token_bounds_and_keep_every_sentence():
+    sentences = [f"Sentence {i} talks about item {i * 7} in some detail." for i in range(60)]
+    documents = [Document(page_content=" ".join(sentences[:30]), metadata={"source": "a.txt", "page": 0}),
+                 Document(page_content=" ".join(sentences[30:]), metadata={"source": "a.txt", "page": 1})]
+    units = SentenceSplitter(60).split_documents(documents)
+    chunks = semantic_chunks(units, HashEmbeddings(), max_tokens=60, min_tokens=20)
+    assert all(count_tokens(chunk.page_content) <= 60 for chunk in chunks)
+    # Nothing lost or reordered, and no chunk spans two pages
+    assert " ".join(chunk.page_content for chunk in chunks) == " ".join(sentences)
+    assert all(any(s in chunk.page_content for s in sentences[:30]) != any(s in chunk.page_content for s in sentences[30:])
+               for chunk in chunks)
+
+def test_autotune_picks_one_of_the_candidates():
+    text = " ".join(f"Paragraph {i} explains how the component number {i} is configured and deployed." for i in range(120))
+    params, candidates = autotune_chunking([Document(page_content=text)], HashEmbeddings())
+    assert params["chunk_size"] in AUTOTUNE_SIZES
+    assert len(candidates) == len(AUTOTUNE_SIZES) * 2
+    best = max(candidates, key=lambda c: (c["score"], c["chunk_size"]))
+    assert params == {"chunk_size": best["chunk_size"], "chunk_overlap": best["chunk_overlap"]}
@@ -0,0 +1,50 @@
+import pytest
+from langchain_core.documents import Document
+import core.context
+from core.context import CHARS_PER_TOKEN, count_tokens, pack_context, split_sentences
+
+@pytest.fixture
+def no_tiktoken(monkeypatch):
+    # As when the encoding can't be downloaded
+    monkeypatch.setattr(core.context, "_encoding", None)
+    monkeypatch.setattr(core.context, "_encoding_loaded", True)
+
+def docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+def test_tokens_are_estimated_from_length_without_tiktoken(no_tiktoken):
+    assert count_tokens("") == 0
+    assert count_tokens("abcd") == 1
+    assert count_tokens("abcde") == 2
+    assert count_tokens("x" * 400) == 400 // CHARS_PER_TOKEN
+
+def test_sentences_split_on_punctuation_followed_by_space():
+    assert split_sentences("Pi is 3.14 today. Version v1.2 ships! Does it?") == \
+        ["Pi is 3.14 today.", " Version v1.2 ships!", " Does it?"]
+
+@pytest.mark.parametrize("budget", [20, 37, 60, 200])
+def test_packed_context_stays_within_the_budget(no_tiktoken, budget):
+    chunks = docs(*[" ".join(f"Chunk {c} sentence {s} has a few words in it." for s in range(5)) for c in range(6)])
+    context, stats = pack_context(chunks, budget)
+    assert count_tokens(context) <= stats["context_tokens"] <= budget
+    assert context.startswith("[1] Chunk 0 sentence 0")
+
+def test_packing_stops_at_the_first_sentence_that_does_not_fit(no_tiktoken):
+    first = "A short opening sentence. " * 2
+    second = "Second chunk first sentence. Second chunk second sentence is much much longer than the rest."
+    context, stats = pack_context(docs(first, second, "Third chunk."), 30)
+    # Whole sentences only: the second chunk is cut after its first sentence and nothing follows it
+    assert context == "[1] A short opening sentence.\n\n[2] Second chunk first sentence."
+    assert stats["chunks_packed"] == 2 and stats["duplicate_sentences"] == 1
+
+def test_an_oversized_first_sentence_is_truncated_not_dropped(no_tiktoken):
+    context, stats = pack_context(docs("word " * 500 + "end."), 50)
+    assert context.startswith("[1] word word")
+    assert count_tokens(context) <= 50 and stats["chunks_packed"] == 1
+
+def test_sentences_repeated_by_overlapping_chunks_are_packed_once(no_tiktoken):
+    context, stats = pack_context(docs("The pump runs at night. It is loud.",
+                                       "It is loud. The boiler is new.",
+                                       "the pump runs at night"), 200)
+    assert context == "[1] The pump runs at night. It is loud.\n\n[2] The boiler is new."
+    assert stats == {"chunks_retrieved": 3, "chunks_packed": 2, "duplicate_sentences": 2, "context_tokens": stats["context_tokens"]}
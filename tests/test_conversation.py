@@ -0,0 +1,86 @@
+import types
+import ollama
+import pytest
+from langchain_core.documents import Document
+import core.conversation
+from benchmarks.fake_ollama import FakeOllamaServer
+from core.cache import text_hash
+from core.conversation import Conversation, prefill_stats
+
+MODEL = "llama3.2:latest"
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeOllamaServer(request_latency=0, token_latency=0, prefill_latency=0, load_latency=0, answer_tokens=8) as fake:
+        client = ollama.Client(host=fake.base_url)
+        requests = []
+        generate = client.generate
+
+        def recording_generate(**kwargs):
+            requests.append(kwargs)
+            return generate(**kwargs)
+
+        client.generate = recording_generate
+        fake.requests_sent = requests
+        monkeypatch.setattr(core.conversation, "get_ollama_client", lambda: client)
+        yield fake
+
+def docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+def turn(conversation, question, documents):
+    stats = {}
+    answer = "".join(conversation.stream(question, documents, stats))
+    return answer, stats
+
+def test_first_turn_sends_the_full_prompt_and_pins_its_chunks(server):
+    conversation = Conversation(MODEL, 1)
+    answer, stats = turn(conversation, "How hot is the boiler?", docs("The boiler runs at 80 degrees.", "The pump is new."))
+    assert answer and stats["rebased"] and stats["reused_tokens"] == 0
+    request = server.requests_sent[-1]
+    assert request["system"] == core.conversation.SYSTEM_PROMPT and request["context"] is None
+    assert "The boiler runs at 80 degrees." in request["prompt"] and request["prompt"].endswith("Question: How hot is the boiler?")
+    assert conversation.pinned == {text_hash("The boiler runs at 80 degrees."), text_hash("The pump is new.")}
+    assert conversation.context == server.kv_cache[MODEL]
+    assert stats["cached_tokens"] == 0 and stats["prefill_tokens"] > 0
+
+def test_follow_up_reuses_the_context_and_only_sends_new_chunks(server):
+    conversation = Conversation(MODEL, 1)
+    turn(conversation, "How hot is the boiler?", docs("The boiler runs at 80 degrees.", "The pump is new."))
+    carried = list(conversation.context)
+    _, stats = turn(conversation, "And the pump?", docs("The pump is new.", "The pump was serviced in May."))
+    request = server.requests_sent[-1]
+    assert not stats["rebased"] and stats["reused_tokens"] == len(carried)
+    assert request["context"] == carried and request["system"] is None
+    assert request["prompt"] == "Additional context:\n[1] The pump was serviced in May.\n\nQuestion: And the pump?"
+    assert stats["chunks_retrieved"] == 2 and stats["chunks_packed"] == 1
+    # The server found the carried context in its KV cache and only evaluated the new prompt
+    assert stats["prefill_tokens"] < len(carried)
+    assert stats["cached_tokens"] > 0
+
+    _, stats = turn(conversation, "Anything else?", docs("The pump was serviced in May."))
+    assert server.requests_sent[-1]["prompt"] == "Question: Anything else?"
+    assert stats["chunks_packed"] == 0
+
+def test_long_conversations_are_rebased_on_a_summary(server, monkeypatch):
+    monkeypatch.setattr(core.conversation, "HISTORY_TURNS", 1)
+    conversation = Conversation(MODEL, 1)
+    turn(conversation, "How hot is the boiler?", docs("The boiler runs at 80 degrees."))
+    turn(conversation, "And the pump?", docs("The pump is new."))
+    monkeypatch.setattr(core.conversation, "CONVERSATION_MAX_TOKENS", len(conversation.context) - 1)
+    _, stats = turn(conversation, "Who services them?", docs("Services are done by the night shift."))
+    assert stats["rebased"] and stats["reused_tokens"] == 0 and stats["cached_tokens"] == 0
+    summary_request, request = server.requests_sent[-2:]
+    # Turns that left the history window were summarized by the model, the last one is sent verbatim
+    assert "User: How hot is the boiler?" in summary_request["prompt"]
+    assert conversation.summary and conversation.summarized_turns == 1
+    assert f"Summary of the earlier conversation: {conversation.summary}" in request["prompt"]
+    assert "User: And the pump?" in request["prompt"] and "User: How hot is the boiler?" not in request["prompt"]
+    assert request["context"] is None and request["system"] == core.conversation.SYSTEM_PROMPT
+    assert conversation.pinned == {text_hash("Services are done by the night shift.")}
+
+def test_prefill_stats_split_cached_and_evaluated_tokens():
+    final = types.SimpleNamespace(prompt_eval_count=20, prompt_eval_duration=int(0.5e9), eval_count=10, context=list(range(130)))
+    assert prefill_stats(final, reused=100) == {"prefill": 0.5, "prefill_tokens": 20, "cached_tokens": 100, "prefill_saved": 2.5}
+    # A fresh context has nothing cached, whatever the counts say
+    assert prefill_stats(final, reused=0)["cached_tokens"] == 0
@@ -0,0 +1,92 @@
+from langchain_core.documents import Document
+from core.embeddings import index_documents, list_indexed_documents, remove_document
+
+def make_chunks(doc_id: str, source_hash: str, texts):
+    return [Document(page_content=text, metadata={"doc_id": doc_id, "source_hash": source_hash}) for text in texts]
+
+def test_identical_files_under_different_names_keep_their_own_chunks(numpy_store, tmp_path):
+    texts = ["alpha beta", "gamma delta", "epsilon zeta"]
+    stats = index_documents(numpy_store, make_chunks("dup1.txt", "same" * 16, texts) +
+                            make_chunks("dup2.txt", "same" * 16, texts), str(tmp_path))
+    assert stats["added"] == 2
+    assert numpy_store.stats()["live"] == 6
+
+    assert remove_document(numpy_store, "dup1.txt", str(tmp_path))
+    assert numpy_store.stats()["live"] == 3
+    assert list(list_indexed_documents(str(tmp_path))) == ["dup2.txt"]
+    ids, _, metadatas, _ = next(numpy_store.iter_records())
+    assert len(ids) == 3 and {metadata["doc_id"] for metadata in metadatas} == {"dup2.txt"}
+
+def test_entries_from_before_doc_id_prefixes_keep_their_ids():
+    from core.embeddings import entry_chunk_ids
+    assert entry_chunk_ids({"source_hash": "ab" * 32, "chunks": 2}) == ["abababababababab:0", "abababababababab:1"]
+
+def test_streamed_documents_reach_the_lexical_index_in_parts(numpy_store, tmp_path, monkeypatch):
+    import core.embeddings
+    from core.embeddings import index_stream, lexical_dir
+    from core.lexical import BM25Index, get_lexical_index
+    monkeypatch.setattr(core.embeddings, "LEXICAL_BATCH_SIZE", 4)
+    persist_directory = str(tmp_path / "workspace")
+    chunking = {"strategy": "auto"}
+
+    def stream(count, word):
+        for i in range(count):
+            if i == 0:
+                # As iter_stream_chunks does once it has tuned on the first piece
+                chunking.update({"chunk_size": 384, "chunk_overlap": 57})
+            yield Document(page_content=f"{word} chunk number{i}", metadata={})
+
+    written = index_stream(numpy_store, "big.txt", "b" * 64, "v1", stream(10, "first"), persist_directory,
+                           chunking=chunking)
+    assert written == 10
+    assert list_indexed_documents(persist_directory)["big.txt"]["chunking"] == \
+        {"strategy": "auto", "chunk_size": 384, "chunk_overlap": 57}
+    lexical = get_lexical_index(lexical_dir(persist_directory))
+    assert lexical.search("number9", k=1)[0][0].metadata["doc_id"] == "big.txt"
+    # Three parts of at most four chunks, loaded back as one document
+    assert len(BM25Index(lexical_dir(persist_directory)).documents["big.txt"]["chunk_ids"]) == 10
+
+    index_stream(numpy_store, "big.txt", "c" * 64, "v2", stream(3, "second"), persist_directory)
+    reloaded = BM25Index(lexical_dir(persist_directory))
+    assert len(reloaded.documents["big.txt"]["chunk_ids"]) == 3
+    assert reloaded.search("first", k=1) == []
+
+def test_reindexing_only_writes_changed_documents(numpy_store, tmp_path):
+    embeddings = numpy_store.embeddings
+    stats = index_documents(numpy_store, make_chunks("a.txt", "a" * 64, ["one", "two", "three"]) +
+                            make_chunks("b.txt", "b" * 64, ["four", "five"]), str(tmp_path))
+    assert stats == {"added": 2, "updated": 0, "unchanged": 0, "removed_chunks": 0}
+    calls = embeddings.calls
+    version = list_indexed_documents(str(tmp_path))
+
+    # Same chunks again: nothing is embedded or written
+    stats = index_documents(numpy_store, make_chunks("a.txt", "a" * 64, ["one", "two", "three"]) +
+                            make_chunks("b.txt", "b" * 64, ["four", "five"]), str(tmp_path))
+    assert stats == {"added": 0, "updated": 0, "unchanged": 2, "removed_chunks": 0}
+    assert embeddings.calls == calls
+    assert list_indexed_documents(str(tmp_path)) == version
+
+    # A shorter new version of a.txt replaces its chunks and leaves b.txt alone
+    stats = index_documents(numpy_store, make_chunks("a.txt", "c" * 64, ["one", "two updated"]) +
+                            make_chunks("b.txt", "b" * 64, ["four", "five"]), str(tmp_path))
+    assert stats == {"added": 0, "updated": 1, "unchanged": 1, "removed_chunks": 3}
+    assert numpy_store.stats()["live"] == 4
+    indexed = list_indexed_documents(str(tmp_path))
+    assert indexed["a.txt"]["chunks"] == 2 and indexed["b.txt"] == version["b.txt"]
+
+def test_rechunking_the_same_file_drops_the_extra_chunks(numpy_store, tmp_path):
+    index_documents(numpy_store, make_chunks("a.txt", "a" * 64, ["one", "two", "three"]), str(tmp_path))
+    stats = index_documents(numpy_store, make_chunks("a.txt", "a" * 64, ["one two", "three"]), str(tmp_path))
+    assert stats["updated"] == 1 and stats["removed_chunks"] == 1
+    assert numpy_store.stats()["live"] == 2
+
+def test_get_vector_store_records_the_chunking_it_was_given(numpy_store, tmp_path, monkeypatch):
+    import core.embeddings
+    from core.embeddings import get_vector_store
+    monkeypatch.setattr(core.embeddings, "open_vector_store", lambda persist_directory: numpy_store)
+    persist_directory = str(tmp_path / "workspace")
+    chunking = {"a.txt": {"strategy": "token", "chunk_size": 256, "chunk_overlap": 32}}
+    assert get_vector_store(make_chunks("a.txt", "a" * 64, ["one", "two"]) + make_chunks("b.txt", "b" * 64, ["three"]),
+                            persist_directory=persist_directory, chunking=chunking) is numpy_store
+    indexed = list_indexed_documents(persist_directory)
+    assert indexed["a.txt"]["chunking"] == chunking["a.txt"] and indexed["b.txt"]["chunking"] is None
@@ -0,0 +1,88 @@
+import resource
+import socket
+import sys
+import urllib.request
+import pytest
+import utils.helpers
+from utils.helpers import (
+    LATENCY_BUCKETS,
+    LatencyHistogram,
+    MetricsRegistry,
+    get_rss_mb,
+    span,
+    start_metrics_server,
+    trace
+)
+
+@pytest.mark.parametrize("platform, maxrss", [("darwin", 512 * 1024 * 1024), ("linux", 512 * 1024)])
+def test_rss_fallback_reports_megabytes(monkeypatch, platform, maxrss):
+    def no_proc(*args, **kwargs):
+        raise OSError("no /proc")
+
+    monkeypatch.setattr(utils.helpers, "open", no_proc, raising=False)
+    monkeypatch.setattr(sys, "platform", platform)
+    monkeypatch.setattr(resource, "getrusage", lambda who: type("Usage", (), {"ru_maxrss": maxrss})())
+    assert get_rss_mb() == 512
+
+def test_histogram_quantiles_and_buckets():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.observe(ms / 1000)
+    assert histogram.quantile(0.5) == pytest.approx(0.051)
+    assert histogram.quantile(0.95) == pytest.approx(0.095)
+    assert histogram.count == 100 and histogram.sum == pytest.approx(5.05)
+    # Buckets are cumulative
+    assert dict(zip(LATENCY_BUCKETS, histogram.buckets))[0.01] == 10
+    assert dict(zip(LATENCY_BUCKETS, histogram.buckets))[0.1] == 100
+    assert LatencyHistogram().quantile(0.95) == 0.0
+
+def test_registry_snapshot_and_prometheus_text():
+    registry = MetricsRegistry()
+    registry.observe("chatdoc_stage_seconds", 0.02, pipeline="qa", stage="retrieval")
+    registry.observe("chatdoc_stage_seconds", 0.2, pipeline="qa", stage="retrieval")
+    registry.observe("chatdoc_request_seconds", 1.5, pipeline="qa")
+    assert registry.snapshot() == [
+        {"metric": "chatdoc_request_seconds", "pipeline": "qa", "count": 1, "mean_ms": 1500.0, "p50_ms": 1500.0, "p95_ms": 1500.0},
+        {"metric": "chatdoc_stage_seconds", "pipeline": "qa", "stage": "retrieval", "count": 2, "mean_ms": 110.0, "p50_ms": 20.0, "p95_ms": 200.0}
+    ]
+    lines = registry.prometheus_text().splitlines()
+    assert lines[0] == "# TYPE chatdoc_request_seconds histogram"
+    assert 'chatdoc_request_seconds_bucket{pipeline="qa",le="1.0"} 0' in lines
+    assert 'chatdoc_request_seconds_bucket{pipeline="qa",le="2.5"} 1' in lines
+    assert "# TYPE chatdoc_stage_seconds histogram" in lines
+    assert 'chatdoc_stage_seconds_bucket{pipeline="qa",stage="retrieval",le="0.025"} 1' in lines
+    assert 'chatdoc_stage_seconds_bucket{pipeline="qa",stage="retrieval",le="+Inf"} 2' in lines
+    assert 'chatdoc_stage_seconds_sum{pipeline="qa",stage="retrieval"} 0.220000' in lines
+    assert 'chatdoc_stage_seconds_count{pipeline="qa",stage="retrieval"} 2' in lines
+    # Every series has its buckets, +Inf, sum and count under one TYPE line per metric
+    assert len(lines) == 2 + 2 * (len(LATENCY_BUCKETS) + 3)
+
+def test_spans_land_in_the_current_trace(monkeypatch):
+    registry = MetricsRegistry()
+    monkeypatch.setattr(utils.helpers, "_metrics", registry)
+    with trace("qa", question_id=1) as current:
+        with span("retrieval"):
+            pass
+        with span("retrieval"):
+            pass
+    with span("load"):
+        pass
+    assert list(current.spans) == ["retrieval"]
+    series = {(row["metric"], row.get("pipeline"), row.get("stage")): row["count"] for row in registry.snapshot()}
+    assert series == {("chatdoc_stage_seconds", "qa", "retrieval"): 2,
+                      ("chatdoc_request_seconds", "qa", None): 1,
+                      ("chatdoc_stage_seconds", "untraced", "load"): 1}
+
+def test_metrics_server_listens_on_loopback_by_default(monkeypatch):
+    monkeypatch.setattr(utils.helpers, "_metrics_server", None)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = start_metrics_server(port)
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+    finally:
+        server.shutdown()
+        server.server_close()
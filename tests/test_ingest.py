@@ -0,0 +1,28 @@
+import os
+import pytest
+from core.ingest import find_ingestible_documents, within_ingest_root
+
+@pytest.fixture
+def ingest_root(tmp_path):
+    root = tmp_path / "docs"
+    (root / "team").mkdir(parents=True)
+    (root / "team" / "notes.txt").write_text("inside")
+    outside = tmp_path / "secret"
+    outside.mkdir()
+    (outside / "passwords.txt").write_text("outside")
+    os.symlink(outside / "passwords.txt", root / "team" / "link.txt")
+    return str(root)
+
+def test_folder_below_root_is_ingested_without_escaping_symlinks(ingest_root):
+    files = find_ingestible_documents("team", ingest_root)
+    assert [os.path.basename(path) for path in files] == ["notes.txt"]
+
+@pytest.mark.parametrize("folder", ["..", "../secret", "/etc", "team/../../secret"])
+def test_folder_outside_root_is_refused(ingest_root, folder):
+    with pytest.raises(ValueError):
+        find_ingestible_documents(folder, ingest_root)
+
+def test_folder_ingestion_disabled_without_root():
+    assert not within_ingest_root("/etc", "")
+    with pytest.raises(ValueError):
+        find_ingestible_documents("docs", "")
@@ -0,0 +1,73 @@
+from langchain_core.documents import Document
+from core.jobs import IngestionJob
+
+def test_chunking_records_autotuned_params_per_document():
+    files = [("/tmp/a.txt", {"doc_id": "a.txt", "source_hash": "1"}), ("/tmp/b.txt", {"doc_id": "b.txt", "source_hash": "2"})]
+    documents = [Document(page_content="summary", metadata={"doc_id": "table.csv"})]
+    job = IngestionJob("key", files, documents, "auto", {"chunk_size": 256, "chunk_overlap": 32})
+    timings = {"autotuned": {"a.txt": {"chunk_size": 512, "chunk_overlap": 0}}}
+    assert job.chunking(timings) == {
+        "a.txt": {"strategy": "auto", "chunk_size": 512, "chunk_overlap": 0},
+        "b.txt": {"strategy": "auto", "chunk_size": 256, "chunk_overlap": 32},
+        "table.csv": {"strategy": "structured"}
+    }
+
+def stream_version(word, count):
+    for i in range(count):
+        yield Document(page_content=f"{word} part{i}", metadata={})
+
+def stream_past_quota(numpy_store, job, persist_directory, source_hash, word):
+    from core.embeddings import index_stream
+    from core.workspaces import quota_guard
+    metadata = {"doc_id": "big.txt", "source_hash": source_hash}
+    guard = {"chunks": 0, "exceeded": False}
+    try:
+        index_stream(numpy_store, "big.txt", source_hash, f"{word}-signature",
+                     quota_guard(stream_version(word, 10), 5, guard), persist_directory)
+    except RuntimeError:
+        assert guard["exceeded"]
+        job._drop_partial_stream(numpy_store, metadata, guard["chunks"])
+    else:
+        raise AssertionError("quota was not hit")
+
+def test_new_version_over_quota_keeps_the_old_one(numpy_store, tmp_path, monkeypatch):
+    import core.embeddings
+    from core.embeddings import index_stream, lexical_dir, list_indexed_documents
+    from core.lexical import BM25Index, get_lexical_index
+    monkeypatch.setattr(core.embeddings, "LEXICAL_BATCH_SIZE", 2)
+    persist_directory = str(tmp_path / "workspace")
+    job = IngestionJob("key", [], [], "recursive", {}, persist_directory=persist_directory)
+
+    index_stream(numpy_store, "big.txt", "1" * 64, "v1-signature", stream_version("original", 4), persist_directory)
+    stream_past_quota(numpy_store, job, persist_directory, "2" * 64, "replacement")
+
+    entry = list_indexed_documents(persist_directory)["big.txt"]
+    assert entry["signature"] == "v1-signature" and entry["chunks"] == 4
+    assert numpy_store.stats()["live"] == 4
+    assert {doc.page_content for doc in numpy_store.similarity_search("original part2", k=4)} == \
+        {f"original part{i}" for i in range(4)}
+    for lexical in (get_lexical_index(lexical_dir(persist_directory)), BM25Index(lexical_dir(persist_directory))):
+        assert lexical.search("original part3", k=1)[0][0].page_content == "original part3"
+        assert lexical.search("replacement", k=1) == []
+        assert list(lexical.documents) == ["big.txt"]
+
+def test_new_version_completes_over_the_old_one(numpy_store, tmp_path):
+    from core.embeddings import index_stream, lexical_dir
+    from core.lexical import BM25Index
+    persist_directory = str(tmp_path / "workspace")
+    index_stream(numpy_store, "big.txt", "1" * 64, "v1-signature", stream_version("original", 4), persist_directory)
+    index_stream(numpy_store, "big.txt", "2" * 64, "v2-signature", stream_version("replacement", 3), persist_directory)
+    assert numpy_store.stats()["live"] == 3
+    lexical = BM25Index(lexical_dir(persist_directory))
+    assert lexical.search("original", k=1) == []
+    assert len(lexical.documents["big.txt"]["chunk_ids"]) == 3
+
+def test_rechunked_source_over_quota_is_removed(numpy_store, tmp_path):
+    from core.embeddings import index_stream, list_indexed_documents
+    persist_directory = str(tmp_path / "workspace")
+    job = IngestionJob("key", [], [], "recursive", {}, persist_directory=persist_directory)
+    index_stream(numpy_store, "big.txt", "1" * 64, "v1-signature", stream_version("original", 4), persist_directory)
+    # Same source, so its first chunks were overwritten and the old version can't be kept
+    stream_past_quota(numpy_store, job, persist_directory, "1" * 64, "rechunked")
+    assert "big.txt" not in list_indexed_documents(persist_directory)
+    assert numpy_store.stats()["live"] == 0
@@ -0,0 +1,93 @@
+import threading
+import time
+import types
+import pytest
+import core.models
+from core.models import ModelManager
+from core.scheduler import RequestScheduler
+
+class FakeClient:
+    """Counts list calls and records the models it was asked to load"""
+
+    def __init__(self):
+        self.lists = 0
+        self.fail = False
+        self.loads = []
+        self.loaded = threading.Event()
+
+    def list(self):
+        if self.fail:
+            raise ConnectionError("ollama is down")
+        self.lists += 1
+        return {"models": [f"model-{self.lists}"]}
+
+    def generate(self, model, prompt, keep_alive):
+        self.loads.append(model)
+        self.loaded.set()
+        return types.SimpleNamespace(load_duration=int(1.5e9))
+
+@pytest.fixture
+def client(monkeypatch):
+    fake = FakeClient()
+    monkeypatch.setattr(core.models, "get_ollama_client", lambda: fake)
+    return fake
+
+def test_model_list_is_cached_for_its_ttl(client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(core.models.time, "time", lambda: now[0])
+    manager = ModelManager()
+    first = manager.list_models()
+    assert manager.list_models() is first and client.lists == 1
+    now[0] += core.models.MODEL_LIST_TTL + 1
+    assert manager.list_models() == {"models": ["model-2"]}
+    # Expired but unreachable, the last known list is served
+    now[0] += core.models.MODEL_LIST_TTL + 1
+    client.fail = True
+    assert manager.list_models() == {"models": ["model-2"]}
+    with pytest.raises(ConnectionError):
+        ModelManager().list_models()
+
+def test_warm_up_waits_for_a_scheduler_slot(client, monkeypatch):
+    scheduler = RequestScheduler(llm_concurrency=1)
+    monkeypatch.setattr(core.models, "get_scheduler", lambda: scheduler)
+    manager = ModelManager()
+    with scheduler.slot("chat-model", session="busy-user", timeout=1):
+        manager.ensure_warm("chat-model")
+        manager.ensure_warm("chat-model")
+        # Queued behind the running request, not sent to Ollama next to it
+        assert not client.loaded.wait(0.2)
+        assert manager.state("chat-model").status == "loading"
+        assert scheduler.metrics()["chat-model"]["queued"] == 1
+    assert client.loaded.wait(2)
+    deadline = time.time() + 2
+    while manager.state("chat-model").status != "warm" and time.time() < deadline:
+        time.sleep(0.01)
+    # Loading already, so the second call didn't queue another warm-up
+    assert client.loads == ["chat-model"]
+    assert manager.is_warm("chat-model") and manager.state("chat-model").load_seconds == 1.5
+    manager.ensure_warm("chat-model")
+    time.sleep(0.05)
+    assert client.loads == ["chat-model"]
+
+def test_record_request_splits_cold_and_warm_first_tokens():
+    manager = ModelManager()
+    assert not manager.is_warm("chat-model")
+    manager.record_request("chat-model", was_warm=False, first_token=4.0)
+    manager.record_request("chat-model", was_warm=True, first_token=0.2)
+    manager.record_request("chat-model", was_warm=True, first_token=0.4)
+    manager.record_request("chat-model", was_warm=True)
+    stats = manager.stats()["chat-model"]
+    assert stats["status"] == "warm" and stats["requests"] == 3
+    assert stats["cold_first_token_avg"] == 4.0
+    assert stats["warm_first_token_avg"] == pytest.approx(0.3)
+    for _ in range(150):
+        manager.record_request("chat-model", was_warm=True, first_token=0.1)
+    assert len(manager.state("chat-model").warm) == 100
+
+def test_model_goes_cold_after_keep_alive(monkeypatch):
+    monkeypatch.setattr(core.models, "KEEP_ALIVE", 300)
+    manager = ModelManager()
+    manager.record_request("chat-model", was_warm=False)
+    assert manager.is_warm("chat-model")
+    manager.state("chat-model").last_used -= 301
+    assert not manager.is_warm("chat-model") and manager.stats()["chat-model"]["status"] == "cold"
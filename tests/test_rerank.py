@@ -0,0 +1,51 @@
+import time
+from langchain_core.documents import Document
+from core.rerank import DUPLICATE_THRESHOLD, LexicalOverlapScorer, Reranker, _similarity, _token_set, mmr_select
+
+def docs(*texts):
+    return [Document(page_content=text) for text in texts]
+
+class FixedScorer:
+    """Scores by lookup, optionally slow, counting what it was asked to score"""
+
+    def __init__(self, scores, batch_size=2, delay=0.0):
+        self.scores = scores
+        self.batch_size = batch_size
+        self.delay = delay
+        self.scored = []
+
+    def score(self, query, texts):
+        time.sleep(self.delay)
+        self.scored.extend(texts)
+        return [self.scores[text] for text in texts]
+
+def test_mmr_trades_relevance_for_diversity():
+    candidates = docs("pump maintenance schedule", "pump maintenance on fridays", "boiler safety valve inspection")
+    # Without diversity the overlapping chunk comes second, with it the different one does
+    assert mmr_select(candidates, [1.0, 0.6, 0.5], k=2, mmr_lambda=1.0)[1] is candidates[1]
+    assert mmr_select(candidates, [1.0, 0.6, 0.5], k=2, mmr_lambda=0.5)[1] is candidates[2]
+
+def test_near_duplicates_are_dropped_even_when_k_is_not_filled():
+    original = "the pump is serviced every monday by the night shift crew"
+    overlapping = "the pump is serviced every monday by the night shift crew team"
+    assert _similarity(_token_set(docs(original)[0]), _token_set(docs(overlapping)[0])) >= DUPLICATE_THRESHOLD
+    selected = mmr_select(docs(original, overlapping), [1.0, 0.9], k=2, mmr_lambda=1.0)
+    assert [doc.page_content for doc in selected] == [original]
+
+def test_reranker_orders_by_scorer():
+    candidates = docs("low", "high", "middle")
+    scorer = FixedScorer({"low": 0.1, "high": 0.9, "middle": 0.5})
+    reranked = Reranker(scorer, budget_ms=10000, mmr_lambda=1.0).rerank("question", candidates, k=3)
+    assert [doc.page_content for doc in reranked] == ["high", "middle", "low"]
+
+def test_budget_keeps_unscored_candidates_in_first_stage_order_below_scored_ones():
+    candidates = docs("a", "b", "c", "d", "e", "f")
+    scorer = FixedScorer({text: score for text, score in zip("abcdef", (0.2, 0.9, 5, 5, 5, 5))}, delay=0.05)
+    reranked = Reranker(scorer, budget_ms=1, mmr_lambda=1.0).rerank("question", candidates, k=4)
+    # Only the first batch fit in the budget
+    assert scorer.scored == ["a", "b"]
+    assert [doc.page_content for doc in reranked] == ["b", "a", "c", "d"]
+
+def test_lexical_overlap_scorer_rewards_terms_and_phrases():
+    scores = LexicalOverlapScorer().score("pump pressure", ["pump pressure is 2 bar", "pressure of the pump", "boiler"])
+    assert scores[0] > scores[1] > scores[2] == 0.0
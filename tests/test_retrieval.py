@@ -0,0 +1,102 @@
+import os
+from langchain_core.documents import Document
+from core.lexical import BM25Index, drop_lexical_index, get_lexical_index, tokenize
+from core.retrieval import HybridRetriever, reciprocal_rank_fusion
+
+def docs(*texts):
+    return [Document(page_content=text, metadata={"doc_id": "manual.txt"}) for text in texts]
+
+def test_tokenize_keeps_ids_whole():
+    assert tokenize("Valve A-12 opens at 3.5 bar.") == ["valve", "a-12", "opens", "at", "3.5", "bar"]
+
+def test_bm25_ranks_rare_terms_and_short_chunks_first(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add_document("manual.txt", "v1", ["c0", "c1", "c2", "c3"], docs(
+        "the pump and the valve",
+        "the pump pump pump",
+        "the pump, the valve, the filter and the long tail of many other words in this chunk",
+        "nothing relevant here at all"
+    ))
+    assert [doc.id for doc, _ in index.search("pump")][:2] == ["c1", "c0"]
+    # 'filter' appears once, so it outweighs the common 'pump'
+    assert index.search("filter pump", k=1)[0][0].id == "c2"
+    assert index.search("absent", k=3) == []
+
+def test_shards_reload_and_replace_per_document(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add_document("a.txt", "v1", ["a0"], docs("boiler pressure"))
+    index.add_document("b.txt", "v1", ["b0"], docs("pump schedule"))
+    index.add_document("a.txt", "v2", ["a1"], docs("boiler temperature"))
+    reloaded = BM25Index(str(tmp_path))
+    assert reloaded.has_document("a.txt", "v2") and not reloaded.has_document("a.txt", "v1")
+    assert [doc.id for doc, _ in reloaded.search("boiler")] == ["a1"]
+    assert reloaded.search("pressure") == []
+    assert reloaded.total_length == index.total_length
+
+    reloaded.remove_document("b.txt")
+    assert BM25Index(str(tmp_path)).search("pump") == []
+
+def test_appended_parts_load_as_one_document(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.append_chunks("big.txt", "v1", ["p0", "p1"], docs("first part", "second part"))
+    index.append_chunks("big.txt", "v1", ["p2"], docs("third part"))
+    assert len([name for name in os.listdir(tmp_path) if ".part" in name]) == 2
+    reloaded = BM25Index(str(tmp_path))
+    assert reloaded.documents["big.txt"]["chunk_ids"] == ["p0", "p1", "p2"]
+    assert reloaded.search("third", k=1)[0][0].id == "p2"
+    reloaded.remove_document("big.txt")
+    assert os.listdir(tmp_path) == []
+
+def test_dropped_index_is_reloaded_from_its_shards(tmp_path):
+    directory = str(tmp_path / "lexical")
+    index = get_lexical_index(directory)
+    assert get_lexical_index(directory) is index
+    index.add_document("a.txt", "v1", ["a0"], docs("boiler pressure"))
+    drop_lexical_index(directory)
+    reloaded = get_lexical_index(directory)
+    assert reloaded is not index
+    assert reloaded.search("boiler", k=1)[0][0].id == "a0"
+
+def test_rrf_favours_chunks_both_lists_agree_on():
+    a, b, c, d = docs("alpha", "bravo", "charlie", "delta")
+    fused = reciprocal_rank_fusion([[a, b, c], [c, d, b]])
+    # b and c are in both lists, c ranks higher on average; duplicates are merged by text
+    assert [doc.page_content for doc in fused] == ["charlie", "bravo", "alpha", "delta"]
+
+class FakeStore:
+    def __init__(self, results):
+        self.results = results
+
+    def similarity_search(self, query, k=4):
+        return self.results[:k]
+
+class CountingIndex:
+    def __init__(self, results):
+        self.results = results
+        self.searches = 0
+
+    def search(self, query, k=10):
+        self.searches += 1
+        return [(doc, 1.0) for doc in self.results[:k]]
+
+def test_vector_mode_skips_the_lexical_index():
+    vector, lexical = docs("vector hit"), CountingIndex(docs("lexical hit"))
+    retriever = HybridRetriever(vector_store=FakeStore(vector), lexical_index=lexical, mode="vector", k=2)
+    assert [doc.page_content for doc in retriever.invoke("question")] == ["vector hit"]
+    assert lexical.searches == 0
+
+def test_vector_mode_falls_back_to_bm25_when_the_vector_search_fails():
+    class BrokenStore:
+        def similarity_search(self, query, k=4):
+            raise RuntimeError("embedder down")
+
+    lexical = CountingIndex(docs("lexical hit"))
+    retriever = HybridRetriever(vector_store=BrokenStore(), lexical_index=lexical, mode="vector")
+    assert [doc.page_content for doc in retriever.invoke("question")] == ["lexical hit"]
+    assert lexical.searches == 1
+
+def test_hybrid_mode_fuses_both_legs():
+    shared, vector_only, lexical_only = docs("shared", "vector only", "lexical only")
+    retriever = HybridRetriever(vector_store=FakeStore([vector_only, shared]),
+                                lexical_index=CountingIndex([shared, lexical_only]), k=3)
+    assert [doc.page_content for doc in retriever.invoke("question")] == ["shared", "vector only", "lexical only"]
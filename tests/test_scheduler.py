@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import core.scheduler
+from core.scheduler import RequestScheduler, current_queue_timeout, current_session_id, request_context
+
+def test_stalled_stream_times_out_and_frees_the_slot():
+    scheduler = RequestScheduler()
+    released = threading.Event()
+
+    def stalled():
+        # Never sends a token, like an Ollama stream that hangs
+        released.wait(5)
+        yield "late"
+
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        list(scheduler.stream("chat-model", stalled, timeout=0.2))
+    assert time.perf_counter() - started < 2
+    released.set()
+    assert scheduler.metrics()["chat-model"]["timeouts"] == 1
+    # The slot went back, so the next stream runs
+    assert list(scheduler.stream("chat-model", lambda: iter(["a", "b"]), timeout=1)) == ["a", "b"]
+
+def test_stream_errors_reach_the_caller():
+    scheduler = RequestScheduler()
+
+    def failing():
+        yield "a"
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        list(scheduler.stream("chat-model", failing, timeout=1))
+
+def test_request_context_sets_session_and_queue_timeout():
+    assert current_session_id() == "background"
+    assert current_queue_timeout() is not None
+    with request_context("ingest:abc"):
+        assert current_session_id() == "ingest:abc"
+        assert current_queue_timeout() is None
+    assert current_session_id() == "background"
+
+def test_concurrency_is_set_per_scheduler():
+    scheduler = RequestScheduler(llm_concurrency=3, embed_concurrency=2)
+    with scheduler.slot("chat-model", timeout=1):
+        pass
+    with scheduler.slot("embed-model", timeout=1):
+        pass
+    metrics = scheduler.metrics()
+    assert metrics["chat-model"]["limit"] == 3
+    assert metrics["embed-model"]["limit"] == 2
+
+def test_embed_batches_take_turns_across_sessions(monkeypatch):
+    monkeypatch.setattr(core.scheduler, "EMBED_BATCH_MAX", 4)
+    scheduler = RequestScheduler(embed_concurrency=1)
+    batches = []
+
+    def embed(texts):
+        batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def query(session, text):
+        with request_context(session):
+            return scheduler.embed("embed-model", embed, text, timeout=5)
+
+    with ThreadPoolExecutor(max_workers=9) as pool:
+        with scheduler.slot("embed-model", session="busy", timeout=1):
+            backlog = [pool.submit(query, "ingest:a", f"a{i}") for i in range(8)]
+            time.sleep(0.2)
+            late = pool.submit(query, "user-b", "b-question")
+            time.sleep(0.2)
+            # Batches wait for the slot under the session whose texts they carry
+            assert list(scheduler.queues["embed-model"].sessions) == ["ingest:a"]
+        assert late.result(timeout=5) == [10.0]
+        assert [future.result(timeout=5) for future in backlog] == [[2.0]] * 8
+    # The late session's query rides in the first batch instead of behind the whole backlog
+    assert len(batches[0]) == 4 and batches[0][1] == "b-question"
+    assert sorted(text for batch in batches for text in batch) == sorted([f"a{i}" for i in range(8)] + ["b-question"])
+    assert all(len(batch) <= 4 for batch in batches)
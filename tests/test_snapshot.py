@@ -0,0 +1,93 @@
+import os
+import pytest
+from langchain_core.documents import Document
+import core.snapshot
+from conftest import HashEmbeddings
+from core.embeddings import index_documents, index_lexical
+from core.lexical import BM25Index
+from core.snapshot import (
+    CURRENT_FILE,
+    current_snapshot,
+    current_store_dir,
+    export_snapshot,
+    list_snapshots,
+    prune_snapshots,
+    publish_snapshot
+)
+from core.vectorstore import NumpyVectorStore
+
+@pytest.fixture
+def indexed(numpy_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(core.snapshot, "_served", None)
+    persist_directory = str(tmp_path / "workspace")
+    chunks = [Document(page_content=text, metadata={"doc_id": "notes.txt", "source_hash": "n" * 64})
+              for text in ("the boiler pressure is 2 bar", "the pump runs at night", "invoices go to finance")]
+    index_lexical(chunks, persist_directory)
+    index_documents(numpy_store, chunks, persist_directory)
+    return numpy_store, persist_directory, str(tmp_path / "snapshots")
+
+def export(indexed, name, publish=True):
+    store, persist_directory, root = indexed
+    return export_snapshot(store, persist_directory, root, name=name, publish=publish)
+
+def test_export_publish_open_round_trip(indexed):
+    store, _, root = indexed
+    info = export(indexed, "first")
+    assert info["chunks"] == 3 and set(info["documents"]) == {"notes.txt"}
+    assert current_snapshot(root) == info["path"]
+    assert current_store_dir(root) == os.path.join(info["path"], "vectors")
+    # Built under a hidden name and renamed, nothing else is left in the root
+    assert sorted(os.listdir(root)) == [CURRENT_FILE, "first"]
+
+    vector = store.embeddings.embed_query("the pump runs at night")
+    snapshot = NumpyVectorStore(current_store_dir(root), HashEmbeddings())
+    assert snapshot.read_only
+    assert snapshot.similarity_search_by_vector(vector, k=1)[0].page_content == "the pump runs at night"
+    lexical = BM25Index(os.path.join(info["path"], "lexical"))
+    assert lexical.search("boiler", k=1)[0][0].page_content == "the boiler pressure is 2 bar"
+    with pytest.raises(RuntimeError):
+        snapshot.delete(ids=["anything"])
+    snapshot.close()
+
+def test_opening_a_snapshot_leaves_its_files_alone(indexed):
+    info = export(indexed, "first")
+    stray = os.path.join(info["path"], "vectors", "vectors.7.bin")
+    open(stray, "wb").close()
+    NumpyVectorStore(os.path.join(info["path"], "vectors"), HashEmbeddings()).close()
+    assert os.path.exists(stray)
+
+def test_publish_swaps_current_and_rejects_unknown_snapshots(indexed):
+    _, _, root = indexed
+    first = export(indexed, "first")
+    second = export(indexed, "second", publish=False)
+    assert current_snapshot(root) == first["path"]
+    publish_snapshot("second", root)
+    assert current_snapshot(root) == second["path"]
+    with pytest.raises(FileNotFoundError):
+        publish_snapshot("missing", root)
+    assert current_snapshot(root) == second["path"]
+    assert not [name for name in os.listdir(root) if name.endswith(".tmp")]
+
+def test_prune_keeps_the_current_and_the_served_snapshot(indexed):
+    _, _, root = indexed
+    for name in ("one", "two", "three", "four"):
+        export(indexed, name, publish=False)
+    publish_snapshot("one", root)
+    current_store_dir(root)  # this process now serves "one"
+    publish_snapshot("two", root)
+    removed = prune_snapshots(root, keep=1)
+    assert sorted(os.path.basename(path) for path in removed) == ["three"]
+    assert [info["name"] for info in list_snapshots(root)] == ["one", "two", "four"]
+
+def test_current_store_dir_falls_back_without_current(indexed):
+    _, _, root = indexed
+    with pytest.raises(FileNotFoundError):
+        current_store_dir(root)
+    export(indexed, "first")
+    export(indexed, "second", publish=False)
+    served = current_store_dir(root)
+    os.remove(os.path.join(root, CURRENT_FILE))
+    # Keeps serving what it served rather than jumping to an unpublished snapshot
+    assert current_store_dir(root) == served
+    core.snapshot._served = None
+    assert current_store_dir(root) == os.path.join(root, "second", "vectors")
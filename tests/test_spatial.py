@@ -0,0 +1,39 @@
+import os
+import geopandas as gpd
+import pytest
+from conftest import SAMPLE_DOCS
+from core.spatial import SpatialLayer, answer_spatial_question, nearest_features
+
+@pytest.fixture(scope="module")
+def districts():
+    return SpatialLayer(gpd.read_file(os.path.join(SAMPLE_DOCS, "MunichDis.geojson")))
+
+@pytest.mark.parametrize("question", [
+    "Which district has the largest population?",
+    "What is the smallest population density?",
+    "Who is the biggest employer near Schwabing?",
+    "Who is the biggest employer near Maxvorstadt?",
+    "Which district has the largest Nr?",
+])
+def test_non_area_questions_fall_back_to_rag(districts, question):
+    assert answer_spatial_question(districts, question) is None
+
+def test_area_ranking_needs_an_area_term(districts):
+    answer = answer_spatial_question(districts, "Which district has the largest area?")
+    assert answer.startswith("Largest features by area")
+    assert answer.splitlines()[2].startswith("- Aubing-Lochhausen-Langwied")
+
+def test_near_uses_centroid_distance(districts):
+    target = districts.find_feature("Maxvorstadt")
+    nearest = nearest_features(districts, target, 5)
+    distances = [distance for _, distance in nearest]
+    assert all(distance > 0 for distance in distances)
+    assert distances == sorted(distances)
+    # Same result as a brute-force scan over every centroid
+    brute = districts.centroids.drop(index=target).distance(districts.centroids.iloc[target]).sort_values().head(5)
+    assert [i for i, _ in nearest] == brute.index.tolist()
+
+def test_border_lists_touching_districts(districts):
+    answer = answer_spatial_question(districts, "Which districts border Maxvorstadt?")
+    assert answer.startswith("Features bordering Maxvorstadt")
+    assert "Schwabing-West" in answer
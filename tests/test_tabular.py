@@ -0,0 +1,39 @@
+import os
+import pandas as pd
+import pytest
+from conftest import SAMPLE_DOCS
+from core.tabular import answer_tabular_question
+
+@pytest.fixture(scope="module")
+def astronauts():
+    return pd.read_csv(os.path.join(SAMPLE_DOCS, "sample.csv"))
+
+@pytest.mark.parametrize("question", [
+    "How many astronauts from Japan?",
+    "How many flights did Akihiko Hoshide make?",
+    "how many columns",
+])
+def test_unparsed_constraints_fall_back_to_rag(astronauts, question):
+    assert answer_tabular_question(astronauts, question) is None
+
+def test_aggregation_word_inside_column_name_is_not_the_aggregation(astronauts):
+    answer = answer_tabular_question(astronauts, "Who has the most total flights?")
+    assert answer.startswith("The max of `Total Flights` is **7**")
+    assert "Franklin Chang-Diaz" in answer
+
+def test_row_count(astronauts):
+    assert answer_tabular_question(astronauts, "How many rows?") == f"There are **{len(astronauts):,}** rows."
+
+def test_filtered_count(astronauts):
+    japan = (astronauts["Country"] == "Japan").sum()
+    answer = answer_tabular_question(astronauts, "How many rows where Country is Japan?")
+    assert answer.startswith(f"There are **{japan}** rows where `Country` == japan")
+
+def test_mean_and_group_by(astronauts):
+    assert answer_tabular_question(astronauts, "What is the average Total Flights?") == \
+        f"The mean of `Total Flights` is **{astronauts['Total Flights'].mean():,.4g}**."
+    answer = answer_tabular_question(astronauts, "How many rows per Gender?")
+    assert answer.startswith("Rows per `Gender`")
+
+def test_no_aggregation_is_not_intercepted(astronauts):
+    assert answer_tabular_question(astronauts, "Tell me about Akihiko Hoshide") is None
@@ -0,0 +1,16 @@
+import io
+from components.upload import stage_upload
+
+class FakeUpload(io.BytesIO):
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+
+def test_same_named_uploads_are_staged_separately(tmp_path):
+    first_path, first_hash = stage_upload(FakeUpload("report.txt", b"first"), str(tmp_path))
+    second_path, second_hash = stage_upload(FakeUpload("report.txt", b"second"), str(tmp_path))
+    assert first_path != second_path
+    assert first_hash != second_hash
+    with open(first_path, "rb") as f:
+        assert f.read() == b"first"
+    assert first_path.endswith("report.txt") and second_path.endswith("report.txt")
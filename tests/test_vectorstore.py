@@ -0,0 +1,101 @@
+import numpy as np
+import core.vectorstore
+from conftest import HashEmbeddings
+from core.vectorstore import NumpyVectorStore, normalize
+
+def random_vectors(count, dim=32, seed=0):
+    return normalize(np.random.default_rng(seed).standard_normal((count, dim))).tolist()
+
+def fill(store, count, prefix="c", seed=0):
+    vectors = random_vectors(count, seed=seed)
+    ids = [f"{prefix}{i}" for i in range(count)]
+    store.upsert(ids, vectors, [{"n": i} for i in range(count)], [f"text {prefix}{i}" for i in range(count)])
+    return ids, vectors
+
+def test_upsert_then_search_finds_each_vector(numpy_store):
+    ids, vectors = fill(numpy_store, 50)
+    for chunk_id, vector in zip(ids, vectors):
+        doc, score = numpy_store.similarity_search_with_score_by_vector(vector, k=1)[0]
+        assert doc.id == chunk_id and doc.page_content == f"text {chunk_id}"
+        assert score > 0.99
+
+    # Replacing an id moves it to a new row and the old row stops matching
+    numpy_store.upsert(["c0"], [vectors[1]], [{"n": 0}], ["text c0 replaced"])
+    assert numpy_store.stats()["live"] == 50
+    assert {doc.id for doc in numpy_store.similarity_search_by_vector(vectors[0], k=50)} == set(ids)
+    assert {doc.id for doc in numpy_store.similarity_search_by_vector(vectors[1], k=2)} == {"c0", "c1"}
+
+def test_compaction_keeps_ids_on_their_vectors(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "vectors"), HashEmbeddings(), "float16")
+    ids, vectors = fill(store, 40)
+    store.delete(ids=ids[:20:2])
+    assert store.generation == 0
+    store.delete(ids=ids[1:20:2])
+    # Half the rows were dead, so the matrix was rewritten with only the live ones
+    assert store.generation == 1 and store.stats()["rows"] == 20
+    assert sorted(name for name in tmp_path.joinpath("vectors").iterdir() if name.suffix == ".bin") == \
+        [tmp_path / "vectors" / "scales.1.bin", tmp_path / "vectors" / "vectors.1.bin"]
+    for chunk_id, vector in list(zip(ids, vectors))[20:]:
+        assert store.similarity_search_by_vector(vector, k=1)[0].id == chunk_id
+    assert store.similarity_search_by_vector(vectors[0], k=1)[0].id not in ids[:20]
+    store.close()
+
+    reopened = NumpyVectorStore(str(tmp_path / "vectors"), HashEmbeddings())
+    assert reopened.similarity_search_by_vector(vectors[25], k=1)[0].id == "c25"
+    reopened.close()
+
+def test_search_spanning_a_compaction_maps_rows_of_the_new_generation(numpy_store, monkeypatch):
+    ids, vectors = fill(numpy_store, 20)
+    search = numpy_store._search
+    calls = []
+
+    def search_then_compact(queries, k):
+        result = search(queries, k)
+        if not calls:
+            # Another thread compacts between the matrix scan and the row lookup
+            numpy_store.delete(ids=ids[:10])
+        calls.append(result[0])
+        return result
+
+    monkeypatch.setattr(numpy_store, "_search", search_then_compact)
+    assert numpy_store.similarity_search_by_vector(vectors[15], k=1)[0].id == "c15"
+    assert calls == [0, 1]
+
+def test_int8_recall_matches_float32(tmp_path):
+    vectors = np.asarray(random_vectors(500, dim=64, seed=1), dtype=np.float32)
+    queries = np.asarray(random_vectors(50, dim=64, seed=2), dtype=np.float32)
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :10]
+    store = NumpyVectorStore(str(tmp_path / "int8"), HashEmbeddings(), "int8")
+    store.upsert([str(i) for i in range(500)], vectors.tolist(), [{}] * 500, [""] * 500)
+    assert store.stats()["dtype"] == "int8"
+    found = [[row for row, _ in hits] for hits in store.search_vectors(queries, k=10)]
+    recall = np.mean([len(set(f) & set(e)) / 10 for f, e in zip(found, exact.tolist())])
+    assert recall >= 0.95
+    store.close()
+
+def test_ivf_search_matches_brute_force(tmp_path, monkeypatch):
+    vectors = random_vectors(2000, dim=16, seed=3)
+    queries = random_vectors(20, dim=16, seed=4)
+    brute = NumpyVectorStore(str(tmp_path / "brute"), HashEmbeddings(), "float16")
+    brute.upsert([str(i) for i in range(2000)], vectors, [{}] * 2000, [""] * 2000)
+    exact = brute.search_vectors(queries, k=5)
+    brute.close()
+
+    monkeypatch.setattr(core.vectorstore, "IVF_MIN_ROWS", 1000)
+    store = NumpyVectorStore(str(tmp_path / "ivf"), HashEmbeddings(), "float16")
+    store.upsert([str(i) for i in range(2000)], vectors, [{}] * 2000, [""] * 2000)
+    assert store.build_ivf()
+    lists = store.stats()["ivf_lists"]
+    # Probing every list is exhaustive, so the results are exactly the brute-force ones
+    monkeypatch.setattr(core.vectorstore, "IVF_PROBES", lists)
+    assert [[row for row, _ in hits] for hits in store.search_vectors(queries, k=5)] == \
+        [[row for row, _ in hits] for hits in exact]
+    # A few probes still find most neighbours
+    monkeypatch.setattr(core.vectorstore, "IVF_PROBES", max(lists // 4, 1))
+    found = store.search_vectors(queries, k=5)
+    recall = np.mean([len({r for r, _ in f} & {r for r, _ in e}) / 5 for f, e in zip(found, exact)])
+    assert recall >= 0.6
+    # Rows added after training are scanned exhaustively
+    store.upsert(["new"], [queries[0]], [{}], ["added later"])
+    assert store.similarity_search_by_vector(queries[0], k=1)[0].id == "new"
+    store.close()
@@ -0,0 +1,44 @@
+import hashlib
+import os
+import core.workspaces
+from core.workspaces import SessionSpill, WorkspaceRegistry
+
+def test_spilled_values_come_back(tmp_path):
+    spill = SessionSpill("session", budget_mb=0.01, directory=str(tmp_path))
+    first, second = "a" * 8000, "b" * 8000
+    spill.put("first", first)
+    spill.put("second", second)
+    assert spill.spills == 1
+    assert spill.get("first") == first
+
+def test_pop_loads_a_spilled_value_and_removes_its_file(tmp_path):
+    spill = SessionSpill("session", budget_mb=0.01, directory=str(tmp_path))
+    spill.put("first", "a" * 8000)
+    spill.put("second", "b" * 8000)
+    path = spill._path("first")
+    assert os.path.exists(path)
+    assert spill.pop("first") == "a" * 8000
+    assert not os.path.exists(path)
+    assert spill.keys() == ["second"]
+
+def test_spill_files_are_named_by_a_stable_key_digest(tmp_path):
+    spill = SessionSpill("session", directory=str(tmp_path))
+    assert os.path.basename(spill._path("df:sales.csv")) == hashlib.sha256(b"df:sales.csv").hexdigest() + ".pkl"
+    assert spill._path("df:sales.csv") != spill._path("df:sales.csv ")
+
+def test_registry_drops_the_least_recently_used_and_idle_workspaces(monkeypatch):
+    released = []
+    monkeypatch.setattr(core.workspaces, "release_store", released.append)
+    registry = WorkspaceRegistry(max_open=2, idle_seconds=60)
+    registry.touch("a")
+    registry.touch("b")
+    with registry.pin("c"):
+        # Three open, "a" was used least recently
+        assert released == ["a"]
+        registry._last_used["c"] -= 120
+        registry.touch("b")
+        # "c" is idle but still being written to
+        assert released == ["a"]
+    registry._last_used["c"] -= 120
+    assert registry.touch("b") == ["c"]
+    assert released == ["a", "c"] and registry.stats()["open"] == 1 and registry.evictions == 2
@@ -1,5 +1,14 @@
 import os
+import sys
+import json
+import time
+import uuid
 import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
 
 # Configure logging
 logging.basicConfig(
@@ -15,3 +24,222 @@ def setup_logging():
     """Setup logging configuration"""
     logger = logging.getLogger(__name__)
     return logger
+
+def get_rss_mb() -> float:
+    """Current resident set size of this process in MB.
+    Without /proc this is the lifetime peak instead, so PeakRssTracker deltas mean nothing there"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        # No /proc (macOS, Windows): fall back to the lifetime peak
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, KB elsewhere
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class PeakRssTracker:
+    """Track the peak RSS seen while an ingestion runs"""
+
+    def __init__(self):
+        self.start = get_rss_mb()
+        self.current = self.start
+        self.peak = self.start
+
+    def sample(self) -> float:
+        self.current = get_rss_mb()
+        self.peak = max(self.peak, self.current)
+        return self.current
+
+    def summary(self) -> str:
+        self.sample()
+        return f"peak RSS {self.peak:.0f} MB (+{self.peak - self.start:.0f} MB during ingestion)"
+
+# Latency metrics and per-request traces, exported as Prometheus text or JSON
+METRICS_PORT = int(os.getenv("CHATDOC_METRICS_PORT", "0"))  # 0 disables the /metrics endpoint
+METRICS_HOST = os.getenv("CHATDOC_METRICS_HOST", "127.0.0.1")  # 0.0.0.0 exposes it on every interface
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RESERVOIR_SIZE = 1000
+trace_logger = logging.getLogger("chatdoc.trace")
+
+class LatencyHistogram:
+    """Cumulative buckets for Prometheus plus recent samples for p50/p95"""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+class MetricsRegistry:
+    """Latency histograms keyed by metric name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram()
+            self._histograms[key].observe(seconds)
+
+    def snapshot(self) -> list:
+        """count, mean, p50 and p95 in milliseconds for every series"""
+        with self._lock:
+            return [
+                {
+                    "metric": name,
+                    **dict(labels),
+                    "count": h.count,
+                    "mean_ms": round(h.sum / h.count * 1000, 2) if h.count else 0.0,
+                    "p50_ms": round(h.quantile(0.5) * 1000, 2),
+                    "p95_ms": round(h.quantile(0.95) * 1000, 2)
+                }
+                for (name, labels), h in sorted(self._histograms.items())
+            ]
+
+    def prometheus_text(self) -> str:
+        """Prometheus text exposition of all histograms"""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series, labels), h in sorted(self._histograms.items()):
+                    if series != name:
+                        continue
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    prefix = f"{label_text}," if label_text else ""
+                    for bound, count in zip(LATENCY_BUCKETS, h.buckets):
+                        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {h.count}')
+                    lines.append(f"{name}_sum{{{label_text}}} {h.sum:.6f}")
+                    lines.append(f"{name}_count{{{label_text}}} {h.count}")
+        return "\n".join(lines) + "\n"
+
+_metrics = MetricsRegistry()
+
+def get_metrics() -> MetricsRegistry:
+    """Process-wide metrics registry"""
+    return _metrics
+
+class Trace:
+    """Named stage durations of one request, logged as a single JSON line when it ends"""
+
+    def __init__(self, pipeline: str, **attributes):
+        self.pipeline = pipeline
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.attributes = attributes
+        self.spans = {}
+        self.start = time.perf_counter()
+
+    def record(self, stage: str, seconds: float):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+        _metrics.observe("chatdoc_stage_seconds", seconds, pipeline=self.pipeline, stage=stage)
+
+    def finish(self, error: Optional[BaseException] = None):
+        total = time.perf_counter() - self.start
+        _metrics.observe("chatdoc_request_seconds", total, pipeline=self.pipeline)
+        trace_logger.info(json.dumps({
+            "trace": self.pipeline,
+            "trace_id": self.trace_id,
+            "total_ms": round(total * 1000, 2),
+            "spans_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.spans.items()},
+            **({"error": type(error).__name__} if error else {}),
+            **self.attributes
+        }, default=str))
+
+_current_trace: ContextVar = ContextVar("chatdoc_trace", default=None)
+
+@contextmanager
+def trace(pipeline: str, **attributes):
+    """Start a request trace; spans recorded in this context belong to it"""
+    current = Trace(pipeline, **attributes)
+    token = _current_trace.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_trace.reset(token)
+        current.finish(error)
+
+def record_span(stage: str, seconds: float, trace_obj: Optional[Trace] = None):
+    """Add a stage duration to the given or current trace, or to the untraced metrics"""
+    current = trace_obj or _current_trace.get()
+    if current is not None:
+        current.record(stage, seconds)
+    else:
+        _metrics.observe("chatdoc_stage_seconds", seconds, pipeline="untraced", stage=stage)
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+@contextmanager
+def span(stage: str):
+    """Time a block as one stage of the current trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """Serve /metrics (Prometheus) and /metrics.json on a daemon thread, once per process"""
+    global _metrics_server
+    if port <= 0:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is not None:
+            return _metrics_server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = _metrics.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(_metrics.snapshot()).encode("utf-8"), "application/json"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            # Another Streamlit process already serves this port
+            logging.getLogger(__name__).warning(f"Metrics endpoint not started on {host}:{port}: {str(e)}")
+            return None
+        _metrics_server.daemon_threads = True
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+        logging.getLogger(__name__).info(f"Serving metrics on {host}:{port}/metrics")
+        return _metrics_server